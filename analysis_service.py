@@ -2,11 +2,22 @@
 خدمات التحليل الفني والنصائح
 Technical Analysis and Recommendations Service
 """
+import bisect
 import requests
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from functools import lru_cache
 from typing import Optional, Dict, List
+import threading
 import time
 
+import numpy as np
+
+import indicators
+from corporate_actions import corporate_actions
+from indicator_state import EXTREME_WINDOWS, MA_PERIODS
+from ohlcv_store import ohlcv_store
+from rate_limiter import yahoo_rate_limiter
+
 
 class TechnicalAnalysis:
     """التحليل الفني للأسهم"""
@@ -15,16 +26,72 @@ class TechnicalAnalysis:
         "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36",
     }
 
+    # Cache للبيانات التاريخية: (الرمز، الفترة) -> (وقت الجلب، البيانات)
+    _history_cache = {}
+    _history_lock = threading.Lock()
+    HISTORY_CACHE_DURATION = 300  # 5 دقائق
+
+    # عدد الأيام التقريبي لكل فترة (لاشتقاق فترة قصيرة من فترة أطول مخزنة)
+    PERIOD_DAYS = {"5d": 5, "1mo": 31, "3mo": 92, "6mo": 183, "1y": 366, "2y": 731, "5y": 1827}
+
+    @classmethod
+    def _get_cached_history(cls, code: str, period: str) -> Optional[Dict]:
+        """البحث في الكاش عن الفترة المطلوبة أو فترة أطول تغطيها"""
+        now = time.monotonic()
+        wanted_days = cls.PERIOD_DAYS.get(period)
+
+        with cls._history_lock:
+            entry = cls._history_cache.get((code, period))
+            if entry and now - entry[0] < cls.HISTORY_CACHE_DURATION:
+                return entry[1]
+
+            if wanted_days is None:
+                return None
+
+            for (cached_code, cached_period), (fetched_at, data) in cls._history_cache.items():
+                if cached_code != code or now - fetched_at >= cls.HISTORY_CACHE_DURATION:
+                    continue
+                if cls.PERIOD_DAYS.get(cached_period, 0) > wanted_days:
+                    return cls._slice_history(data, wanted_days)
+
+        return None
+
     @staticmethod
-    def get_historical_data(symbol: str, period: str = "1mo") -> Optional[Dict]:
-        """جلب البيانات التاريخية للسهم"""
-        code = symbol.strip().replace(".SR", "")
+    def _slice_history(data: Dict, days: int) -> Dict:
+        """اقتطاع آخر N يوم من البيانات التاريخية"""
+        timestamps = data.get("timestamps") or []
+        if not timestamps:
+            return data
+
+        cutoff = timestamps[-1] - days * 86400
+        start = 0
+        while start < len(timestamps) and timestamps[start] < cutoff:
+            start += 1
+
+        sliced = {"symbol": data.get("symbol"), "timestamps": timestamps[start:]}
+        for key in ("open", "high", "low", "close", "volume"):
+            sliced[key] = (data.get(key) or [])[start:]
+        return sliced
+
+    @classmethod
+    def clear_history_cache(cls):
+        """مسح كاش البيانات التاريخية"""
+        with cls._history_lock:
+            cls._history_cache = {}
 
+    @staticmethod
+    def _fetch_chart(code: str, query: str) -> Optional[Dict]:
+        """طلب شموع يومية من Yahoo Finance
+        query: نطاق الطلب مثل "range=6mo" أو "period1=...&period2=..."
+        """
         try:
-            url = f"https://query1.finance.yahoo.com/v8/finance/chart/{code}.SR?interval=1d&range={period}"
+            url = f"https://query1.finance.yahoo.com/v8/finance/chart/{code}.SR?interval=1d&{query}"
+            yahoo_rate_limiter.acquire()
             response = requests.get(url, headers=TechnicalAnalysis.HEADERS, timeout=15)
 
-            if response.status_code == 200:
+            if response.status_code == 429:
+                yahoo_rate_limiter.backoff(2)
+            elif response.status_code == 200:
                 data = response.json()
                 if "chart" in data and data["chart"]["result"]:
                     result = data["chart"]["result"][0]
@@ -46,39 +113,141 @@ class TechnicalAnalysis:
 
         return None
 
+    @staticmethod
+    def get_historical_data(symbol: str, period: str = "1mo") -> Optional[Dict]:
+        """جلب البيانات التاريخية للسهم
+
+        الفترات المعروفة تُخدم من المخزن المحلي (ohlcv_store) ولا يُطلب من
+        Yahoo إلا الشموع الجديدة منذ آخر شمعة مخزنة. عند تعذر الاتصال تُرجع
+        البيانات المخزنة كما هي.
+        """
+        code = symbol.strip().replace(".SR", "")
+
+        cached = TechnicalAnalysis._get_cached_history(code, period)
+        if cached:
+            return cached
+
+        days = TechnicalAnalysis.PERIOD_DAYS.get(period)
+        if days is None:
+            history = TechnicalAnalysis._fetch_chart(code, f"range={period}")
+        else:
+            now = int(time.time())
+            start_ts = now - days * 86400
+
+            if ohlcv_store.covers(code, start_ts):
+                stored = ohlcv_store.load(code)
+                if now - stored["fetched_at"] >= TechnicalAnalysis.HISTORY_CACHE_DURATION:
+                    # جلب الشموع الناقصة فقط (من آخر شمعة مخزنة)
+                    last_ts = int(stored["timestamps"][-1])
+                    tail = TechnicalAnalysis._fetch_chart(code, f"period1={last_ts}&period2={now}")
+                    if tail and tail["timestamps"]:
+                        ohlcv_store.merge(code, tail)
+                    else:
+                        # لا شموع جديدة (أو تعذر الطلب): لا إعادة طلب قبل مرور المدة
+                        ohlcv_store.touch(code)
+            else:
+                full = TechnicalAnalysis._fetch_chart(code, f"range={period}")
+                if full and full["timestamps"]:
+                    ohlcv_store.merge(code, full, coverage_start=start_ts)
+
+            history = ohlcv_store.get_range(code, start_ts)
+
+        if history:
+            with TechnicalAnalysis._history_lock:
+                TechnicalAnalysis._history_cache[(code, period)] = (time.monotonic(), history)
+
+        return history
+
+    @staticmethod
+    def resample_history(data: Dict, period: str, bars: Dict = None) -> Dict:
+        """الشموع الأسبوعية أو الشهرية (تقويمية) المشتقة من البيانات اليومية
+
+        إذا كانت البيانات مأخوذة من المخزن المحلي (نفس آخر شمعة) يُستخدم
+        التجميع المحفوظ للسهم بدلاً من إعادة حسابه في كل طلب.
+        """
+        if bars is None:
+            bars = indicators.to_arrays(data)
+
+        code = (data or {}).get("symbol")
+        timestamps = bars["timestamps"]
+        if code and len(timestamps):
+            stored = ohlcv_store.load(code)
+            if (stored is not None and len(stored["timestamps"])
+                    and int(stored["timestamps"][-1]) == int(timestamps[-1])):
+                resampled = ohlcv_store.get_resampled(code, period, int(timestamps[0]))
+                if resampled is not None:
+                    return resampled
+
+        return indicators.resample(bars, period)
+
+    @staticmethod
+    def get_streaming_indicators(data: Dict, bars: Dict = None,
+                                 price: float = None) -> Optional[Dict]:
+        """قيم المؤشرات من الحالة المتزايدة في المخزن المحلي
+
+        الحالة تغطي كامل السلسلة المخزنة. إذا كانت البيانات جزءاً أخيراً منها
+        (مثل فترة 6mo من مخزن سنة) تُرجع فقط المؤشرات التي لا تعتمد على بداية
+        النافذة: SMA والقمم والقيعان التي تتسع لها البيانات. EMA ومتوسط الكمية
+        يعتمدان على كل التاريخ فلا يُرجعان إلا إذا كانت البيانات هي كامل السلسلة
+        (full_window). None إذا لم تكن البيانات من المخزن.
+        price: سعر لحظي للشمعة الحالية (اختياري)
+        """
+        code = (data or {}).get("symbol")
+        if not code:
+            return None
+        if bars is None:
+            bars = indicators.to_arrays(data)
+        timestamps = bars["timestamps"]
+        if not len(timestamps):
+            return None
+
+        values = ohlcv_store.get_indicators(code, price=price)
+        if values is None or values["last_ts"] != int(timestamps[-1]):
+            return None
+
+        count = len(timestamps)
+        if values["first_ts"] == int(timestamps[0]) and values["bars"] == count:
+            values["full_window"] = True
+            return values
+
+        # البيانات يجب أن تكون نهاية السلسلة المخزنة نفسها (نفس الشموع من أول شمعة فيها)
+        if ohlcv_store.bars_since(code, int(timestamps[0])) != count:
+            return None
+
+        partial = {"last_ts": values["last_ts"], "full_window": False}
+        for period in MA_PERIODS:
+            if count >= period:
+                partial[f"sma_{period}"] = values[f"sma_{period}"]
+        for window in EXTREME_WINDOWS:
+            if count >= window:
+                partial[f"high_{window}"] = values[f"high_{window}"]
+                partial[f"low_{window}"] = values[f"low_{window}"]
+        return partial
+
     @staticmethod
     def calculate_support_resistance(data: Dict) -> Dict:
         """حساب مستويات الدعم والمقاومة"""
         if not data or not data.get("high") or not data.get("low"):
             return {"support": [], "resistance": []}
 
-        highs = [h for h in data["high"] if h is not None]
-        lows = [l for l in data["low"] if l is not None]
-        closes = [c for c in data["close"] if c is not None]
+        bars = indicators.to_arrays(data)
+        highs, lows, closes = bars["high"], bars["low"], bars["close"]
 
-        if not highs or not lows or not closes:
+        if not len(closes):
             return {"support": [], "resistance": []}
 
-        current_price = closes[-1] if closes else 0
+        current_price = float(closes[-1])
 
-        # حساب المقاومات (أعلى سعر)
-        max_high = max(highs)
-        avg_high = sum(highs) / len(highs)
-        recent_highs = highs[-10:] if len(highs) >= 10 else highs
-        recent_max = max(recent_highs)
-
-        # حساب الدعوم (أدنى سعر)
-        min_low = min(lows)
-        avg_low = sum(lows) / len(lows)
-        recent_lows = lows[-10:] if len(lows) >= 10 else lows
-        recent_min = min(recent_lows)
+        # حساب المقاومات (أعلى سعر) والدعوم (أدنى سعر)
+        recent_max = float(highs[-10:].max())
+        recent_min = float(lows[-10:].min())
 
         # Pivot Points
-        pivot = (max_high + min_low + closes[-1]) / 3
-        r1 = (2 * pivot) - min_low
-        r2 = pivot + (max_high - min_low)
-        s1 = (2 * pivot) - max_high
-        s2 = pivot - (max_high - min_low)
+        points = indicators.pivots(highs, lows, closes)
+        max_high, min_low = float(points["max_high"]), float(points["min_low"])
+        pivot = float(points["pivot"])
+        r1, r2 = float(points["r1"]), float(points["r2"])
+        s1, s2 = float(points["s1"]), float(points["s2"])
 
         resistance_levels = sorted(set([
             round(recent_max, 2),
@@ -111,14 +280,14 @@ class TechnicalAnalysis:
         if not data or not data.get("volume"):
             return {"avg_volume": 0, "current_volume": 0, "volume_trend": "neutral"}
 
-        volumes = [v for v in data["volume"] if v is not None and v > 0]
+        stats = indicators.volume_stats(indicators.to_arrays(data)["volume"])
 
-        if not volumes:
+        if not stats["count"]:
             return {"avg_volume": 0, "current_volume": 0, "volume_trend": "neutral"}
 
-        avg_volume = sum(volumes) / len(volumes)
-        current_volume = volumes[-1] if volumes else 0
-        recent_avg = sum(volumes[-5:]) / len(volumes[-5:]) if len(volumes) >= 5 else avg_volume
+        avg_volume = float(stats["avg"])
+        current_volume = float(stats["current"])
+        recent_avg = float(stats["recent_avg"])
 
         # تحديد اتجاه الكميات
         if current_volume > avg_volume * 1.5:
@@ -135,14 +304,18 @@ class TechnicalAnalysis:
             "current_volume": int(current_volume),
             "recent_avg": int(recent_avg),
             "volume_trend": volume_trend,
-            "volume_ratio": round(current_volume / avg_volume, 2) if avg_volume > 0 else 0
+            "volume_ratio": round(float(stats["ratio"]), 2)
         }
 
     @staticmethod
-    def get_recommendation(symbol: str, current_price: float = None, shares: int = 0) -> Dict:
-        """الحصول على توصية للسهم"""
+    def get_recommendation(symbol: str, current_price: float = None, shares: int = 0,
+                           data: Dict = None) -> Dict:
+        """الحصول على توصية للسهم
+        data: بيانات تاريخية جاهزة (إن لم تمرر تُجلب بيانات 3 أشهر)
+        """
         # جلب البيانات التاريخية
-        data = TechnicalAnalysis.get_historical_data(symbol, "3mo")
+        if data is None:
+            data = TechnicalAnalysis.get_historical_data(symbol, "3mo")
 
         if not data:
             return {
@@ -234,6 +407,471 @@ class TechnicalAnalysis:
         }
 
 
+# ==================== مستويات التداول والمؤشرات المركبة ====================
+
+def calculate_trading_levels(current_price, avg_cost, moving_averages, levels, supply_demand, price_action):
+    """
+    حساب مستويات البيع والشراء المقترحة مع النسب من متوسط التكلفة
+    بناءً على المتوسطات المتحركة والبرايس أكشن ومناطق العرض والطلب
+    """
+    buy_levels = []
+    sell_levels = []
+
+    if not current_price or current_price <= 0:
+        return {'buy_levels': [], 'sell_levels': [], 'recommendation': 'غير متوفر'}
+
+    # حساب النسبة من متوسط التكلفة
+    def calc_percent_from_avg(price):
+        if avg_cost and avg_cost > 0:
+            return round(((price - avg_cost) / avg_cost) * 100, 2)
+        return 0
+
+    # ========== مستويات الشراء (أسفل السعر الحالي) ==========
+
+    # 1. من مناطق الطلب (Demand Zones)
+    daily_demand = supply_demand.get('daily', {}).get('demand', [])
+    weekly_demand = supply_demand.get('weekly', {}).get('demand', [])
+
+    for zone in daily_demand[:2]:
+        zone_price = zone.get('high', 0)
+        if zone_price < current_price:
+            buy_levels.append({
+                'price': zone_price,
+                'percent_from_current': round(((zone_price - current_price) / current_price) * 100, 2),
+                'percent_from_avg': calc_percent_from_avg(zone_price),
+                'source': 'منطقة طلب يومية',
+                'strength': zone.get('strength', 'moderate'),
+                'reason': 'منطقة شراء قوية - ارتداد متوقع'
+            })
+
+    for zone in weekly_demand[:1]:
+        zone_price = zone.get('high', 0)
+        if zone_price < current_price:
+            buy_levels.append({
+                'price': zone_price,
+                'percent_from_current': round(((zone_price - current_price) / current_price) * 100, 2),
+                'percent_from_avg': calc_percent_from_avg(zone_price),
+                'source': 'منطقة طلب أسبوعية',
+                'strength': 'strong',
+                'reason': 'منطقة شراء أسبوعية - دعم قوي'
+            })
+
+    # 2. من مستويات الدعم
+    supports = levels.get('support', [])
+    for i, support in enumerate(supports[:3]):
+        if support < current_price:
+            buy_levels.append({
+                'price': round(support, 2),
+                'percent_from_current': round(((support - current_price) / current_price) * 100, 2),
+                'percent_from_avg': calc_percent_from_avg(support),
+                'source': f'دعم {i+1}',
+                'strength': 'strong' if i == 0 else 'moderate',
+                'reason': f'مستوى دعم {"رئيسي" if i == 0 else "ثانوي"}'
+            })
+
+    # 3. من المتوسطات المتحركة (أقل من السعر الحالي)
+    daily_mas = moving_averages.get('daily', {})
+    ma_buy_sources = [
+        ('sma_50', 'متوسط 50 يوم', 'strong'),
+        ('sma_200', 'متوسط 200 يوم', 'strong'),
+        ('ema_20', 'متوسط أسي 20', 'moderate'),
+    ]
+
+    for ma_key, ma_name, strength in ma_buy_sources:
+        ma_value = daily_mas.get(ma_key)
+        if ma_value and ma_value < current_price:
+            buy_levels.append({
+                'price': ma_value,
+                'percent_from_current': round(((ma_value - current_price) / current_price) * 100, 2),
+                'percent_from_avg': calc_percent_from_avg(ma_value),
+                'source': ma_name,
+                'strength': strength,
+                'reason': f'شراء عند {ma_name} - دعم متحرك'
+            })
+
+    # ========== مستويات البيع (أعلى السعر الحالي) ==========
+
+    # 1. من مناطق العرض (Supply Zones)
+    daily_supply = supply_demand.get('daily', {}).get('supply', [])
+    weekly_supply = supply_demand.get('weekly', {}).get('supply', [])
+
+    for zone in daily_supply[:2]:
+        zone_price = zone.get('low', 0)
+        if zone_price > current_price:
+            sell_levels.append({
+                'price': zone_price,
+                'percent_from_current': round(((zone_price - current_price) / current_price) * 100, 2),
+                'percent_from_avg': calc_percent_from_avg(zone_price),
+                'source': 'منطقة عرض يومية',
+                'strength': zone.get('strength', 'moderate'),
+                'reason': 'منطقة بيع - مقاومة متوقعة'
+            })
+
+    for zone in weekly_supply[:1]:
+        zone_price = zone.get('low', 0)
+        if zone_price > current_price:
+            sell_levels.append({
+                'price': zone_price,
+                'percent_from_current': round(((zone_price - current_price) / current_price) * 100, 2),
+                'percent_from_avg': calc_percent_from_avg(zone_price),
+                'source': 'منطقة عرض أسبوعية',
+                'strength': 'strong',
+                'reason': 'منطقة بيع أسبوعية - مقاومة قوية'
+            })
+
+    # 2. من مستويات المقاومة
+    resistances = levels.get('resistance', [])
+    for i, resistance in enumerate(resistances[:3]):
+        if resistance > current_price:
+            sell_levels.append({
+                'price': round(resistance, 2),
+                'percent_from_current': round(((resistance - current_price) / current_price) * 100, 2),
+                'percent_from_avg': calc_percent_from_avg(resistance),
+                'source': f'مقاومة {i+1}',
+                'strength': 'strong' if i == 0 else 'moderate',
+                'reason': f'مستوى مقاومة {"رئيسي" if i == 0 else "ثانوي"}'
+            })
+
+    # 3. من المتوسطات المتحركة (أعلى من السعر الحالي)
+    for ma_key, ma_name, strength in ma_buy_sources:
+        ma_value = daily_mas.get(ma_key)
+        if ma_value and ma_value > current_price:
+            sell_levels.append({
+                'price': ma_value,
+                'percent_from_current': round(((ma_value - current_price) / current_price) * 100, 2),
+                'percent_from_avg': calc_percent_from_avg(ma_value),
+                'source': ma_name,
+                'strength': strength,
+                'reason': f'مقاومة عند {ma_name}'
+            })
+
+    # 4. أهداف ربح بناءً على متوسط التكلفة
+    if avg_cost and avg_cost > 0:
+        profit_targets = [
+            (5, 'هدف ربح 5%', 'moderate'),
+            (10, 'هدف ربح 10%', 'moderate'),
+            (15, 'هدف ربح 15%', 'strong'),
+            (20, 'هدف ربح 20%', 'strong'),
+        ]
+
+        for percent, name, strength in profit_targets:
+            target_price = round(avg_cost * (1 + percent / 100), 2)
+            if target_price > current_price:
+                sell_levels.append({
+                    'price': target_price,
+                    'percent_from_current': round(((target_price - current_price) / current_price) * 100, 2),
+                    'percent_from_avg': percent,
+                    'source': name,
+                    'strength': strength,
+                    'reason': f'جني أرباح عند {percent}% من متوسط التكلفة'
+                })
+
+    # ترتيب المستويات
+    buy_levels.sort(key=lambda x: x['price'], reverse=True)  # الأقرب للسعر أولاً
+    sell_levels.sort(key=lambda x: x['price'])  # الأقرب للسعر أولاً
+
+    # إزالة المكرر وأخذ أفضل 5
+    def remove_duplicates(levels_list):
+        seen_prices = set()
+        unique = []
+        for level in levels_list:
+            price_key = round(level['price'], 1)
+            if price_key not in seen_prices:
+                seen_prices.add(price_key)
+                unique.append(level)
+        return unique[:5]
+
+    buy_levels = remove_duplicates(buy_levels)
+    sell_levels = remove_duplicates(sell_levels)
+
+    # ========== التوصية النهائية ==========
+    trend = price_action.get('trend', 'neutral')
+    signals = price_action.get('signals', [])
+
+    # حساب التوصية بناءً على المؤشرات
+    buy_signals = sum(1 for s in signals if s.get('signal') == 'شراء')
+    sell_signals = sum(1 for s in signals if s.get('signal') == 'بيع')
+
+    # موقع السعر من متوسط التكلفة
+    price_vs_avg = calc_percent_from_avg(current_price)
+
+    # موقع السعر من المتوسطات
+    sma_20 = daily_mas.get('sma_20', current_price)
+    sma_50 = daily_mas.get('sma_50', current_price)
+
+    recommendation = 'انتظار'
+    recommendation_reason = []
+
+    if trend == 'bullish':
+        recommendation_reason.append('الاتجاه صاعد')
+    elif trend == 'bearish':
+        recommendation_reason.append('الاتجاه هابط')
+
+    if price_vs_avg < -10:
+        recommendation = 'تعزيز'
+        recommendation_reason.append(f'السعر أقل من المتوسط بـ {abs(price_vs_avg):.1f}%')
+    elif price_vs_avg > 15:
+        recommendation = 'جني أرباح جزئي'
+        recommendation_reason.append(f'ربح {price_vs_avg:.1f}% من المتوسط')
+    elif current_price < sma_20 and current_price < sma_50 and trend == 'bearish':
+        recommendation = 'انتظار أو تخفيف'
+        recommendation_reason.append('السعر تحت المتوسطات')
+    elif current_price > sma_20 and trend == 'bullish':
+        recommendation = 'احتفاظ'
+        recommendation_reason.append('السعر فوق المتوسطات')
+
+    if buy_signals > sell_signals:
+        if recommendation == 'انتظار':
+            recommendation = 'شراء محتمل'
+        recommendation_reason.append(f'{buy_signals} إشارة شراء')
+    elif sell_signals > buy_signals:
+        if recommendation == 'انتظار':
+            recommendation = 'بيع محتمل'
+        recommendation_reason.append(f'{sell_signals} إشارة بيع')
+
+    return {
+        'buy_levels': buy_levels,
+        'sell_levels': sell_levels,
+        'recommendation': recommendation,
+        'recommendation_reason': ' | '.join(recommendation_reason) if recommendation_reason else 'لا توجد إشارات واضحة',
+        'current_vs_avg': {
+            'percent': price_vs_avg,
+            'status': 'ربح' if price_vs_avg > 0 else 'خسارة' if price_vs_avg < 0 else 'تعادل'
+        }
+    }
+
+
+def calculate_moving_averages_from_data(data):
+    """حساب المتوسطات المتحركة من البيانات التاريخية"""
+    return calculate_moving_averages_batch([data])[0]
+
+
+DAILY_MA_PERIODS = [10, 20, 50, 200]
+
+
+def calculate_moving_averages_batch(histories):
+    """حساب المتوسطات المتحركة لعدة أسهم في استدعاء متجه واحد
+
+    المتوسطات اليومية تؤخذ من حالة المؤشرات المتزايدة في المخزن المحلي
+    إذا توفرت، ولا يُعاد حسابها من التاريخ إلا للأسهم الأخرى.
+    """
+    bars_list = [indicators.to_arrays(h) for h in histories]
+    closes = [bars['close'] for bars in bars_list]
+    results = [{'daily': {}, 'weekly': {}, 'monthly': {}} for _ in histories]
+
+    daily_rows = []
+    ema_rows = []  # أسهم أُخذت متوسطاتها البسيطة من الحالة ونافذتها جزء من السلسلة
+    for row, history in enumerate(histories):
+        streaming = TechnicalAnalysis.get_streaming_indicators(history, bars_list[row])
+        if streaming is None:
+            daily_rows.append(row)
+            continue
+        if not streaming['full_window']:
+            ema_rows.append(row)
+        for period in DAILY_MA_PERIODS:
+            if streaming.get(f'sma_{period}') is not None:
+                results[row]['daily'][f'sma_{period}'] = round(streaming[f'sma_{period}'], 2)
+            if streaming.get(f'ema_{period}'):
+                results[row]['daily'][f'ema_{period}'] = round(streaming[f'ema_{period}'], 2)
+
+    # إغلاقات الأسابيع (أحد - خميس) والأشهر التقويمية
+    weekly_closes = [TechnicalAnalysis.resample_history(h, 'weekly', bars)['close']
+                     for h, bars in zip(histories, bars_list)]
+    monthly_closes = [TechnicalAnalysis.resample_history(h, 'monthly', bars)['close']
+                      for h, bars in zip(histories, bars_list)]
+
+    all_rows = list(range(len(histories)))
+    frames = [
+        ('daily', daily_rows, indicators.stack([closes[r] for r in daily_rows]), DAILY_MA_PERIODS, True),
+        ('daily', ema_rows, indicators.stack([closes[r] for r in ema_rows]), DAILY_MA_PERIODS, False),
+        ('weekly', all_rows, indicators.stack(weekly_closes), [10, 20, 50], True),
+        ('monthly', all_rows, indicators.stack(monthly_closes), [10, 20], True),
+    ]
+
+    for frame, rows, matrix, periods, with_sma in frames:
+        if not rows:
+            continue
+        for period in periods:
+            smas = indicators.sma_last(matrix, period) if with_sma else None
+            emas = indicators.ema_last(matrix, period)
+            for i, row in enumerate(rows):
+                if with_sma and not np.isnan(smas[i]):
+                    results[row][frame][f'sma_{period}'] = round(float(smas[i]), 2)
+                if not np.isnan(emas[i]) and emas[i]:
+                    results[row][frame][f'ema_{period}'] = round(float(emas[i]), 2)
+
+    return results
+
+
+# عدد الشموع التي يُبحث فيها عن المناطق لكل إطار زمني
+# (الفحص خطي في عدد الشموع، لذلك يمكن رفعها لتغطية سنوات من البيانات)
+SUPPLY_DEMAND_LOOKBACK = {'daily': 50, 'weekly': 20, 'monthly': 10}
+
+
+def calculate_supply_demand_zones(data, lookback=None):
+    """حساب مناطق العرض والطلب (Supply & Demand Zones)
+
+    lookback: قاموس اختياري بعدد الشموع لكل إطار زمني
+    (مثلاً {'daily': 500} لفحص سنتين من البيانات اليومية)
+    """
+    if not data or not data.get('high') or not data.get('low') or not data.get('close') or not data.get('open'):
+        return {'daily': {}, 'weekly': {}, 'monthly': {}}
+
+    bars = indicators.to_arrays(data)
+
+    if len(bars['close']) < 20:
+        return {'daily': {}, 'weekly': {}, 'monthly': {}}
+
+    current_price = float(bars['close'][-1])
+    lookback = {**SUPPLY_DEMAND_LOOKBACK, **(lookback or {})}
+
+    def find_zones(frame, lookback=50):
+        """إيجاد مناطق العرض والطلب (خطي في عدد الشموع)"""
+        h_list, l_list, c_list, o_list = frame['high'], frame['low'], frame['close'], frame['open']
+        found = indicators.supply_demand_zones(o_list, h_list, l_list, c_list, lookback, current_price)
+
+        # منطقة الطلب: من القاع حتى أدنى جسم الشمعة
+        demand_zones = [{
+            'low': round(float(l_list[p]), 2),
+            'high': round(float(min(o_list[p], c_list[p])), 2),
+            'strength': 'strong' if strong else 'moderate'
+        } for p, strong in zip(found['demand'], found['demand_strong'])]
+
+        # منطقة العرض: من أعلى جسم الشمعة حتى القمة
+        supply_zones = [{
+            'low': round(float(max(o_list[p], c_list[p])), 2),
+            'high': round(float(h_list[p]), 2),
+            'strength': 'strong' if strong else 'moderate'
+        } for p, strong in zip(found['supply'], found['supply_strong'])]
+
+        # إزالة المناطق المتداخلة والاحتفاظ بالأقوى
+        demand_zones = remove_overlapping_zones(demand_zones, 'demand')[:3]
+        supply_zones = remove_overlapping_zones(supply_zones, 'supply')[:3]
+
+        return demand_zones, supply_zones
+
+    def remove_overlapping_zones(zones, zone_type):
+        """إزالة المناطق المتداخلة"""
+        if not zones:
+            return []
+
+        # ترتيب حسب القوة ثم السعر
+        if zone_type == 'demand':
+            zones.sort(key=lambda x: (x['strength'] == 'strong', x['low']), reverse=True)
+        else:
+            zones.sort(key=lambda x: (x['strength'] == 'strong', -x['high']), reverse=True)
+
+        filtered = []
+        for zone in zones:
+            overlaps = False
+            for existing in filtered:
+                if (zone['low'] <= existing['high'] and zone['high'] >= existing['low']):
+                    overlaps = True
+                    break
+            if not overlaps:
+                filtered.append(zone)
+
+        return filtered
+
+    # حساب المناطق اليومية
+    daily_demand, daily_supply = find_zones(bars, lookback['daily'])
+
+    # حساب المناطق الأسبوعية (أسابيع تداول من الأحد إلى الخميس)
+    weekly = TechnicalAnalysis.resample_history(data, 'weekly', bars)
+    weekly_demand, weekly_supply = find_zones(weekly, lookback['weekly']) if len(weekly['close']) >= 10 else ([], [])
+
+    # حساب المناطق الشهرية (أشهر تقويمية)
+    monthly = TechnicalAnalysis.resample_history(data, 'monthly', bars)
+    monthly_demand, monthly_supply = find_zones(monthly, lookback['monthly']) if len(monthly['close']) >= 5 else ([], [])
+
+    return {
+        'daily': {'demand': daily_demand, 'supply': daily_supply},
+        'weekly': {'demand': weekly_demand, 'supply': weekly_supply},
+        'monthly': {'demand': monthly_demand, 'supply': monthly_supply}
+    }
+
+
+def analyze_price_action(data):
+    """تحليل البرايس أكشن (Price Action Analysis)"""
+    if not data or not data.get('high') or not data.get('low') or not data.get('close') or not data.get('open'):
+        return {'patterns': [], 'trend': 'neutral', 'signals': []}
+
+    bars = indicators.to_arrays(data)
+    highs, lows, closes, opens = bars['high'], bars['low'], bars['close'], bars['open']
+
+    if len(closes) < 20:
+        return {'patterns': [], 'trend': 'neutral', 'signals': []}
+
+    patterns = []
+    signals = []
+    current_price = float(closes[-1])
+
+    # تحليل الاتجاه
+    sma_20 = float(indicators.sma_last(closes, 20))
+    sma_50 = float(indicators.sma_last(closes, 50)) if len(closes) >= 50 else sma_20
+
+    if current_price > sma_20 > sma_50:
+        trend = 'bullish'
+        trend_ar = 'صاعد'
+    elif current_price < sma_20 < sma_50:
+        trend = 'bearish'
+        trend_ar = 'هابط'
+    else:
+        trend = 'neutral'
+        trend_ar = 'متذبذب'
+
+    # تحليل آخر 5 شموع للأنماط (كل شمعة مع التي تليها)
+    masks = indicators.candle_patterns(opens[-5:], highs[-5:], lows[-5:], closes[-5:])
+    pattern_defs = [
+        ('hammer', {'name': 'مطرقة (Hammer)', 'type': 'bullish'},
+         {'signal': 'شراء', 'reason': 'نمط المطرقة - انعكاس صعودي محتمل'}),
+        ('shooting_star', {'name': 'شهاب (Shooting Star)', 'type': 'bearish'},
+         {'signal': 'بيع', 'reason': 'نمط الشهاب - انعكاس هبوطي محتمل'}),
+        ('bullish_engulfing', {'name': 'ابتلاع صعودي', 'type': 'bullish'},
+         {'signal': 'شراء', 'reason': 'نمط الابتلاع الصعودي'}),
+        ('bearish_engulfing', {'name': 'ابتلاع هبوطي', 'type': 'bearish'},
+         {'signal': 'بيع', 'reason': 'نمط الابتلاع الهبوطي'}),
+        ('doji', {'name': 'دوجي (Doji)', 'type': 'neutral'},
+         {'signal': 'انتظار', 'reason': 'نمط الدوجي - تردد في السوق'}),
+    ]
+
+    for i in range(-5, -1):
+        for key, pattern, signal in pattern_defs:
+            if masks[key][i]:
+                patterns.append({**pattern, 'position': i})
+                signals.append(dict(signal))
+
+    # تحليل القمم والقيعان
+    recent_highs = highs[-20:]
+    recent_lows = lows[-20:]
+
+    if len(recent_highs) >= 3:
+        # Higher Highs and Higher Lows
+        if recent_highs[-1] > recent_highs[-5] and recent_lows[-1] > recent_lows[-5]:
+            patterns.append({'name': 'قمم وقيعان صاعدة', 'type': 'bullish', 'position': -1})
+
+        # Lower Highs and Lower Lows
+        if recent_highs[-1] < recent_highs[-5] and recent_lows[-1] < recent_lows[-5]:
+            patterns.append({'name': 'قمم وقيعان هابطة', 'type': 'bearish', 'position': -1})
+
+    return {
+        'patterns': patterns[-5:],  # آخر 5 أنماط
+        'trend': trend,
+        'trend_ar': trend_ar,
+        'signals': signals[-3:],  # آخر 3 إشارات
+        'current_price': round(current_price, 2),
+        'sma_20': round(sma_20, 2),
+        'sma_50': round(sma_50, 2) if len(closes) >= 50 else None
+    }
+
+
+def calculate_ema(prices, period):
+    """حساب المتوسط المتحرك الأسي"""
+    if len(prices) < period:
+        return None
+    return float(indicators.ema_last(np.asarray(prices, dtype=np.float64), period))
+
+
 class DividendTracker:
     """تتبع التوزيعات"""
 
@@ -323,12 +961,215 @@ class DividendTracker:
         ],
     }
 
+    # فهرس التوزيعات لكل سهم:
+    # الرمز -> (أيام التوزيع مرتبة، المجموع التراكمي للسهم الواحد، التوزيعات، مبالغ معدلة بالتقسيم؟)
+    _index = {}
+    _index_lock = threading.Lock()
+
+    DETAIL_PAGE_SIZE = 10  # عدد التوزيعات المرجعة لكل سهم في ملخص المحفظة
+
+    index_revision = 0  # يزيد مع كل مسح للفهرس (لإبطال الحسابات المعتمدة عليه)
+
+    @staticmethod
+    def _dividend_type(gap_days: float) -> str:
+        """نوع التوزيع من الفترة بين توزيعين متتاليين"""
+        if gap_days < 135:
+            return "ربع سنوي"
+        if gap_days < 270:
+            return "نصف سنوي"
+        return "سنوي"
+
+    @classmethod
+    def _loaded_history(cls, code: str) -> List[Dict]:
+        """التوزيعات من مخزن الإجراءات المؤسسية مع تقدير نوعها من تكرارها"""
+        events = corporate_actions.dividends(code)
+        history = []
+        for i, event in enumerate(events):
+            # الفترة إلى التوزيع السابق (أو التالي لأول توزيع)
+            j = i - 1 if i else i + 1
+            if j < len(events):
+                gap = abs(_date_ordinal(event["date"]) - _date_ordinal(events[j]["date"]))
+                dividend_type = cls._dividend_type(gap)
+            else:
+                dividend_type = "سنوي"
+            history.append({"date": event["date"], "amount": event["amount"], "type": dividend_type})
+        return history
+
+    @classmethod
+    def _get_index(cls, code: str) -> Optional[tuple]:
+        """فهرس التوزيعات مرتب حسب التاريخ (يُبنى مرة واحدة لكل سهم)
+
+        الأحداث المحملة من المصدر لها الأولوية، والبيانات الثابتة احتياطية.
+        """
+        index = cls._index.get(code)
+        if index is not None:
+            return index
+
+        history = cls._loaded_history(code)
+        adjusted = bool(history)
+        if not history:
+            history = cls.DIVIDEND_HISTORY.get(code)
+        if not history:
+            return None
+
+        entries = []
+        for dividend in history:
+            ordinal = _date_ordinal(dividend["date"])
+            if ordinal is not None:
+                entries.append((ordinal, dividend))
+        entries.sort(key=lambda item: item[0])
+
+        ordinals = [ordinal for ordinal, _ in entries]
+        cumulative = [0.0]
+        for _, dividend in entries:
+            cumulative.append(cumulative[-1] + dividend["amount"])
+
+        index = (ordinals, cumulative, [dividend for _, dividend in entries], adjusted)
+        with cls._index_lock:
+            cls._index[code] = index
+        return index
+
+    @classmethod
+    def clear_index(cls, code: str = None):
+        """مسح الفهرس بعد تحديث بيانات التوزيعات"""
+        with cls._index_lock:
+            if code is None:
+                cls._index = {}
+            else:
+                cls._index.pop(code, None)
+            cls.index_revision += 1
+
     @staticmethod
-    def get_dividends_received(symbol: str, buy_date: str, shares: float) -> Dict:
-        """حساب التوزيعات المستلمة بناءً على تاريخ الشراء"""
+    def _range(ordinals: List[int], acquired: str, disposed: str = None) -> Optional[tuple]:
+        """مواقع التوزيعات المستحقة لدفعة أسهم: تاريخ الاستحقاق بعد الشراء وحتى يوم البيع
+
+        من يشتري يوم الاستحقاق لا يستحق التوزيع، ومن يبيع يوم الاستحقاق يستحقه،
+        لذلك كل سهم يُحسب له التوزيع مرة واحدة فقط.
+        ordinals من نفس نسخة الفهرس التي يستخدمها المستدعي (قد يُمسح الفهرس من خيط آخر).
+        """
+        start_ordinal = _date_ordinal(acquired)
+        if start_ordinal is None:
+            return None
+        start = bisect.bisect_right(ordinals, start_ordinal)
+
+        end = len(ordinals)
+        if disposed:
+            end_ordinal = _date_ordinal(disposed)
+            if end_ordinal is not None:
+                end = max(start, bisect.bisect_right(ordinals, end_ordinal))
+        return start, end
+
+    @classmethod
+    def dividends_per_share(cls, symbol: str, acquired: str, disposed: str = None) -> float:
+        """مجموع التوزيعات للسهم الواحد بين تاريخ الشراء وتاريخ البيع (O(log n))"""
+        code = symbol.strip().replace(".SR", "")
+        index = cls._get_index(code)
+        if index is None:
+            return 0.0
+        ordinals, cumulative = index[0], index[1]
+        bounds = cls._range(ordinals, acquired, disposed)
+        if bounds is None:
+            return 0.0
+        return cumulative[bounds[1]] - cumulative[bounds[0]]
+
+    @classmethod
+    def get_lot_dividends(cls, symbol: str, lots: List[tuple], offset: int = 0,
+                          limit: int = None, share_multiplier=None) -> Dict:
+        """التوزيعات المستحقة لمجموعة دفعات أسهم
+
+        lots: قائمة (عدد الأسهم، تاريخ الشراء، تاريخ البيع أو None للمركز المفتوح)
+        عدد الأسهم المملوكة في كل تاريخ استحقاق يُحسب من الدفعات القائمة فيه فعلاً.
+        مع المبالغ المحملة (معدلة بالتقسيم) تُحوّل أسهم كل دفعة إلى ما يقابلها بعد التقسيمات.
+        مع المبالغ الثابتة (غير معدلة) تُضرب الأسهم في كل تاريخ استحقاق بمعامل المنح
+        والتجزئة حتى ذلك التاريخ: share_multiplier(التاريخ) مثل Stock.get_corporate_action_multiplier
+        offset/limit: صفحة من قائمة التفاصيل (الأحدث أولاً)؛ المجموع والعدد لكل التوزيعات دائماً.
+        """
+        code = symbol.strip().replace(".SR", "")
+        index = cls._get_index(code)
+        if index is None:
+            result = {"symbol": code, "total_dividends": 0, "dividend_count": 0, "dividends": []}
+            if limit is not None:
+                result.update({"offset": offset, "has_more": False})
+            return result
+
+        ordinals, _, entries, adjusted = index
+        # مصفوفة فروق: كل دفعة تضيف أسهمها من أول توزيع مستحق حتى آخره
+        held = [0.0] * (len(ordinals) + 1)
+        for shares, acquired, disposed in lots:
+            bounds = cls._range(ordinals, acquired, disposed)
+            if bounds is None or bounds[0] >= bounds[1] or shares <= 0:
+                continue
+            if adjusted:
+                shares *= corporate_actions.split_factor(code, acquired)
+            held[bounds[0]] += shares
+            held[bounds[1]] -= shares
+
+        # المرور الأول: المجموع ومواقع التوزيعات المستلمة فقط
+        positions = []
+        total_amount = 0
+        shares_on_date = 0
+        for i, dividend in enumerate(entries):
+            shares_on_date += held[i]
+            if shares_on_date <= 0:
+                continue
+            shares = shares_on_date
+            if share_multiplier is not None and not adjusted:
+                shares *= share_multiplier(dividend["date"])
+            positions.append((i, shares))
+            total_amount += dividend["amount"] * shares
+
+        # التفاصيل تُبنى للصفحة المطلوبة فقط (الأحدث أولاً)
+        positions.reverse()
+        page = positions[offset:] if limit is None else positions[offset:offset + limit]
+        received = []
+        for i, shares in page:
+            dividend = entries[i]
+            received.append({
+                "date": dividend["date"],
+                "shares": shares,
+                "amount_per_share": dividend["amount"],
+                "total_amount": round(dividend["amount"] * shares, 2),
+                "type": dividend["type"]
+            })
+
+        result = {
+            "symbol": code,
+            "total_dividends": round(total_amount, 2),
+            "dividend_count": len(positions),
+            "dividends": received
+        }
+        if limit is not None:
+            result.update({"offset": offset, "has_more": offset + len(received) < len(positions)})
+        return result
+
+    @staticmethod
+    def lots_from_orders(orders) -> List[tuple]:
+        """تحويل أوامر الشراء والبيع إلى دفعات (FIFO) بتواريخ الشراء والبيع"""
+        lots = []
+        open_lots = []  # [عدد الأسهم المتبقية، تاريخ الشراء]
+        for order in sorted(orders, key=lambda o: o.date):
+            if order.order_type == "buy":
+                open_lots.append([order.shares, order.date])
+                continue
+            to_sell = order.shares
+            while to_sell > 0 and open_lots:
+                lot = open_lots[0]
+                sold = min(lot[0], to_sell)
+                lots.append((sold, lot[1], order.date))
+                lot[0] -= sold
+                to_sell -= sold
+                if lot[0] <= 0:
+                    open_lots.pop(0)
+        lots.extend((shares, acquired, None) for shares, acquired in open_lots if shares > 0)
+        return lots
+
+    @staticmethod
+    def get_dividends_received(symbol: str, buy_date: str, shares: float,
+                               sell_date: str = None) -> Dict:
+        """حساب التوزيعات المستلمة لدفعة واحدة بناءً على تاريخ الشراء (وتاريخ البيع إن وجد)"""
         code = symbol.strip().replace(".SR", "")
 
-        if code not in DividendTracker.DIVIDEND_HISTORY:
+        if DividendTracker._get_index(code) is None:
             return {
                 "symbol": code,
                 "total_dividends": 0,
@@ -337,9 +1178,7 @@ class DividendTracker:
                 "message": "لا تتوفر بيانات توزيعات لهذا السهم"
             }
 
-        try:
-            buy_datetime = datetime.strptime(buy_date, "%Y-%m-%d")
-        except:
+        if _date_ordinal(buy_date) is None:
             return {
                 "symbol": code,
                 "total_dividends": 0,
@@ -348,49 +1187,126 @@ class DividendTracker:
                 "message": "تاريخ الشراء غير صحيح"
             }
 
-        received_dividends = []
-        total_amount = 0
-
-        for dividend in DividendTracker.DIVIDEND_HISTORY[code]:
-            div_date = datetime.strptime(dividend["date"], "%Y-%m-%d")
-            if div_date >= buy_datetime:
-                amount = dividend["amount"] * shares
-                received_dividends.append({
-                    "date": dividend["date"],
-                    "amount_per_share": dividend["amount"],
-                    "total_amount": round(amount, 2),
-                    "type": dividend["type"]
-                })
-                total_amount += amount
+        result = DividendTracker.get_lot_dividends(code, [(shares, buy_date, sell_date)])
+        total_amount = result["total_dividends"]
+        count = result["dividend_count"]
 
         return {
-            "symbol": code,
+            **result,
             "shares": shares,
             "buy_date": buy_date,
-            "total_dividends": round(total_amount, 2),
-            "dividend_count": len(received_dividends),
-            "dividends": received_dividends,
-            "annual_yield": round((total_amount / shares / len(received_dividends) * 4 if received_dividends and shares > 0 else 0), 2)
+            "annual_yield": round((total_amount / shares / count * 4 if count and shares > 0 else 0), 2)
         }
 
+    @staticmethod
+    def get_position_dividends(symbol: str, orders, offset: int = 0, limit: int = None,
+                               share_multiplier=None) -> Dict:
+        """التوزيعات المستلمة لمركز سهم من أوامره الفعلية (كل دفعة من تاريخ شرائها حتى بيعها)
+
+        share_multiplier: معامل إجراءات الشركة حتى تاريخ (Stock.get_corporate_action_multiplier)
+        """
+        code = symbol.strip().replace(".SR", "")
+        lots = DividendTracker.lots_from_orders(orders)
+        result = DividendTracker.get_lot_dividends(code, lots, offset, limit, share_multiplier)
+        result["buy_date"] = min((lot[1] for lot in lots), default=None)
+        return result
+
+    @classmethod
+    def get_portfolio_dividends(cls, stocks, limit: int = DETAIL_PAGE_SIZE) -> Dict:
+        """التوزيعات المستلمة والقادمة لكل أسهم المحفظة في مرور واحد
+
+        stocks: أسهم المحفظة (symbol, name, shares, orders, corporate_actions)
+        limit: عدد التفاصيل المرجعة لكل سهم (الباقي عبر /api/dividends/<symbol>?offset=)
+        """
+        total_dividends = 0
+        details = []
+        for stock in stocks:
+            lots = cls.lots_from_orders(stock.orders)
+            if not lots:
+                continue
+
+            divs = cls.get_lot_dividends(stock.symbol, lots, 0, limit,
+                                         stock.get_corporate_action_multiplier)
+            total_dividends += divs["total_dividends"]
+            details.append({
+                "symbol": stock.symbol,
+                "name": stock.name,
+                "shares": stock.shares,
+                "buy_date": min(lot[1] for lot in lots),
+                "total_dividends": divs["total_dividends"],
+                "dividend_count": divs["dividend_count"],
+                "dividends": divs["dividends"],
+                "has_more": divs["has_more"],
+                "upcoming": cls.get_upcoming_dividends(stock.symbol)  # التوزيع القادم المتوقع
+            })
+
+        return {"total_dividends": round(total_dividends, 2), "stocks": details}
+
+    @classmethod
+    def project_dividends(cls, symbol: str, start: date, end: date) -> List[Dict]:
+        """التوزيعات المتوقعة للسهم الواحد بين start و end (بدون end)
+
+        التوزيعات المعروفة في الفترة تُعتمد كما هي، وما بعد آخر توزيع معروف يُتوقع
+        بتكرار نمط آخر 12 شهراً من السجل (نفس اليوم والمبلغ في السنوات التالية).
+        """
+        code = symbol.strip().replace(".SR", "")
+        index = cls._get_index(code)
+        if index is None:
+            return []
+
+        ordinals, _, entries, _ = index
+        start_ordinal, end_ordinal = start.toordinal(), end.toordinal()
+        projected = []
+
+        lo = bisect.bisect_left(ordinals, start_ordinal)
+        hi = bisect.bisect_left(ordinals, end_ordinal)
+        for dividend in entries[lo:hi]:
+            projected.append({"date": dividend["date"], "amount_per_share": dividend["amount"],
+                              "type": dividend["type"], "projected": False})
+
+        # نمط آخر سنة في السجل (بدون ما تقع ذكراه السنوية قرب آخر توزيع، لتجنب تكراره)
+        last_ordinal = ordinals[-1]
+        pattern = entries[bisect.bisect_right(ordinals, last_ordinal - 335):]
+        for dividend in pattern:
+            base = date.fromisoformat(dividend["date"])
+            years = 1
+            while True:
+                try:
+                    shifted = base.replace(year=base.year + years)
+                except ValueError:  # 29 فبراير
+                    shifted = base.replace(year=base.year + years, day=28)
+                ordinal = shifted.toordinal()
+                years += 1
+                if ordinal >= end_ordinal:
+                    break
+                if ordinal < start_ordinal or ordinal <= last_ordinal:
+                    continue
+                projected.append({"date": shifted.isoformat(), "amount_per_share": dividend["amount"],
+                                  "type": dividend["type"], "projected": True})
+
+        projected.sort(key=lambda d: d["date"])
+        return projected
+
     @staticmethod
     def get_upcoming_dividends(symbol: str) -> Dict:
         """توقع التوزيعات القادمة"""
         code = symbol.strip().replace(".SR", "")
 
-        if code not in DividendTracker.DIVIDEND_HISTORY:
+        index = DividendTracker._get_index(code)
+        if index is None:
             return None
 
-        dividends = DividendTracker.DIVIDEND_HISTORY[code]
-        if not dividends:
-            return None
-
-        # آخر توزيع
-        last_dividend = dividends[0]
+        # آخر توزيع (الفهرس مرتب تصاعدياً)
+        ordinals, _, entries, _ = index
+        last_dividend = entries[-1]
         last_date = datetime.strptime(last_dividend["date"], "%Y-%m-%d")
 
-        # تقدير التوزيع القادم
-        if "ربع سنوي" in last_dividend["type"]:
+        # تقدير التوزيع القادم: وسيط الفترات بين آخر التوزيعات، أو حسب النوع
+        recent = ordinals[-5:]
+        gaps = sorted(b - a for a, b in zip(recent, recent[1:]))
+        if gaps:
+            next_date = last_date + timedelta(days=gaps[len(gaps) // 2])
+        elif "ربع سنوي" in last_dividend["type"]:
             next_date = last_date + timedelta(days=90)
         elif "نصف سنوي" in last_dividend["type"]:
             next_date = last_date + timedelta(days=180)
@@ -407,6 +1323,19 @@ class DividendTracker:
         }
 
 
+# مسح فهرس السهم عند تحميل توزيعات جديدة له
+corporate_actions.add_listener(DividendTracker.clear_index)
+
+
+@lru_cache(maxsize=4096)
+def _date_ordinal(value: str) -> Optional[int]:
+    """تحويل تاريخ YYYY-MM-DD إلى رقم يوم (مع تخزين النتيجة)"""
+    try:
+        return date.fromisoformat(str(value)[:10]).toordinal()
+    except (TypeError, ValueError):
+        return None
+
+
 class NewsService:
     """خدمة الأخبار - أخبار السوق السعودي"""
 
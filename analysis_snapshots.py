@@ -0,0 +1,113 @@
+"""
+لقطات التحليل الفني المحسوبة مسبقاً
+Precomputed Analysis Snapshots - bar-dependent analysis built once after market close
+
+الدعم والمقاومة والمتوسطات ومناطق العرض والطلب والبرايس أكشن لا تتغير إلا
+بإغلاق شمعة جديدة، لذلك تُحسب مرة واحدة بعد إغلاق السوق وتُحفظ لكل سهم.
+الحقول المعتمدة على السعر اللحظي (مستويات البيع والشراء ونسبها) تُحسب
+عند الطلب فوق اللقطة.
+"""
+import json
+import os
+import pathlib
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from market_time import (
+    MARKET_CLOSE_HOUR, MARKET_OPEN_HOUR, RIYADH_TZ, TRADING_WEEKDAYS, last_market_close,
+)
+
+SNAPSHOT_FILE = pathlib.Path(__file__).parent / "cache" / "analysis_snapshots.json"
+
+POST_CLOSE_DELAY = timedelta(minutes=30)  # انتظار المزاد الختامي واكتمال الشمعة
+
+
+def in_trading_session(now: datetime = None) -> bool:
+    """هل شمعة اليوم غير مكتملة؟ (من الافتتاح حتى انتهاء مهلة ما بعد الإغلاق)"""
+    now = (now or datetime.now(RIYADH_TZ)).astimezone(RIYADH_TZ)
+    if now.weekday() not in TRADING_WEEKDAYS:
+        return False
+    opened = now.replace(hour=MARKET_OPEN_HOUR, minute=0, second=0, microsecond=0)
+    closed = now.replace(hour=MARKET_CLOSE_HOUR, minute=0, second=0, microsecond=0) + POST_CLOSE_DELAY
+    return opened <= now < closed
+
+
+def next_snapshot_run(now: datetime = None) -> datetime:
+    """موعد بناء اللقطات القادم (بعد الإغلاق التالي بمهلة قصيرة)"""
+    now = (now or datetime.now(RIYADH_TZ)).astimezone(RIYADH_TZ)
+    run = last_market_close(now) + POST_CLOSE_DELAY
+    while run <= now or run.weekday() not in TRADING_WEEKDAYS:
+        run += timedelta(days=1)
+    return run
+
+
+class AnalysisSnapshotStore:
+    """مخزن لقطات التحليل لكل سهم (في الذاكرة مع نسخة على القرص)
+
+    اللقطة صالحة إذا بُنيت بعد آخر إغلاق للسوق، أي أنها تحتوي كل الشموع المغلقة.
+    """
+
+    def __init__(self, path: pathlib.Path = SNAPSHOT_FILE):
+        self.path = pathlib.Path(path)
+        self._snapshots = {}  # الرمز -> {"built_at": epoch, "analysis": {...}}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._snapshots = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"خطأ في قراءة لقطات التحليل: {e}")
+            self._snapshots = {}
+
+    def save(self):
+        """حفظ اللقطات (كتابة ذرية عبر ملف مؤقت)"""
+        with self._lock:
+            data = dict(self._snapshots)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, default=float)
+        os.replace(str(tmp_path), str(self.path))
+
+    def get(self, symbol: str) -> Optional[Dict]:
+        """اللقطة الصالحة للسهم أو None إذا لم تُبنَ بعد آخر إغلاق"""
+        with self._lock:
+            snapshot = self._snapshots.get(symbol)
+        if not snapshot or snapshot["built_at"] < last_market_close().timestamp():
+            return None
+        return snapshot["analysis"]
+
+    def put(self, symbol: str, analysis: Dict) -> bool:
+        """حفظ لقطة السهم، إلا أثناء التداول (تحتوي شمعة اليوم غير المكتملة)
+
+        اللقطة المبنية أثناء التداول كانت ستبقى صالحة حتى الإغلاق التالي
+        بمستويات محسوبة من أول طلب في اليوم، لذلك تُستخدم للطلب الحالي فقط.
+        """
+        if in_trading_session():
+            return False
+        with self._lock:
+            self._snapshots[symbol] = {"built_at": time.time(), "analysis": analysis}
+        return True
+
+    def status(self) -> Dict:
+        """ملخص حالة اللقطات"""
+        with self._lock:
+            snapshots = dict(self._snapshots)
+        cutoff = last_market_close().timestamp()
+        built = [s["built_at"] for s in snapshots.values()]
+        return {
+            "count": len(snapshots),
+            "fresh": sum(1 for t in built if t >= cutoff),
+            "last_built": datetime.fromtimestamp(max(built)).isoformat() if built else None,
+            "next_run": next_snapshot_run().isoformat(),
+        }
+
+
+# المخزن المشترك
+analysis_snapshots = AnalysisSnapshotStore()
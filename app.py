@@ -7,10 +7,22 @@ from flask import Flask, render_template, jsonify, request, session, redirect, u
 from functools import wraps
 from portfolio import Portfolio, WalletManager, app_settings
 from price_fetcher import TadawulPriceFetcher
-from analysis_service import TechnicalAnalysis, DividendTracker
+from analysis_service import (
+    TechnicalAnalysis, DividendTracker, calculate_trading_levels,
+    calculate_moving_averages_from_data, calculate_moving_averages_batch,
+    calculate_supply_demand_zones, analyze_price_action
+)
 from news_service import NewsAggregator, NewsService
 from global_prices_service import GlobalPricesService
+from json_provider import FastJSONProvider
+from analysis_snapshots import analysis_snapshots, next_snapshot_run
+from market_time import RIYADH_TZ
+from screener import market_screener
+from corporate_actions import corporate_actions
+from dividend_calendar import dividend_calendar
+import backtest
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait
 import threading
 import time
 import pathlib
@@ -19,6 +31,7 @@ import json
 import hashlib
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 app.secret_key = 'sejini_portfolio_secret_key_2026'
 
 # بيانات تسجيل الدخول
@@ -58,9 +71,46 @@ def auto_refresh_prices():
             print(f"خطأ في التحديث التلقائي: {e}")
 
 
+# العمليات الفرعية للاختبار التاريخي (spawn) تستورد هذا الملف باسم __mp_main__،
+# فالخيوط الخلفية لا تبدأ إلا في العملية الرئيسية
+IS_WORKER_PROCESS = __name__ == '__mp_main__'
+
 # بدء التحديث التلقائي
 refresh_thread = threading.Thread(target=auto_refresh_prices, daemon=True)
-refresh_thread.start()
+if not IS_WORKER_PROCESS:
+    refresh_thread.start()
+
+
+# مجمع خيوط التحليل الفني - يحد عدد التحليلات المتزامنة لكل الطلبات
+ANALYSIS_MAX_WORKERS = 6  # أقصى عدد تحليلات متزامنة (مشترك بين كل الطلبات)
+ANALYSIS_TIMEOUT = 25  # أقصى مدة انتظار للتحليل بالثواني قبل إرجاع نتائج جزئية
+
+analysis_executor = ThreadPoolExecutor(max_workers=ANALYSIS_MAX_WORKERS,
+                                       thread_name_prefix='analysis')
+
+
+def post_close_snapshots():
+    """بناء لقطات التحليل يومياً بعد إغلاق السوق"""
+    while True:
+        delay = (next_snapshot_run() - datetime.now(RIYADH_TZ)).total_seconds()
+        time.sleep(max(delay, 1))
+        try:
+            # تحديث شموع كل السوق للماسح (وتشمل أسهم المحفظة)
+            market_screener.refresh()
+            # أحداث التوزيعات والتقسيم (كل سهم يُفحص مرة كل REFRESH_INTERVAL)
+            corporate_actions.refresh()
+            built = build_analysis_snapshots()
+            print(f"تم بناء لقطات التحليل لـ {built} سهم بعد الإغلاق")
+        except Exception as e:
+            print(f"خطأ في بناء لقطات التحليل: {e}")
+
+
+snapshot_thread = threading.Thread(target=post_close_snapshots, daemon=True)
+if not IS_WORKER_PROCESS:
+    snapshot_thread.start()
+
+    # إبقاء الأسعار العالمية المطلوبة مؤخراً محدثة في الخلفية
+    GlobalPricesService.start_refresher()
 
 
 @app.before_request
@@ -120,21 +170,35 @@ def index():
     return render_template('index.html')
 
 
-@app.route('/api/portfolio')
-def get_portfolio():
-    """الحصول على بيانات المحفظة"""
-    stocks = portfolio.get_all_stocks()
+def build_portfolio_payload(include_orders: bool = False) -> dict:
+    """بناء استجابة المحفظة مع الملخص (الأوامر تُضمَّن عند الطلب فقط)"""
+    stocks = [s.to_summary_dict(include_orders) for s in portfolio.get_all_stocks()]
 
-    return jsonify({
-        "stocks": [s.to_summary_dict() for s in stocks],
+    total_cost = sum(s["total_cost"] for s in stocks)
+    total_value = sum(s["current_value"] for s in stocks)
+    total_profit_loss = total_value - total_cost
+
+    return {
+        "stocks": stocks,
         "summary": {
-            "total_cost": portfolio.total_cost,
-            "total_value": portfolio.total_value,
-            "total_profit_loss": portfolio.total_profit_loss,
-            "total_profit_loss_percent": portfolio.total_profit_loss_percent
+            "total_cost": total_cost,
+            "total_value": total_value,
+            "total_profit_loss": total_profit_loss,
+            "total_profit_loss_percent": (total_profit_loss / total_cost) * 100 if total_cost != 0 else 0
         },
         "last_updated": last_refresh_time
-    })
+    }
+
+
+def wants_orders() -> bool:
+    """هل طلب العميل تضمين الأوامر؟ (?include_orders=1)"""
+    return request.args.get('include_orders', '').lower() in ('1', 'true', 'yes')
+
+
+@app.route('/api/portfolio')
+def get_portfolio():
+    """الحصول على بيانات المحفظة"""
+    return jsonify(build_portfolio_payload(wants_orders()))
 
 
 @app.route('/api/stocks', methods=['POST'])
@@ -186,7 +250,7 @@ def add_stock():
         if price_data:
             stock.current_price = price_data['price']
             stock.last_updated = price_data['timestamp']
-            portfolio.save()
+            portfolio.save(orders_changed=False)
 
         return jsonify({"success": True, "stock": stock.to_summary_dict()})
 
@@ -287,7 +351,7 @@ def add_stock_order(symbol):
         if price_data and stock:
             stock.current_price = price_data['price']
             stock.last_updated = price_data['timestamp']
-            portfolio.save()
+            portfolio.save(orders_changed=False)
 
         return jsonify({
             "success": True,
@@ -315,17 +379,7 @@ def refresh_prices():
         TadawulPriceFetcher.update_portfolio_prices(portfolio)
         last_refresh_time = datetime.now().isoformat()
 
-        stocks = portfolio.get_all_stocks()
-        return jsonify({
-            "stocks": [s.to_summary_dict() for s in stocks],
-            "summary": {
-                "total_cost": portfolio.total_cost,
-                "total_value": portfolio.total_value,
-                "total_profit_loss": portfolio.total_profit_loss,
-                "total_profit_loss_percent": portfolio.total_profit_loss_percent
-            },
-            "last_updated": last_refresh_time
-        })
+        return jsonify(build_portfolio_payload(wants_orders()))
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -437,23 +491,42 @@ def get_stock_analysis(symbol):
 def get_portfolio_analysis():
     """الحصول على التحليل الفني لجميع أسهم المحفظة"""
     stocks = portfolio.get_all_stocks()
+
+    # التوصيات تُحسب بالتوازي، والتنظيم يتم عبر محدد معدل Yahoo المشترك
+    futures = {
+        analysis_executor.submit(TechnicalAnalysis.get_recommendation,
+                                 stock.symbol, stock.current_price, stock.shares): stock
+        for stock in stocks
+    }
+    done, not_done = wait(futures, timeout=ANALYSIS_TIMEOUT)
+
     analyses = []
+    for future, stock in futures.items():
+        analysis = None
+        if future in done:
+            try:
+                analysis = future.result()
+            except Exception as e:
+                print(f"Error analyzing {stock.symbol}: {e}")
+        else:
+            future.cancel()
 
-    for stock in stocks:
-        analysis = TechnicalAnalysis.get_recommendation(
-            stock.symbol,
-            stock.current_price,
-            stock.shares
-        )
+        if analysis is None:
+            analysis = {
+                "symbol": stock.symbol,
+                "recommendation": "hold",
+                "message": "لا تتوفر بيانات كافية للتحليل",
+                "confidence": 0
+            }
         analysis["name"] = stock.name
         analyses.append(analysis)
-        time.sleep(0.3)  # تأخير لتجنب الحد
 
     # ترتيب حسب الثقة
     analyses.sort(key=lambda x: x.get("confidence", 0), reverse=True)
 
     return jsonify({
         "analyses": analyses,
+        "partial": bool(not_done),
         "timestamp": datetime.now().isoformat()
     })
 
@@ -476,14 +549,12 @@ def get_stock_dividends(symbol):
     if not buy_orders:
         return jsonify({"error": "لا توجد أوامر شراء"}), 404
 
-    # أقدم تاريخ شراء
-    first_buy_date = min(o.date for o in buy_orders)
-
-    dividends = DividendTracker.get_dividends_received(
-        symbol,
-        first_buy_date,
-        stock.shares
-    )
+    # التوزيعات حسب الأسهم المملوكة فعلاً في كل تاريخ استحقاق (offset/limit لصفحات التفاصيل)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = request.args.get('limit', type=int)
+    dividends = DividendTracker.get_position_dividends(symbol, orders, offset, limit,
+                                                       stock.get_corporate_action_multiplier)
+    dividends["shares"] = stock.shares
 
     # إضافة التوزيعات القادمة المتوقعة
     upcoming = DividendTracker.get_upcoming_dividends(symbol)
@@ -495,43 +566,39 @@ def get_stock_dividends(symbol):
 
 @app.route('/api/dividends/portfolio')
 def get_portfolio_dividends():
-    """الحصول على إجمالي التوزيعات للمحفظة مع التفاصيل"""
-    stocks = portfolio.get_all_stocks()
-    total_dividends = 0
-    dividend_details = []
+    """الحصول على إجمالي التوزيعات للمحفظة مع صفحة أولى من التفاصيل لكل سهم
 
-    for stock in stocks:
-        orders = stock.orders
-        buy_orders = [o for o in orders if o.order_type == "buy"]
+    limit: عدد التوزيعات لكل سهم (0 للمجاميع فقط)
+    """
+    limit = max(request.args.get('limit', DividendTracker.DETAIL_PAGE_SIZE, type=int), 0)
+    result = DividendTracker.get_portfolio_dividends(portfolio.get_all_stocks(), limit)
+    result["timestamp"] = datetime.now().isoformat()
+    return jsonify(result)
 
-        if buy_orders:
-            first_buy_date = min(o.date for o in buy_orders)
-            divs = DividendTracker.get_dividends_received(
-                stock.symbol,
-                first_buy_date,
-                stock.shares
-            )
-            total_dividends += divs.get("total_dividends", 0)
 
-            # إضافة التوزيعات القادمة المتوقعة
-            upcoming = DividendTracker.get_upcoming_dividends(stock.symbol)
+@app.route('/api/dividends/calendar')
+def get_dividend_calendar():
+    """تقويم دخل التوزيعات المتوقع لـ 12 شهراً قادمة مجمعاً حسب الشهر والمحفظة"""
+    calendar = dividend_calendar.get(portfolio)
+    wallets = {w.wallet_id: w.name for w in wallet_manager.get_all_wallets()}
+    calendar["wallets"] = [
+        {"wallet_id": wallet_id, "wallet_name": wallets.get(wallet_id, "بدون محفظة"), "projected_income": total}
+        for wallet_id, total in calendar.pop("by_wallet").items()
+    ]
+    calendar["timestamp"] = datetime.now().isoformat()
+    return jsonify(calendar)
 
-            dividend_details.append({
-                "symbol": stock.symbol,
-                "name": stock.name,
-                "shares": stock.shares,
-                "buy_date": first_buy_date,
-                "total_dividends": divs.get("total_dividends", 0),
-                "dividend_count": divs.get("dividend_count", 0),
-                "dividends": divs.get("dividends", []),  # التفاصيل الكاملة
-                "upcoming": upcoming  # التوزيع القادم المتوقع
-            })
 
-    return jsonify({
-        "total_dividends": round(total_dividends, 2),
-        "stocks": dividend_details,
-        "timestamp": datetime.now().isoformat()
-    })
+@app.route('/api/dividends/refresh', methods=['GET', 'POST'])
+def refresh_dividend_events():
+    """تحديث أحداث التوزيعات والتقسيم لكل أسهم السوق في الخلفية (GET: الحالة فقط)"""
+    if request.method == 'GET':
+        return jsonify(corporate_actions.status())
+    if corporate_actions.refresh_status['running']:
+        return jsonify({"success": False, "message": "التحديث قيد التشغيل", **corporate_actions.refresh_status})
+    force = bool((request.get_json(silent=True) or {}).get('force'))
+    threading.Thread(target=corporate_actions.refresh, kwargs={"force": force}, daemon=True).start()
+    return jsonify({"success": True, "message": "جاري تحديث بيانات التوزيعات"})
 
 
 # ===== APIs الأخبار =====
@@ -1493,7 +1560,7 @@ def get_portfolio_by_strategy(strategy):
     total_profit_loss_percent = (total_profit_loss / total_cost * 100) if total_cost > 0 else 0
 
     return jsonify({
-        "stocks": [s.to_summary_dict() for s in stocks],
+        "stocks": [s.to_summary_dict(wants_orders()) for s in stocks],
         "summary": {
             "total_cost": total_cost,
             "total_value": total_value,
@@ -1519,667 +1586,252 @@ def get_wallets_by_strategy(strategy):
     })
 
 
-@app.route('/api/dashboard/stocks-analysis/<strategy>')
-def get_owned_stocks_analysis_by_strategy(strategy):
-    """الحصول على تحليل الأسهم المملوكة حسب الاستراتيجية"""
-    valid_strategies = ['speculative', 'balanced', 'long_term']
-    if strategy not in valid_strategies:
-        return jsonify({"error": "استراتيجية غير صالحة"}), 400
-
-    wallet_ids = wallet_manager.get_wallet_ids_by_strategy(strategy)
-    all_stocks = portfolio.get_all_stocks()
-    owned_stocks = [s for s in all_stocks if s.shares > 0 and s.get_wallet_id() in wallet_ids]
+def empty_stock_analysis() -> dict:
+    """تحليل فارغ عند تعذر جلب البيانات"""
+    return {
+        'levels': {'support': [], 'resistance': []},
+        'moving_averages': {'daily': {}, 'weekly': {}, 'monthly': {}},
+        'supply_demand': {'daily': {}, 'weekly': {}, 'monthly': {}},
+        'price_action': {'patterns': [], 'trend': 'neutral', 'signals': []},
+        'trading_levels': {'buy_levels': [], 'sell_levels': [], 'recommendation': 'انتظار'}
+    }
 
-    result = []
-    for stock in owned_stocks:
-        stock_data = stock.to_summary_dict()
 
-        try:
-            historical_data = TechnicalAnalysis.get_historical_data(stock.symbol, "6mo")
-
-            if historical_data:
-                levels = TechnicalAnalysis.calculate_support_resistance(historical_data)
-                moving_averages = calculate_moving_averages_from_data(historical_data)
-                supply_demand = calculate_supply_demand_zones(historical_data)
-                price_action = analyze_price_action(historical_data)
-                trading_levels = calculate_trading_levels(
-                    current_price=stock.current_price,
-                    avg_cost=stock.avg_buy_price,
-                    moving_averages=moving_averages,
-                    levels=levels,
-                    supply_demand=supply_demand,
-                    price_action=price_action
-                )
-
-                stock_data['analysis'] = {
-                    'levels': levels,
-                    'moving_averages': moving_averages,
-                    'supply_demand': supply_demand,
-                    'price_action': price_action,
-                    'trading_levels': trading_levels
-                }
-            else:
-                stock_data['analysis'] = {
-                    'levels': {'support': [], 'resistance': []},
-                    'moving_averages': {'daily': {}, 'weekly': {}, 'monthly': {}},
-                    'supply_demand': {'daily': {}, 'weekly': {}, 'monthly': {}},
-                    'price_action': {'patterns': [], 'trend': 'neutral', 'signals': []},
-                    'trading_levels': {'buy_levels': [], 'sell_levels': [], 'recommendation': 'انتظار'}
-                }
-        except Exception as e:
-            print(f"Error analyzing {stock.symbol}: {e}")
-            stock_data['analysis'] = {
-                'levels': {'support': [], 'resistance': []},
-                'moving_averages': {'daily': {}, 'weekly': {}, 'monthly': {}},
-                'supply_demand': {'daily': {}, 'weekly': {}, 'monthly': {}},
-                'price_action': {'patterns': [], 'trend': 'neutral', 'signals': []},
-                'trading_levels': {'buy_levels': [], 'sell_levels': [], 'recommendation': 'انتظار'}
-            }
+def build_analysis_bundle(historical_data, moving_averages=None):
+    """الجزء المعتمد على الشموع فقط من التحليل (يُحفظ كلقطة بعد الإغلاق)"""
+    if not historical_data:
+        return None
 
-        result.append(stock_data)
+    # حساب المتوسطات المتحركة من البيانات التاريخية (إن لم تحسب مسبقاً ضمن دفعة)
+    if moving_averages is None:
+        moving_averages = calculate_moving_averages_from_data(historical_data)
 
-    return jsonify({"stocks": result, "strategy": strategy})
+    return {
+        'levels': TechnicalAnalysis.calculate_support_resistance(historical_data),
+        'moving_averages': moving_averages,
+        'supply_demand': calculate_supply_demand_zones(historical_data),
+        'price_action': analyze_price_action(historical_data)
+    }
 
 
-@app.route('/api/dashboard/stocks-analysis')
-def get_owned_stocks_analysis():
-    """الحصول على تحليل الأسهم المملوكة مع الدعم والمقاومة والمتوسطات والبرايس أكشن"""
-    stocks = portfolio.get_all_stocks()
-    owned_stocks = [s for s in stocks if s.shares > 0]
+def overlay_analysis(bundle, current_price, avg_cost):
+    """إضافة الحقول المعتمدة على السعر الحالي (مستويات البيع والشراء ونسبها) فوق اللقطة"""
+    if not bundle:
+        return empty_stock_analysis()
 
-    result = []
-    for stock in owned_stocks:
-        stock_data = stock.to_summary_dict()
+    trading_levels = calculate_trading_levels(
+        current_price=current_price,
+        avg_cost=avg_cost,
+        moving_averages=bundle['moving_averages'],
+        levels=bundle['levels'],
+        supply_demand=bundle['supply_demand'],
+        price_action=bundle['price_action']
+    )
+    return {**bundle, 'trading_levels': trading_levels}
 
-        # الحصول على التحليل الفني
-        try:
-            # جلب البيانات التاريخية
-            historical_data = TechnicalAnalysis.get_historical_data(stock.symbol, "6mo")
-
-            if historical_data:
-                # حساب الدعم والمقاومة
-                levels = TechnicalAnalysis.calculate_support_resistance(historical_data)
-
-                # حساب المتوسطات المتحركة من البيانات التاريخية
-                moving_averages = calculate_moving_averages_from_data(historical_data)
-
-                # حساب مناطق العرض والطلب
-                supply_demand = calculate_supply_demand_zones(historical_data)
-
-                # تحليل البرايس أكشن
-                price_action = analyze_price_action(historical_data)
-
-                # حساب توصيات البيع والشراء مع النسب
-                trading_levels = calculate_trading_levels(
-                    current_price=stock.current_price,
-                    avg_cost=stock.avg_buy_price,
-                    moving_averages=moving_averages,
-                    levels=levels,
-                    supply_demand=supply_demand,
-                    price_action=price_action
-                )
-
-                stock_data['analysis'] = {
-                    'levels': levels,
-                    'moving_averages': moving_averages,
-                    'supply_demand': supply_demand,
-                    'price_action': price_action,
-                    'trading_levels': trading_levels
-                }
-            else:
-                stock_data['analysis'] = {
-                    'levels': {'support': [], 'resistance': []},
-                    'moving_averages': {'daily': {}, 'weekly': {}, 'monthly': {}},
-                    'supply_demand': {'daily': {}, 'weekly': {}, 'monthly': {}},
-                    'price_action': {'patterns': [], 'trend': 'neutral', 'signals': []},
-                    'trading_levels': {'buy_levels': [], 'sell_levels': [], 'recommendation': 'انتظار'}
-                }
-        except Exception as e:
-            print(f"Error analyzing {stock.symbol}: {e}")
-            stock_data['analysis'] = {
-                'levels': {'support': [], 'resistance': []},
-                'moving_averages': {'daily': {}, 'weekly': {}, 'monthly': {}},
-                'supply_demand': {'daily': {}, 'weekly': {}, 'monthly': {}},
-                'price_action': {'patterns': [], 'trend': 'neutral', 'signals': []},
-                'trading_levels': {'buy_levels': [], 'sell_levels': [], 'recommendation': 'انتظار'}
-            }
 
-        result.append(stock_data)
+def analyze_stock(historical_data, current_price, avg_cost, moving_averages=None):
+    """التحليل الفني الكامل لسهم: الدعم والمقاومة والمتوسطات والعرض والطلب والبرايس أكشن"""
+    return overlay_analysis(build_analysis_bundle(historical_data, moving_averages),
+                            current_price, avg_cost)
 
-    return jsonify({"stocks": result})
 
+def build_bundles_parallel(symbols):
+    """جلب البيانات التاريخية بالتوازي وبناء لقطات التحليل وحفظها (خارج وقت التداول)
 
-def calculate_trading_levels(current_price, avg_cost, moving_averages, levels, supply_demand, price_action):
+    ترجع (اللقطات حسب الرمز، الرموز التي انتهت مهلتها)
     """
-    حساب مستويات البيع والشراء المقترحة مع النسب من متوسط التكلفة
-    بناءً على المتوسطات المتحركة والبرايس أكشن ومناطق العرض والطلب
-    """
-    buy_levels = []
-    sell_levels = []
-
-    if not current_price or current_price <= 0:
-        return {'buy_levels': [], 'sell_levels': [], 'recommendation': 'غير متوفر'}
-
-    # حساب النسبة من متوسط التكلفة
-    def calc_percent_from_avg(price):
-        if avg_cost and avg_cost > 0:
-            return round(((price - avg_cost) / avg_cost) * 100, 2)
-        return 0
-
-    # ========== مستويات الشراء (أسفل السعر الحالي) ==========
-
-    # 1. من مناطق الطلب (Demand Zones)
-    daily_demand = supply_demand.get('daily', {}).get('demand', [])
-    weekly_demand = supply_demand.get('weekly', {}).get('demand', [])
-
-    for zone in daily_demand[:2]:
-        zone_price = zone.get('high', 0)
-        if zone_price < current_price:
-            buy_levels.append({
-                'price': zone_price,
-                'percent_from_current': round(((zone_price - current_price) / current_price) * 100, 2),
-                'percent_from_avg': calc_percent_from_avg(zone_price),
-                'source': 'منطقة طلب يومية',
-                'strength': zone.get('strength', 'moderate'),
-                'reason': 'منطقة شراء قوية - ارتداد متوقع'
-            })
+    futures = {
+        analysis_executor.submit(TechnicalAnalysis.get_historical_data, symbol, "6mo"): symbol
+        for symbol in symbols
+    }
 
-    for zone in weekly_demand[:1]:
-        zone_price = zone.get('high', 0)
-        if zone_price < current_price:
-            buy_levels.append({
-                'price': zone_price,
-                'percent_from_current': round(((zone_price - current_price) / current_price) * 100, 2),
-                'percent_from_avg': calc_percent_from_avg(zone_price),
-                'source': 'منطقة طلب أسبوعية',
-                'strength': 'strong',
-                'reason': 'منطقة شراء أسبوعية - دعم قوي'
-            })
+    done, not_done = wait(futures, timeout=ANALYSIS_TIMEOUT)
 
-    # 2. من مستويات الدعم
-    supports = levels.get('support', [])
-    for i, support in enumerate(supports[:3]):
-        if support < current_price:
-            buy_levels.append({
-                'price': round(support, 2),
-                'percent_from_current': round(((support - current_price) / current_price) * 100, 2),
-                'percent_from_avg': calc_percent_from_avg(support),
-                'source': f'دعم {i+1}',
-                'strength': 'strong' if i == 0 else 'moderate',
-                'reason': f'مستوى دعم {"رئيسي" if i == 0 else "ثانوي"}'
-            })
+    histories = {}
+    for future in done:
+        try:
+            history = future.result()
+        except Exception as e:
+            print(f"Error fetching history for {futures[future]}: {e}")
+            continue
+        if history:
+            histories[futures[future]] = history
 
-    # 3. من المتوسطات المتحركة (أقل من السعر الحالي)
-    daily_mas = moving_averages.get('daily', {})
-    ma_buy_sources = [
-        ('sma_50', 'متوسط 50 يوم', 'strong'),
-        ('sma_200', 'متوسط 200 يوم', 'strong'),
-        ('ema_20', 'متوسط أسي 20', 'moderate'),
-    ]
+    for future in not_done:
+        future.cancel()
+    timed_out = [futures[future] for future in not_done]
 
-    for ma_key, ma_name, strength in ma_buy_sources:
-        ma_value = daily_mas.get(ma_key)
-        if ma_value and ma_value < current_price:
-            buy_levels.append({
-                'price': ma_value,
-                'percent_from_current': round(((ma_value - current_price) / current_price) * 100, 2),
-                'percent_from_avg': calc_percent_from_avg(ma_value),
-                'source': ma_name,
-                'strength': strength,
-                'reason': f'شراء عند {ma_name} - دعم متحرك'
-            })
+    available = list(histories)
+    batch_mas = calculate_moving_averages_batch([histories[symbol] for symbol in available])
 
-    # ========== مستويات البيع (أعلى السعر الحالي) ==========
-
-    # 1. من مناطق العرض (Supply Zones)
-    daily_supply = supply_demand.get('daily', {}).get('supply', [])
-    weekly_supply = supply_demand.get('weekly', {}).get('supply', [])
-
-    for zone in daily_supply[:2]:
-        zone_price = zone.get('low', 0)
-        if zone_price > current_price:
-            sell_levels.append({
-                'price': zone_price,
-                'percent_from_current': round(((zone_price - current_price) / current_price) * 100, 2),
-                'percent_from_avg': calc_percent_from_avg(zone_price),
-                'source': 'منطقة عرض يومية',
-                'strength': zone.get('strength', 'moderate'),
-                'reason': 'منطقة بيع - مقاومة متوقعة'
-            })
+    bundles = {}
+    stored = 0
+    for symbol, moving_averages in zip(available, batch_mas):
+        try:
+            bundles[symbol] = build_analysis_bundle(histories[symbol], moving_averages)
+        except Exception as e:
+            print(f"Error analyzing {symbol}: {e}")
+            continue
+        # أثناء التداول لا تُحفظ (شمعة اليوم لم تكتمل)
+        stored += analysis_snapshots.put(symbol, bundles[symbol])
 
-    for zone in weekly_supply[:1]:
-        zone_price = zone.get('low', 0)
-        if zone_price > current_price:
-            sell_levels.append({
-                'price': zone_price,
-                'percent_from_current': round(((zone_price - current_price) / current_price) * 100, 2),
-                'percent_from_avg': calc_percent_from_avg(zone_price),
-                'source': 'منطقة عرض أسبوعية',
-                'strength': 'strong',
-                'reason': 'منطقة بيع أسبوعية - مقاومة قوية'
-            })
+    if stored:
+        analysis_snapshots.save()
 
-    # 2. من مستويات المقاومة
-    resistances = levels.get('resistance', [])
-    for i, resistance in enumerate(resistances[:3]):
-        if resistance > current_price:
-            sell_levels.append({
-                'price': round(resistance, 2),
-                'percent_from_current': round(((resistance - current_price) / current_price) * 100, 2),
-                'percent_from_avg': calc_percent_from_avg(resistance),
-                'source': f'مقاومة {i+1}',
-                'strength': 'strong' if i == 0 else 'moderate',
-                'reason': f'مستوى مقاومة {"رئيسي" if i == 0 else "ثانوي"}'
-            })
+    return bundles, timed_out
 
-    # 3. من المتوسطات المتحركة (أعلى من السعر الحالي)
-    for ma_key, ma_name, strength in ma_buy_sources:
-        ma_value = daily_mas.get(ma_key)
-        if ma_value and ma_value > current_price:
-            sell_levels.append({
-                'price': ma_value,
-                'percent_from_current': round(((ma_value - current_price) / current_price) * 100, 2),
-                'percent_from_avg': calc_percent_from_avg(ma_value),
-                'source': ma_name,
-                'strength': strength,
-                'reason': f'مقاومة عند {ma_name}'
-            })
 
-    # 4. أهداف ربح بناءً على متوسط التكلفة
-    if avg_cost and avg_cost > 0:
-        profit_targets = [
-            (5, 'هدف ربح 5%', 'moderate'),
-            (10, 'هدف ربح 10%', 'moderate'),
-            (15, 'هدف ربح 15%', 'strong'),
-            (20, 'هدف ربح 20%', 'strong'),
-        ]
-
-        for percent, name, strength in profit_targets:
-            target_price = round(avg_cost * (1 + percent / 100), 2)
-            if target_price > current_price:
-                sell_levels.append({
-                    'price': target_price,
-                    'percent_from_current': round(((target_price - current_price) / current_price) * 100, 2),
-                    'percent_from_avg': percent,
-                    'source': name,
-                    'strength': strength,
-                    'reason': f'جني أرباح عند {percent}% من متوسط التكلفة'
-                })
+def build_analysis_snapshots():
+    """بناء لقطات التحليل لكل أسهم المحفظة (المملوكة والمتابَعة)"""
+    symbols = sorted({stock.symbol for stock in portfolio.get_all_stocks()})
+    TechnicalAnalysis.clear_history_cache()  # التأكد من تضمين شمعة الإغلاق
+    bundles, _ = build_bundles_parallel(symbols)
+    return len(bundles)
 
-    # ترتيب المستويات
-    buy_levels.sort(key=lambda x: x['price'], reverse=True)  # الأقرب للسعر أولاً
-    sell_levels.sort(key=lambda x: x['price'])  # الأقرب للسعر أولاً
-
-    # إزالة المكرر وأخذ أفضل 5
-    def remove_duplicates(levels_list):
-        seen_prices = set()
-        unique = []
-        for level in levels_list:
-            price_key = round(level['price'], 1)
-            if price_key not in seen_prices:
-                seen_prices.add(price_key)
-                unique.append(level)
-        return unique[:5]
-
-    buy_levels = remove_duplicates(buy_levels)
-    sell_levels = remove_duplicates(sell_levels)
-
-    # ========== التوصية النهائية ==========
-    trend = price_action.get('trend', 'neutral')
-    signals = price_action.get('signals', [])
-
-    # حساب التوصية بناءً على المؤشرات
-    buy_signals = sum(1 for s in signals if s.get('signal') == 'شراء')
-    sell_signals = sum(1 for s in signals if s.get('signal') == 'بيع')
-
-    # موقع السعر من متوسط التكلفة
-    price_vs_avg = calc_percent_from_avg(current_price)
-
-    # موقع السعر من المتوسطات
-    sma_20 = daily_mas.get('sma_20', current_price)
-    sma_50 = daily_mas.get('sma_50', current_price)
-
-    recommendation = 'انتظار'
-    recommendation_reason = []
-
-    if trend == 'bullish':
-        recommendation_reason.append('الاتجاه صاعد')
-    elif trend == 'bearish':
-        recommendation_reason.append('الاتجاه هابط')
-
-    if price_vs_avg < -10:
-        recommendation = 'تعزيز'
-        recommendation_reason.append(f'السعر أقل من المتوسط بـ {abs(price_vs_avg):.1f}%')
-    elif price_vs_avg > 15:
-        recommendation = 'جني أرباح جزئي'
-        recommendation_reason.append(f'ربح {price_vs_avg:.1f}% من المتوسط')
-    elif current_price < sma_20 and current_price < sma_50 and trend == 'bearish':
-        recommendation = 'انتظار أو تخفيف'
-        recommendation_reason.append('السعر تحت المتوسطات')
-    elif current_price > sma_20 and trend == 'bullish':
-        recommendation = 'احتفاظ'
-        recommendation_reason.append('السعر فوق المتوسطات')
-
-    if buy_signals > sell_signals:
-        if recommendation == 'انتظار':
-            recommendation = 'شراء محتمل'
-        recommendation_reason.append(f'{buy_signals} إشارة شراء')
-    elif sell_signals > buy_signals:
-        if recommendation == 'انتظار':
-            recommendation = 'بيع محتمل'
-        recommendation_reason.append(f'{sell_signals} إشارة بيع')
 
-    return {
-        'buy_levels': buy_levels,
-        'sell_levels': sell_levels,
-        'recommendation': recommendation,
-        'recommendation_reason': ' | '.join(recommendation_reason) if recommendation_reason else 'لا توجد إشارات واضحة',
-        'current_vs_avg': {
-            'percent': price_vs_avg,
-            'status': 'ربح' if price_vs_avg > 0 else 'خسارة' if price_vs_avg < 0 else 'تعادل'
-        }
-    }
+def analyze_stocks_parallel(stocks) -> dict:
+    """تحليل عدة أسهم من لقطات ما بعد الإغلاق مع تحديث الحقول المعتمدة على السعر
 
+    الأسهم التي لا توجد لها لقطة صالحة تُحلل فوراً: تُجلب بياناتها بالتوازي عبر
+    مجمع خيوط محدود ومحدد المعدل المشترك، والتي لا تصل بياناتها خلال
+    ANALYSIS_TIMEOUT تُرجع بتحليل فارغ بدلاً من إفشال الصفحة.
+    """
+    result = [stock.to_summary_dict() for stock in stocks]
 
-def calculate_moving_averages_from_data(data):
-    """حساب المتوسطات المتحركة من البيانات التاريخية"""
-    if not data or not data.get('close'):
-        return {'daily': {}, 'weekly': {}, 'monthly': {}}
-
-    closes = [c for c in data['close'] if c is not None]
-
-    if not closes:
-        return {'daily': {}, 'weekly': {}, 'monthly': {}}
-
-    # حساب المتوسطات اليومية
-    daily = {}
-    for period in [10, 20, 50, 200]:
-        if len(closes) >= period:
-            # SMA
-            sma = sum(closes[-period:]) / period
-            daily[f'sma_{period}'] = round(sma, 2)
-
-            # EMA
-            ema = calculate_ema(closes, period)
-            if ema:
-                daily[f'ema_{period}'] = round(ema, 2)
-
-    # حساب المتوسطات الأسبوعية (تقريبية - كل 5 أيام)
-    weekly_closes = closes[::5] if len(closes) >= 5 else closes
-    weekly = {}
-    for period in [10, 20, 50]:
-        if len(weekly_closes) >= period:
-            sma = sum(weekly_closes[-period:]) / period
-            weekly[f'sma_{period}'] = round(sma, 2)
-            ema = calculate_ema(weekly_closes, period)
-            if ema:
-                weekly[f'ema_{period}'] = round(ema, 2)
-
-    # حساب المتوسطات الشهرية (تقريبية - كل 20 يوم)
-    monthly_closes = closes[::20] if len(closes) >= 20 else closes
-    monthly = {}
-    for period in [10, 20]:
-        if len(monthly_closes) >= period:
-            sma = sum(monthly_closes[-period:]) / period
-            monthly[f'sma_{period}'] = round(sma, 2)
-            ema = calculate_ema(monthly_closes, period)
-            if ema:
-                monthly[f'ema_{period}'] = round(ema, 2)
+    bundles = {}
+    for stock in stocks:
+        bundle = analysis_snapshots.get(stock.symbol)
+        if bundle is not None:
+            bundles[stock.symbol] = bundle
+
+    missing = sorted({stock.symbol for stock in stocks} - set(bundles))
+    timed_out = []
+    if missing:
+        built, timed_out = build_bundles_parallel(missing)
+        bundles.update(built)
+
+    for i, stock in enumerate(stocks):
+        if stock.symbol in timed_out:
+            result[i]['analysis_timed_out'] = True
+        try:
+            result[i]['analysis'] = overlay_analysis(bundles.get(stock.symbol),
+                                                     stock.current_price, stock.avg_buy_price)
+        except Exception as e:
+            print(f"Error analyzing {stock.symbol}: {e}")
+            result[i]['analysis'] = empty_stock_analysis()
 
     return {
-        'daily': daily,
-        'weekly': weekly,
-        'monthly': monthly
+        "stocks": result,
+        "partial": bool(timed_out),
+        "timed_out": [r['symbol'] for r in result if r.get('analysis_timed_out')]
     }
 
 
-def calculate_supply_demand_zones(data):
-    """حساب مناطق العرض والطلب (Supply & Demand Zones)"""
-    if not data or not data.get('high') or not data.get('low') or not data.get('close') or not data.get('open'):
-        return {'daily': {}, 'weekly': {}, 'monthly': {}}
-
-    highs = [h for h in data['high'] if h is not None]
-    lows = [l for l in data['low'] if l is not None]
-    closes = [c for c in data['close'] if c is not None]
-    opens = [o for o in data['open'] if o is not None]
-    volumes = data.get('volume', [])
-    volumes = [v for v in volumes if v is not None]
-
-    if len(highs) < 20 or len(lows) < 20:
-        return {'daily': {}, 'weekly': {}, 'monthly': {}}
-
-    current_price = closes[-1] if closes else 0
-
-    def find_zones(h_list, l_list, c_list, o_list, v_list, lookback=50):
-        """إيجاد مناطق العرض والطلب"""
-        demand_zones = []  # مناطق الطلب (شراء)
-        supply_zones = []  # مناطق العرض (بيع)
-
-        # تحديد عدد الشموع للتحليل
-        n = min(len(h_list), len(l_list), len(c_list), len(o_list), lookback)
-        if n < 10:
-            return [], []
-
-        # البحث عن مناطق الطلب (قاع قوي يليه صعود)
-        for i in range(3, n - 3):
-            idx = -n + i
-
-            # شمعة هبوط قوية تليها شمعة صعود قوية (Demand Zone)
-            if (o_list[idx] > c_list[idx] and  # شمعة هبوط
-                c_list[idx + 1] > o_list[idx + 1] and  # شمعة صعود بعدها
-                c_list[idx + 1] > h_list[idx] and  # إغلاق أعلى من قمة الهبوط
-                l_list[idx] < l_list[idx - 1] and l_list[idx] < l_list[idx + 1]):  # قاع محلي
-
-                zone_low = l_list[idx]
-                zone_high = min(o_list[idx], c_list[idx])
-
-                # التحقق من أن المنطقة لم تُخترق
-                not_broken = all(l_list[j] >= zone_low * 0.98 for j in range(idx + 2, 0))
-
-                if not_broken and zone_low < current_price:
-                    demand_zones.append({
-                        'low': round(zone_low, 2),
-                        'high': round(zone_high, 2),
-                        'strength': 'strong' if abs(c_list[idx + 1] - o_list[idx + 1]) > abs(o_list[idx] - c_list[idx]) else 'moderate'
-                    })
-
-            # شمعة صعود قوية تليها شمعة هبوط قوية (Supply Zone)
-            if (c_list[idx] > o_list[idx] and  # شمعة صعود
-                o_list[idx + 1] > c_list[idx + 1] and  # شمعة هبوط بعدها
-                c_list[idx + 1] < l_list[idx] and  # إغلاق أقل من قاع الصعود
-                h_list[idx] > h_list[idx - 1] and h_list[idx] > h_list[idx + 1]):  # قمة محلية
-
-                zone_low = max(o_list[idx], c_list[idx])
-                zone_high = h_list[idx]
-
-                # التحقق من أن المنطقة لم تُخترق
-                not_broken = all(h_list[j] <= zone_high * 1.02 for j in range(idx + 2, 0))
-
-                if not_broken and zone_high > current_price:
-                    supply_zones.append({
-                        'low': round(zone_low, 2),
-                        'high': round(zone_high, 2),
-                        'strength': 'strong' if abs(o_list[idx + 1] - c_list[idx + 1]) > abs(c_list[idx] - o_list[idx]) else 'moderate'
-                    })
-
-        # إزالة المناطق المتداخلة والاحتفاظ بالأقوى
-        demand_zones = remove_overlapping_zones(demand_zones, 'demand')[:3]
-        supply_zones = remove_overlapping_zones(supply_zones, 'supply')[:3]
-
-        return demand_zones, supply_zones
-
-    def remove_overlapping_zones(zones, zone_type):
-        """إزالة المناطق المتداخلة"""
-        if not zones:
-            return []
-
-        # ترتيب حسب القوة ثم السعر
-        if zone_type == 'demand':
-            zones.sort(key=lambda x: (x['strength'] == 'strong', x['low']), reverse=True)
-        else:
-            zones.sort(key=lambda x: (x['strength'] == 'strong', -x['high']), reverse=True)
-
-        filtered = []
-        for zone in zones:
-            overlaps = False
-            for existing in filtered:
-                if (zone['low'] <= existing['high'] and zone['high'] >= existing['low']):
-                    overlaps = True
-                    break
-            if not overlaps:
-                filtered.append(zone)
-
-        return filtered
-
-    # حساب المناطق اليومية
-    daily_demand, daily_supply = find_zones(highs, lows, closes, opens, volumes, 50)
-
-    # حساب المناطق الأسبوعية (تجميع كل 5 أيام)
-    def aggregate_to_weekly(h, l, c, o, v):
-        w_h, w_l, w_c, w_o, w_v = [], [], [], [], []
-        for i in range(0, len(h) - 4, 5):
-            w_h.append(max(h[i:i+5]))
-            w_l.append(min(l[i:i+5]))
-            w_o.append(o[i])
-            w_c.append(c[i+4] if i+4 < len(c) else c[-1])
-            if v:
-                w_v.append(sum(v[i:i+5]) if i+5 <= len(v) else sum(v[i:]))
-        return w_h, w_l, w_c, w_o, w_v
-
-    w_h, w_l, w_c, w_o, w_v = aggregate_to_weekly(highs, lows, closes, opens, volumes)
-    weekly_demand, weekly_supply = find_zones(w_h, w_l, w_c, w_o, w_v, 20) if len(w_h) >= 10 else ([], [])
-
-    # حساب المناطق الشهرية (تجميع كل 20 يوم)
-    def aggregate_to_monthly(h, l, c, o, v):
-        m_h, m_l, m_c, m_o, m_v = [], [], [], [], []
-        for i in range(0, len(h) - 19, 20):
-            m_h.append(max(h[i:i+20]))
-            m_l.append(min(l[i:i+20]))
-            m_o.append(o[i])
-            m_c.append(c[i+19] if i+19 < len(c) else c[-1])
-            if v:
-                m_v.append(sum(v[i:i+20]) if i+20 <= len(v) else sum(v[i:]))
-        return m_h, m_l, m_c, m_o, m_v
-
-    m_h, m_l, m_c, m_o, m_v = aggregate_to_monthly(highs, lows, closes, opens, volumes)
-    monthly_demand, monthly_supply = find_zones(m_h, m_l, m_c, m_o, m_v, 10) if len(m_h) >= 5 else ([], [])
-
-    return {
-        'daily': {'demand': daily_demand, 'supply': daily_supply},
-        'weekly': {'demand': weekly_demand, 'supply': weekly_supply},
-        'monthly': {'demand': monthly_demand, 'supply': monthly_supply}
-    }
+@app.route('/api/screener')
+def screen_market():
+    """فحص كل أسهم السوق من البيانات المخزنة محلياً
 
+    filters: مفاتيح مفصولة بفواصل (مثل near_demand,volume_spike,above_sma50)
+    """
+    filters = [f.strip() for f in request.args.get('filters', '').split(',') if f.strip()]
+    return jsonify(market_screener.screen(
+        filters=filters,
+        sector=request.args.get('sector') or None,
+        sort=request.args.get('sort', 'score'),
+        limit=request.args.get('limit', 50, type=int)
+    ))
 
-def analyze_price_action(data):
-    """تحليل البرايس أكشن (Price Action Analysis)"""
-    if not data or not data.get('high') or not data.get('low') or not data.get('close') or not data.get('open'):
-        return {'patterns': [], 'trend': 'neutral', 'signals': []}
 
-    highs = [h for h in data['high'] if h is not None]
-    lows = [l for l in data['low'] if l is not None]
-    closes = [c for c in data['close'] if c is not None]
-    opens = [o for o in data['open'] if o is not None]
+@app.route('/api/screener/refresh', methods=['POST'])
+def refresh_screener_data():
+    """تحديث الشموع المخزنة لكل أسهم السوق في الخلفية"""
+    if market_screener.refresh_status['running']:
+        return jsonify({"success": False, "message": "التحديث قيد التشغيل", **market_screener.refresh_status})
+    threading.Thread(target=market_screener.refresh, daemon=True).start()
+    return jsonify({"success": True, "message": "جاري تحديث بيانات السوق"})
 
-    if len(closes) < 20:
-        return {'patterns': [], 'trend': 'neutral', 'signals': []}
 
-    patterns = []
-    signals = []
-    current_price = closes[-1]
+# آخر نتيجة اختبار تاريخي (يعمل في الخلفية لأن فحص كل السوق قد يستغرق دقائق)
+backtest_state = {"running": False, "report": None, "error": None}
+backtest_lock = threading.Lock()
 
-    # تحليل الاتجاه
-    sma_20 = sum(closes[-20:]) / 20
-    sma_50 = sum(closes[-50:]) / 50 if len(closes) >= 50 else sma_20
 
-    if current_price > sma_20 > sma_50:
-        trend = 'bullish'
-        trend_ar = 'صاعد'
-    elif current_price < sma_20 < sma_50:
-        trend = 'bearish'
-        trend_ar = 'هابط'
-    else:
-        trend = 'neutral'
-        trend_ar = 'متذبذب'
+def run_backtest_job(symbols, strategy, years):
+    """تشغيل الاختبار التاريخي وحفظ النتيجة"""
+    try:
+        backtest_state["report"] = backtest.run_backtest(symbols, strategy, years)
+        backtest_state["error"] = None
+    except Exception as e:
+        print(f"خطأ في الاختبار التاريخي: {e}")
+        backtest_state["error"] = str(e)
+    finally:
+        backtest_state["running"] = False
 
-    # تحليل آخر 5 شموع للأنماط
-    for i in range(-5, -1):
-        try:
-            o, h, l, c = opens[i], highs[i], lows[i], closes[i]
-            o_next, h_next, l_next, c_next = opens[i+1], highs[i+1], lows[i+1], closes[i+1]
-
-            body = abs(c - o)
-            upper_wick = h - max(o, c)
-            lower_wick = min(o, c) - l
-            total_range = h - l
-
-            if total_range == 0:
-                continue
-
-            # نمط المطرقة (Hammer) - إشارة شراء
-            if lower_wick > body * 2 and upper_wick < body * 0.5 and c > o:
-                patterns.append({'name': 'مطرقة (Hammer)', 'type': 'bullish', 'position': i})
-                signals.append({'signal': 'شراء', 'reason': 'نمط المطرقة - انعكاس صعودي محتمل'})
-
-            # نمط الشهاب (Shooting Star) - إشارة بيع
-            if upper_wick > body * 2 and lower_wick < body * 0.5 and o > c:
-                patterns.append({'name': 'شهاب (Shooting Star)', 'type': 'bearish', 'position': i})
-                signals.append({'signal': 'بيع', 'reason': 'نمط الشهاب - انعكاس هبوطي محتمل'})
-
-            # نمط الابتلاع الصعودي (Bullish Engulfing)
-            if o > c and c_next > o_next and c_next > o and o_next < c:
-                patterns.append({'name': 'ابتلاع صعودي', 'type': 'bullish', 'position': i})
-                signals.append({'signal': 'شراء', 'reason': 'نمط الابتلاع الصعودي'})
-
-            # نمط الابتلاع الهبوطي (Bearish Engulfing)
-            if c > o and o_next > c_next and o_next > c and c_next < o:
-                patterns.append({'name': 'ابتلاع هبوطي', 'type': 'bearish', 'position': i})
-                signals.append({'signal': 'بيع', 'reason': 'نمط الابتلاع الهبوطي'})
-
-            # نمط الدوجي (Doji)
-            if body < total_range * 0.1:
-                patterns.append({'name': 'دوجي (Doji)', 'type': 'neutral', 'position': i})
-                signals.append({'signal': 'انتظار', 'reason': 'نمط الدوجي - تردد في السوق'})
-
-        except (IndexError, TypeError):
-            continue
 
-    # تحليل القمم والقيعان
-    recent_highs = highs[-20:]
-    recent_lows = lows[-20:]
+@app.route('/api/backtest', methods=['GET', 'POST'])
+def backtest_strategies():
+    """اختبار توصيات التحليل على البيانات المخزنة
 
-    if len(recent_highs) >= 3:
-        # Higher Highs and Higher Lows
-        if recent_highs[-1] > recent_highs[-5] and recent_lows[-1] > recent_lows[-5]:
-            patterns.append({'name': 'قمم وقيعان صاعدة', 'type': 'bullish', 'position': -1})
+    POST: {"strategy": "recommendation|trading_levels", "years": 3, "symbols": [...]}
+    GET: حالة الاختبار وآخر نتيجة
+    """
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        strategy = data.get('strategy', 'recommendation')
+        if strategy not in backtest.STRATEGIES:
+            return jsonify({"error": "استراتيجية غير صالحة"}), 400
+        try:
+            years = float(data.get('years', 3))
+        except (TypeError, ValueError):
+            return jsonify({"error": "عدد السنوات غير صالح"}), 400
+        if not 0 < years <= 50:
+            return jsonify({"error": "عدد السنوات غير صالح"}), 400
+
+        with backtest_lock:
+            if backtest_state["running"]:
+                return jsonify({"success": False, "message": "الاختبار قيد التشغيل"})
+            backtest_state["running"] = True
+        threading.Thread(
+            target=run_backtest_job,
+            args=(data.get('symbols') or None, strategy, years),
+            daemon=True
+        ).start()
+        return jsonify({"success": True, "message": "جاري تشغيل الاختبار التاريخي"})
+
+    return jsonify(backtest_state)
+
+
+@app.route('/api/analysis/snapshots', methods=['GET', 'POST'])
+def analysis_snapshots_status():
+    """حالة لقطات التحليل، و POST لإعادة بنائها في الخلفية"""
+    if request.method == 'POST':
+        threading.Thread(target=build_analysis_snapshots, daemon=True).start()
+        return jsonify({"success": True, "message": "جاري بناء لقطات التحليل", **analysis_snapshots.status()})
+    return jsonify(analysis_snapshots.status())
 
-        # Lower Highs and Lower Lows
-        if recent_highs[-1] < recent_highs[-5] and recent_lows[-1] < recent_lows[-5]:
-            patterns.append({'name': 'قمم وقيعان هابطة', 'type': 'bearish', 'position': -1})
 
-    return {
-        'patterns': patterns[-5:],  # آخر 5 أنماط
-        'trend': trend,
-        'trend_ar': trend_ar,
-        'signals': signals[-3:],  # آخر 3 إشارات
-        'current_price': round(current_price, 2),
-        'sma_20': round(sma_20, 2),
-        'sma_50': round(sma_50, 2) if len(closes) >= 50 else None
-    }
+@app.route('/api/dashboard/stocks-analysis/<strategy>')
+def get_owned_stocks_analysis_by_strategy(strategy):
+    """الحصول على تحليل الأسهم المملوكة حسب الاستراتيجية"""
+    valid_strategies = ['speculative', 'balanced', 'long_term']
+    if strategy not in valid_strategies:
+        return jsonify({"error": "استراتيجية غير صالحة"}), 400
 
+    wallet_ids = wallet_manager.get_wallet_ids_by_strategy(strategy)
+    all_stocks = portfolio.get_all_stocks()
+    owned_stocks = [s for s in all_stocks if s.shares > 0 and s.get_wallet_id() in wallet_ids]
 
-def calculate_ema(prices, period):
-    """حساب المتوسط المتحرك الأسي"""
-    if len(prices) < period:
-        return None
+    return jsonify({**analyze_stocks_parallel(owned_stocks), "strategy": strategy})
 
-    multiplier = 2 / (period + 1)
-    ema = sum(prices[:period]) / period  # SMA أولاً
 
-    for price in prices[period:]:
-        ema = (price * multiplier) + (ema * (1 - multiplier))
+@app.route('/api/dashboard/stocks-analysis')
+def get_owned_stocks_analysis():
+    """الحصول على تحليل الأسهم المملوكة مع الدعم والمقاومة والمتوسطات والبرايس أكشن"""
+    stocks = portfolio.get_all_stocks()
+    owned_stocks = [s for s in stocks if s.shares > 0]
 
-    return ema
+    return jsonify(analyze_stocks_parallel(owned_stocks))
 
 
 # ================== Wallet Performance Analysis APIs ==================
@@ -2320,6 +1972,7 @@ def analyze_wallet_performance(wallet_id, wallet_name, wallet_stocks):
                 shares_to_sell = sell_shares
                 buy_dates = []
                 holding_days_list = []
+                sold_lots = []  # (عدد الأسهم، تاريخ الشراء، تاريخ البيع) لحساب التوزيعات
 
                 while shares_to_sell > 0 and buy_queue:
                     buy = buy_queue[0]
@@ -2328,6 +1981,7 @@ def analyze_wallet_performance(wallet_id, wallet_name, wallet_stocks):
                         cost_of_sold += buy['cost']
                         shares_to_sell -= buy['shares']
                         buy_dates.append(buy['date'])
+                        sold_lots.append((buy['shares'], buy['date'], sell_date))
 
                         # حساب مدة الاحتفاظ
                         try:
@@ -2345,6 +1999,7 @@ def analyze_wallet_performance(wallet_id, wallet_name, wallet_stocks):
                         buy['shares'] -= shares_to_sell
                         buy['cost'] *= (1 - ratio)
                         buy_dates.append(buy['date'])
+                        sold_lots.append((shares_to_sell, buy['date'], sell_date))
 
                         try:
                             buy_dt = datetime.strptime(buy['date'], '%Y-%m-%d')
@@ -2355,15 +2010,12 @@ def analyze_wallet_performance(wallet_id, wallet_name, wallet_stocks):
 
                         shares_to_sell = 0
 
-                # حساب التوزيعات خلال فترة الاحتفاظ
+                # حساب التوزيعات خلال فترة احتفاظ كل دفعة مباعة
                 dividends_during_hold = 0
-                if buy_dates:
-                    first_buy_date = min(buy_dates)
-                    div_data = DividendTracker.get_dividends_received(symbol, first_buy_date, sell_shares)
-                    # فقط التوزيعات قبل تاريخ البيع
-                    for div in div_data.get('dividends', []):
-                        if div['date'] <= sell_date:
-                            dividends_during_hold += div['total_amount']
+                if sold_lots:
+                    div_data = DividendTracker.get_lot_dividends(
+                        symbol, sold_lots, share_multiplier=stock.get_corporate_action_multiplier)
+                    dividends_during_hold = div_data['total_dividends']
                     total_dividends += dividends_during_hold
 
                 # حساب الربح/الخسارة
@@ -2414,7 +2066,9 @@ def analyze_wallet_performance(wallet_id, wallet_name, wallet_stocks):
 
             # حساب التوزيعات للمراكز المفتوحة
             first_buy_date = min(b['date'] for b in buy_queue)
-            div_data = DividendTracker.get_dividends_received(symbol, first_buy_date, remaining_shares)
+            div_data = DividendTracker.get_lot_dividends(
+                symbol, [(b['shares'], b['date'], None) for b in buy_queue],
+                share_multiplier=stock.get_corporate_action_multiplier)
             open_dividends = div_data.get('total_dividends', 0)
             total_dividends += open_dividends
 
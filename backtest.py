@@ -0,0 +1,441 @@
+"""
+اختبار توصيات التحليل الفني على البيانات التاريخية
+Backtesting Engine - replays cached daily OHLCV through the recommendation rules
+
+يعيد توليد إشارات get_recommendation و calculate_trading_levels لكل شمعة
+باستخدام البيانات المتاحة حتى إغلاقها فقط، ثم ينفذ الأوامر على افتتاح الشمعة
+التالية مع عمولة وضريبة الإعدادات. الإشارات تُحسب متجهة لكل السلسلة، وكل
+سهم يُختبر في عملية مستقلة.
+
+الاستراتيجيات:
+- recommendation: شراء عند توصية buy وبيع عند توصية sell (قواعد get_recommendation)
+- trading_levels: شراء عند "شراء محتمل" وبيع عند توصيات البيع/جني الأرباح
+  (قواعد calculate_trading_levels مع متوسط تكلفة المركز المفتوح)
+
+الاستخدام:
+    python backtest.py --strategy recommendation --years 3 [رموز...]
+    python backtest.py --years 3 --no-fetch   # بدون تنزيل التاريخ الناقص
+    python backtest.py --verify 2222   # مقارنة الإشارات المتجهة بالدوال الأصلية
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+import indicators
+from analysis_service import (
+    TechnicalAnalysis, calculate_trading_levels, calculate_moving_averages_from_data,
+    calculate_supply_demand_zones, analyze_price_action
+)
+from ohlcv_store import ohlcv_store
+from portfolio import app_settings
+from saudi_stocks import TASI_STOCKS
+
+STRATEGIES = ("recommendation", "trading_levels")
+
+# طول البيانات التي تراها كل استراتيجية عند كل شمعة (كما في التطبيق)
+STRATEGY_WINDOWS = {
+    "recommendation": 63,    # get_recommendation تستخدم 3 أشهر
+    "trading_levels": 126,   # تحليل لوحة التحكم يستخدم 6 أشهر
+}
+
+TRADING_DAYS_PER_YEAR = 250
+CALENDAR_DAYS_PER_TRADING_DAY = 365 / TRADING_DAYS_PER_YEAR
+HISTORY_WORKERS = 4  # تنزيل التاريخ الناقص (محكوم أيضاً بمحدد معدل Yahoo المشترك)
+INITIAL_CAPITAL = 100000.0
+NEAR_LEVEL_PERCENT = 3  # نفس عتبة القرب من الدعم/المقاومة في get_recommendation
+
+# توصيات calculate_trading_levels التي تعني الخروج من المركز
+EXIT_RECOMMENDATIONS = ("جني أرباح جزئي", "بيع محتمل", "انتظار أو تخفيف")
+ENTRY_RECOMMENDATIONS = ("شراء محتمل",)
+
+BUY, HOLD, SELL = 1, 0, -1
+
+
+# ==================== الإشارات المتجهة ====================
+
+def _rolling(values: np.ndarray, window: int, func) -> np.ndarray:
+    """تطبيق دالة على نافذة متحركة (النتيجة NaN قبل اكتمال النافذة)"""
+    result = np.full(len(values), np.nan)
+    if len(values) >= window:
+        result[window - 1:] = func(sliding_window_view(values, window), axis=1)
+    return result
+
+
+def recommendation_signals(bars: Dict[str, np.ndarray], window: int) -> np.ndarray:
+    """إشارة get_recommendation عند إغلاق كل شمعة (بيانات آخر `window` شمعة فقط)"""
+    high, low, close = bars["high"], bars["low"], bars["close"]
+
+    recent_max = _rolling(high, 10, np.max)
+    recent_min = _rolling(low, 10, np.min)
+    max_high = _rolling(high, window, np.max)
+    min_low = _rolling(low, window, np.min)
+
+    pivot = (max_high + min_low + close) / 3
+    spread = max_high - min_low
+    resistances = np.round(np.column_stack([recent_max, 2 * pivot - min_low, pivot + spread, max_high]), 2)
+    supports = np.round(np.column_stack([recent_min, 2 * pivot - max_high, pivot - spread, min_low]), 2)
+
+    with np.errstate(invalid="ignore"):
+        # المقاومات: أعلى 3 مستويات مختلفة فوق السعر، والأقرب هو أصغرها
+        above = np.sort(np.where(resistances > close[:, None], resistances, np.nan), axis=1)
+        distinct = np.concatenate([np.ones((len(close), 1), dtype=bool),
+                                   above[:, 1:] != above[:, :-1]], axis=1) & ~np.isnan(above)
+        nearest_resistance = np.where(distinct.sum(axis=1) == 4, above[:, 1], above[:, 0])
+
+        # الدعوم: الأقرب هو أعلى مستوى تحت السعر
+        below = np.where(supports < close[:, None], supports, np.nan)
+        has_support = ~np.isnan(below).all(axis=1)
+        nearest_support = np.full(len(close), np.nan)
+        nearest_support[has_support] = np.nanmax(below[has_support], axis=1)
+
+        price = np.round(close, 2)
+        sell = (nearest_resistance - price) / price * 100 <= NEAR_LEVEL_PERCENT
+        buy = (price - nearest_support) / price * 100 <= NEAR_LEVEL_PERCENT
+
+    signals = np.where(buy & ~sell, BUY, np.where(sell & ~buy, SELL, HOLD)).astype(np.int8)
+    signals[:window - 1] = HOLD
+    return signals
+
+
+def _pattern_signal_counts(bars: Dict[str, np.ndarray]) -> np.ndarray:
+    """عدد إشارات الشراء ناقص البيع من آخر 3 إشارات شموع (كما في analyze_price_action)"""
+    masks = indicators.candle_patterns(bars["open"], bars["high"], bars["low"], bars["close"])
+    # نفس ترتيب pattern_defs في analyze_price_action
+    ordered = [("hammer", BUY), ("shooting_star", SELL), ("bullish_engulfing", BUY),
+               ("bearish_engulfing", SELL), ("doji", HOLD)]
+    n = len(bars["close"])
+    per_bar = [[code for key, code in ordered if masks[key][j]] for j in range(n)]
+
+    net = np.zeros(n, dtype=np.int8)
+    for t in range(4, n):
+        # الشموع في المواضع -5..-2 من نافذة تنتهي عند t
+        recent = (per_bar[t - 4] + per_bar[t - 3] + per_bar[t - 2] + per_bar[t - 1])[-3:]
+        net[t] = np.sign(recent.count(BUY) - recent.count(SELL))
+    return net
+
+
+def trading_level_inputs(bars: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """مدخلات توصية calculate_trading_levels غير المعتمدة على متوسط التكلفة"""
+    close = bars["close"]
+    sma20 = indicators.sma_series(close, 20)
+    sma50 = indicators.sma_series(close, 50)
+    sma50 = np.where(np.isnan(sma50), sma20, sma50)  # analyze_price_action عند نقص البيانات
+
+    trend = np.where((close > sma20) & (sma20 > sma50), BUY,
+                     np.where((close < sma20) & (sma20 < sma50), SELL, HOLD)).astype(np.int8)
+    return {
+        "trend": trend,
+        "sma_20": np.round(sma20, 2),
+        "sma_50": np.round(sma50, 2),
+        "pattern_net": _pattern_signal_counts(bars),
+    }
+
+
+def trading_level_recommendation(inputs: Dict[str, np.ndarray], t: int, price: float,
+                                 avg_cost: Optional[float]) -> str:
+    """التوصية النهائية لـ calculate_trading_levels عند الشمعة t"""
+    trend = inputs["trend"][t]
+    sma_20, sma_50 = inputs["sma_20"][t], inputs["sma_50"][t]
+    price_vs_avg = round((price - avg_cost) / avg_cost * 100, 2) if avg_cost else 0
+
+    recommendation = 'انتظار'
+    if price_vs_avg < -10:
+        recommendation = 'تعزيز'
+    elif price_vs_avg > 15:
+        recommendation = 'جني أرباح جزئي'
+    elif price < sma_20 and price < sma_50 and trend == SELL:
+        recommendation = 'انتظار أو تخفيف'
+    elif price > sma_20 and trend == BUY:
+        recommendation = 'احتفاظ'
+
+    if recommendation == 'انتظار':
+        if inputs["pattern_net"][t] > 0:
+            recommendation = 'شراء محتمل'
+        elif inputs["pattern_net"][t] < 0:
+            recommendation = 'بيع محتمل'
+    return recommendation
+
+
+# ==================== المحاكاة ====================
+
+def simulate(bars: Dict[str, np.ndarray], strategy: str, start: int,
+             commission_rate: float, tax_rate: float,
+             capital: float = INITIAL_CAPITAL) -> Dict:
+    """تنفيذ الإشارات: الإشارة عند إغلاق الشمعة t تُنفذ على افتتاح الشمعة t+1"""
+    open_, close = bars["open"], bars["close"]
+    n = len(close)
+    fee_rate = commission_rate * (1 + tax_rate)  # الضريبة على العمولة
+
+    if strategy == "recommendation":
+        signals = recommendation_signals(bars, STRATEGY_WINDOWS[strategy])
+    else:
+        inputs = trading_level_inputs(bars)
+
+    cash, shares, entry_cost = capital, 0, 0.0
+    equity = np.empty(n - start)
+    trades = []
+    bars_in_market = 0
+    pending = HOLD
+    fees_paid = 0.0
+
+    for t in range(start, n):
+        # تنفيذ أمر الإغلاق السابق على الافتتاح
+        if pending == BUY and shares == 0:
+            qty = math.floor(cash / (open_[t] * (1 + fee_rate)))
+            if qty > 0:
+                value = qty * open_[t]
+                fees = value * fee_rate
+                cash -= value + fees
+                shares, entry_cost = qty, value + fees
+                fees_paid += fees
+                entry_t = t
+        elif pending == SELL and shares > 0:
+            value = shares * open_[t]
+            fees = value * fee_rate
+            cash += value - fees
+            fees_paid += fees
+            trades.append({"return": (value - fees - entry_cost) / entry_cost, "bars": t - entry_t})
+            shares = 0
+        pending = HOLD
+
+        if shares:
+            bars_in_market += 1
+        equity[t - start] = cash + shares * close[t]
+
+        # إشارة عند الإغلاق
+        if strategy == "recommendation":
+            signal = signals[t]
+        else:
+            avg_cost = entry_cost / shares if shares else None
+            recommendation = trading_level_recommendation(inputs, t, float(close[t]), avg_cost)
+            signal = BUY if recommendation in ENTRY_RECOMMENDATIONS else \
+                SELL if recommendation in EXIT_RECOMMENDATIONS else HOLD
+        if (signal == BUY and shares == 0) or (signal == SELL and shares > 0):
+            pending = signal
+
+    peak = np.maximum.accumulate(equity)
+    drawdown = equity / peak - 1
+    returns = np.array([trade["return"] for trade in trades])
+    wins = int((returns > 0).sum())
+
+    return {
+        "total_return": round(float(equity[-1] / capital - 1) * 100, 2),
+        "buy_hold_return": round(float(close[-1] / close[start] - 1) * 100, 2),
+        "max_drawdown": round(float(drawdown.min()) * 100, 2),
+        "trades": len(trades),
+        "wins": wins,
+        "hit_rate": round(wins / len(trades) * 100, 2) if trades else None,
+        "avg_trade_return": round(float(returns.mean()) * 100, 2) if trades else None,
+        "avg_holding_days": round(float(np.mean([tr["bars"] for tr in trades])), 1) if trades else None,
+        "exposure": round(bars_in_market / len(equity) * 100, 2),
+        "fees_paid": round(float(fees_paid), 2),
+        "open_position": shares > 0,
+        "final_equity": round(float(equity[-1]), 2),
+    }
+
+
+def _load_bars(code: str) -> Optional[Dict[str, np.ndarray]]:
+    stored = ohlcv_store.load(code)
+    if stored is None or not len(stored["timestamps"]):
+        return None
+    bars = indicators.to_arrays(dict(stored))
+    return bars if len(bars["close"]) else None
+
+
+def history_period(years: float, strategy: str) -> str:
+    """أقصر فترة get_historical_data تغطي `years` سنوات مع نافذة الإشارات الأولى (بحد أقصى 5y)"""
+    needed = years * 365 + STRATEGY_WINDOWS[strategy] * CALENDAR_DAYS_PER_TRADING_DAY
+    periods = sorted(TechnicalAnalysis.PERIOD_DAYS.items(), key=lambda item: item[1])
+    for period, days in periods:
+        if days >= needed:
+            return period
+    return periods[-1][0]
+
+
+def ensure_history(symbols: List[str], years: float, strategy: str = "recommendation") -> int:
+    """تنزيل ما ينقص من تاريخ الأسهم في المخزن المحلي قبل الاختبار
+
+    المخزن يُملأ عادة بفترة الفاحص (سنة واحدة) فقط. ترجع عدد الأسهم التي تم توسيعها.
+    """
+    period = history_period(years, strategy)
+    start_ts = int(time.time()) - TechnicalAnalysis.PERIOD_DAYS[period] * 86400
+    missing = [code for code in symbols if not ohlcv_store.covers(code, start_ts)]
+
+    def fetch(code):
+        try:
+            return TechnicalAnalysis.get_historical_data(code, period) is not None
+        except Exception as e:
+            print(f"خطأ في تنزيل تاريخ {code}: {e}")
+            return False
+
+    with ThreadPoolExecutor(max_workers=HISTORY_WORKERS, thread_name_prefix="backtest-history") as executor:
+        return sum(executor.map(fetch, missing))
+
+
+def backtest_symbol(code: str, strategy: str = "recommendation", years: float = 3,
+                    commission_rate: float = None, tax_rate: float = None) -> Dict:
+    """اختبار سهم واحد من بياناته المخزنة محلياً"""
+    commission_rate = app_settings.commission_rate if commission_rate is None else commission_rate
+    tax_rate = app_settings.tax_rate if tax_rate is None else tax_rate
+
+    bars = _load_bars(code)
+    window = STRATEGY_WINDOWS[strategy]
+    if bars is None or len(bars["close"]) < window + 2:
+        return {"symbol": code, "error": "لا تتوفر بيانات كافية"}
+
+    # أول شمعة تداول بعد اكتمال نافذة الإشارات، ضمن آخر `years` سنوات
+    n = len(bars["close"])
+    start = max(window - 1, n - int(years * TRADING_DAYS_PER_YEAR))
+
+    result = simulate(bars, strategy, start, commission_rate, tax_rate)
+    result["symbol"] = code
+    result["bars"] = n - start
+    # الفترة المختبرة فعلياً (قد تكون أقصر من المطلوب لقصر تاريخ السهم)
+    result["start_date"] = time.strftime("%Y-%m-%d", time.gmtime(int(bars["timestamps"][start])))
+    result["years_tested"] = round((n - start) / TRADING_DAYS_PER_YEAR, 2)
+    return result
+
+
+def _backtest_task(args):
+    try:
+        return backtest_symbol(*args)
+    except Exception as e:
+        return {"symbol": args[0], "error": str(e)}
+
+
+def run_backtest(symbols: List[str] = None, strategy: str = "recommendation", years: float = 3,
+                 max_workers: int = None, fetch_history: bool = True) -> Dict:
+    """اختبار عدة أسهم (كل السوق افتراضياً) في عمليات متوازية
+
+    fetch_history: تنزيل التاريخ الناقص حتى `years` سنوات قبل الاختبار
+    (في العملية الرئيسية؛ العمليات الفرعية تقرأ المخزن فقط)
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f"استراتيجية غير معروفة: {strategy}")
+
+    symbols = list(symbols or TASI_STOCKS)
+    extended = ensure_history(symbols, years, strategy) if fetch_history else 0
+    tasks = [(code, strategy, years, app_settings.commission_rate, app_settings.tax_rate)
+             for code in symbols]
+
+    started = time.perf_counter()
+    # spawn بدلاً من fork: الاستدعاء يتم من خيط في خادم متعدد الخيوط، والعملية
+    # المنسوخة بـ fork قد ترث أقفالاً (المخزن، محدد المعدل، السجلات) محجوزة لخيط آخر.
+    # كل عملية فرعية تستورد الملف الرئيسي باسم __mp_main__ (app.py لا يبدأ خيوطه الخلفية عندها)
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(),
+                             mp_context=multiprocessing.get_context("spawn")) as executor:
+        results = list(executor.map(_backtest_task, tasks, chunksize=8))
+    elapsed = time.perf_counter() - started
+
+    tested = [r for r in results if "error" not in r]
+    total_trades = sum(r["trades"] for r in tested)
+    total_wins = sum(r["wins"] for r in tested)
+
+    summary = {
+        "strategy": strategy,
+        "years": years,
+        "symbols": len(symbols),
+        "tested": len(tested),
+        "history_extended": extended,
+        "commission_rate": app_settings.commission_rate,
+        "tax_rate": app_settings.tax_rate,
+        "elapsed_seconds": round(elapsed, 2),
+    }
+    if tested:
+        total_returns = np.array([r["total_return"] for r in tested])
+        summary.update({
+            "avg_return": round(float(total_returns.mean()), 2),
+            "median_return": round(float(np.median(total_returns)), 2),
+            "avg_buy_hold_return": round(float(np.mean([r["buy_hold_return"] for r in tested])), 2),
+            "avg_max_drawdown": round(float(np.mean([r["max_drawdown"] for r in tested])), 2),
+            "worst_drawdown": round(float(min(r["max_drawdown"] for r in tested)), 2),
+            "total_trades": total_trades,
+            "avg_years_tested": round(float(np.mean([r["years_tested"] for r in tested])), 2),
+            "min_years_tested": min(r["years_tested"] for r in tested),
+            "hit_rate": round(total_wins / total_trades * 100, 2) if total_trades else None,
+        })
+
+    return {
+        "summary": summary,
+        "results": sorted(tested, key=lambda r: r["total_return"], reverse=True),
+        "errors": [r for r in results if "error" in r],
+    }
+
+
+# ==================== التحقق من مطابقة الإشارات ====================
+
+def verify_signals(code: str, strategy: str = "recommendation", samples: int = 100) -> Dict:
+    """مقارنة الإشارات المتجهة باستدعاء الدوال الأصلية على نافذة كل شمعة
+
+    للتأكد من أن الاختبار يعكس قواعد التطبيق بعد أي تعديل عليها
+    (بدون مركز مفتوح في trading_levels)
+    """
+    bars = _load_bars(code)
+    window = STRATEGY_WINDOWS[strategy]
+    if bars is None or len(bars["close"]) <= window:
+        return {"symbol": code, "error": "لا تتوفر بيانات كافية"}
+
+    n = len(bars["close"])
+    points = np.unique(np.linspace(window - 1, n - 1, min(samples, n - window + 1)).astype(int))
+    if strategy == "recommendation":
+        fast = recommendation_signals(bars, window)
+    else:
+        inputs = trading_level_inputs(bars)
+
+    mismatches = []
+    for t in points:
+        data = {field: bars[field][t - window + 1:t + 1].tolist()
+                for field in ("open", "high", "low", "close", "volume")}
+        data["timestamps"] = bars["timestamps"][t - window + 1:t + 1].tolist()
+        price = float(bars["close"][t])
+
+        if strategy == "recommendation":
+            expected = TechnicalAnalysis.get_recommendation(code, data=data)["recommendation"]
+            got = {BUY: "buy", SELL: "sell", HOLD: "hold"}[int(fast[t])]
+        else:
+            expected = calculate_trading_levels(
+                current_price=price, avg_cost=None,
+                moving_averages=calculate_moving_averages_from_data(data),
+                levels=TechnicalAnalysis.calculate_support_resistance(data),
+                supply_demand=calculate_supply_demand_zones(data),
+                price_action=analyze_price_action(data)
+            )["recommendation"]
+            got = trading_level_recommendation(inputs, t, price, None)
+
+        if expected != got:
+            mismatches.append({"bar": int(t), "expected": expected, "got": got})
+
+    return {
+        "symbol": code,
+        "strategy": strategy,
+        "checked": len(points),
+        "matched": len(points) - len(mismatches),
+        "mismatches": mismatches[:10],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="اختبار توصيات التحليل الفني على البيانات المخزنة")
+    parser.add_argument("symbols", nargs="*", help="رموز الأسهم (كل السوق إذا لم تحدد)")
+    parser.add_argument("--strategy", choices=STRATEGIES, default="recommendation")
+    parser.add_argument("--years", type=float, default=3)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--no-fetch", action="store_true", help="الاختبار على المخزن المحلي فقط بدون تنزيل")
+    parser.add_argument("--verify", action="store_true", help="مقارنة الإشارات مع الدوال الأصلية")
+    args = parser.parse_args()
+
+    if args.verify:
+        for symbol in args.symbols or ["2222"]:
+            print(json.dumps(verify_signals(symbol, args.strategy), ensure_ascii=False, indent=2))
+    else:
+        report = run_backtest(args.symbols, args.strategy, args.years, args.workers,
+                              fetch_history=not args.no_fetch)
+        print(json.dumps(report["summary"], ensure_ascii=False, indent=2))
@@ -0,0 +1,169 @@
+"""
+قياس زمن استخراج البيانات من صفحات HTML محفوظة
+HTML Extraction Benchmark - BeautifulSoup (html.parser) vs html_extract on saved pages
+
+الاستخدام:
+    python benchmarks/html_extract_bench.py            # قياس على الصفحات المحفوظة
+    python benchmarks/html_extract_bench.py --save     # حفظ نسخ حية من الصفحات أولاً
+
+الصفحات تُقرأ من benchmarks/fixtures/*.html. إذا لم توجد صفحات محفوظة
+تُولّد صفحات بنفس بنية المواقع وحجمها التقريبي. يتحقق القياس أيضاً من
+تطابق النتائج بين الطريقتين قبل عرض الأزمنة.
+"""
+import argparse
+import pathlib
+import sys
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from bs4 import BeautifulSoup  # noqa: E402
+
+import html_extract  # noqa: E402
+
+FIXTURES_DIR = pathlib.Path(__file__).resolve().parent / "fixtures"
+
+# الصفحات الحية المستخدمة في الخدمات (للحفظ عبر --save)
+LIVE_PAGES = {
+    "investing_gold": "https://sa.investing.com/commodities/gold",
+    "investing_brent": "https://sa.investing.com/commodities/brent-oil",
+    "argaam_home": "https://www.argaam.com/ar",
+    "aleqt_home": "https://www.aleqt.com/",
+    "maaal_home": "https://maaal.com/",
+}
+
+
+# ==================== الطريقة السابقة (BeautifulSoup مع html.parser) ====================
+
+def legacy_investing(page: str) -> dict:
+    soup = BeautifulSoup(page, "html.parser")
+
+    def text(selector):
+        el = soup.select_one(selector)
+        return el.get_text(strip=True) if el else None
+
+    return {
+        "last": text('[data-test="instrument-price-last"]'),
+        "change": text('[data-test="instrument-price-change"]'),
+        "change_percent": text('[data-test="instrument-price-change-percent"]'),
+        "week_range": [el.get_text(strip=True) for el in soup.select('[data-test="weekRange"] span')],
+    }
+
+
+def news_extract(doc: html_extract.Document, kind: str):
+    if kind == "argaam":
+        return doc.links("/ar/article/articledetail")
+    if kind == "maaal":
+        return doc.blocks(("article", "div"), ("post", "article", "entry"), ("h2", "h3", "h4", "a"))
+    return doc.links()
+
+
+# ==================== صفحات مولدة ====================
+
+def _filler(count: int) -> str:
+    rows = []
+    for i in range(count):
+        rows.append(
+            f'<div class="row r{i}"><span class="label">عنصر {i}</span>'
+            f'<a href="/ar/section/{i}">قسم رقم {i}</a><script>var x{i} = {i};</script>'
+            f'<ul><li>بند أول</li><li>بند ثان &amp; ثالث</li></ul></div>'
+        )
+    return "\n".join(rows)
+
+
+def generated_pages() -> dict:
+    investing = (
+        "<!DOCTYPE html><html><head><title>Gold</title>"
+        + "<script>" + "var data = {};" * 4000 + "</script></head><body>"
+        + _filler(2500)
+        + '<div class="price"><div data-test="instrument-price-last">4,012.35</div>'
+          '<span data-test="instrument-price-change">+12.40</span>'
+          '<span data-test="instrument-price-change-percent">(+0.31%)</span></div>'
+        + '<div data-test="weekRange"><div><span>2,601.10</span><span>4,120.00</span></div></div>'
+        + _filler(2500) + "</body></html>"
+    )
+    argaam = (
+        "<html><body>" + _filler(1500)
+        + "".join(f'<div class="news"><a href="/ar/article/articledetail/id/{1800000 + i}">'
+                  f'<span>خاص</span> عنوان خبر اقتصادي طويل بما يكفي رقم {i}</a></div>' for i in range(120))
+        + _filler(1500) + "</body></html>"
+    )
+    aleqt = (
+        "<html><body>" + _filler(1500)
+        + "".join(f'<h3><a href="/2026/10/19/article_{i}.html">عنوان مقال في الاقتصادية رقم {i} عن السوق</a></h3>'
+                  for i in range(100))
+        + _filler(1500) + "</body></html>"
+    )
+    maaal = (
+        "<html><body>" + _filler(1500)
+        + "".join(f'<article class="post type-post entry"><a href="https://maaal.com/2026/10/{i}/">'
+                  f'<img src="x.jpg"></a><h3>عنوان خبر من مال رقم {i} للاختبار</h3></article>' for i in range(60))
+        + _filler(1500) + "</body></html>"
+    )
+    return {"investing_generated": investing, "argaam_generated": argaam,
+            "aleqt_generated": aleqt, "maaal_generated": maaal}
+
+
+def load_pages() -> dict:
+    pages = {path.stem: path.read_text(encoding="utf-8") for path in sorted(FIXTURES_DIR.glob("*.html"))}
+    return pages or generated_pages()
+
+
+def save_pages():
+    import requests
+    from global_prices_service import GlobalPricesService
+
+    FIXTURES_DIR.mkdir(parents=True, exist_ok=True)
+    for name, url in LIVE_PAGES.items():
+        try:
+            resp = requests.get(url, headers=GlobalPricesService.HEADERS, timeout=20)
+            resp.raise_for_status()
+        except Exception as e:
+            print(f"تعذر حفظ {name}: {e}")
+            continue
+        (FIXTURES_DIR / f"{name}.html").write_text(resp.text, encoding="utf-8")
+        print(f"تم حفظ {name} ({len(resp.text) // 1024} KB)")
+
+
+# ==================== القياس ====================
+
+def best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(repeat: int):
+    pages = load_pages()
+    print(f"lxml: {'متوفر' if html_extract.HAS_LXML else 'غير متوفر'}")
+    print(f"{'الصفحة':<24}{'KB':>6}{'bs4 ms':>10}{'جديد ms':>10}{'التسريع':>9}  تطابق")
+
+    for name, page in pages.items():
+        if name.startswith("investing"):
+            old = lambda: legacy_investing(page)  # noqa: E731
+            new = lambda: html_extract.investing_quote(page)  # noqa: E731
+        else:
+            kind = name.split("_")[0]
+            old = lambda: news_extract(html_extract.Document(page, "bs4"), kind)  # noqa: E731
+            new = lambda: news_extract(html_extract.Document(page), kind)  # noqa: E731
+
+        same = old() == new()
+        old_time = best_of(old, repeat)
+        new_time = best_of(new, repeat)
+        print(f"{name:<24}{len(page) // 1024:>6}{old_time * 1000:>10.2f}{new_time * 1000:>10.2f}"
+              f"{old_time / new_time:>8.1f}x  {'نعم' if same else 'لا'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="قياس زمن استخراج HTML")
+    parser.add_argument("--save", action="store_true", help="حفظ نسخ حية من الصفحات في fixtures")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.save:
+        save_pages()
+    run(args.repeat)
@@ -0,0 +1,232 @@
+"""
+مخزن التوزيعات والإجراءات المؤسسية (تقسيم الأسهم)
+Corporate Actions Store - dividend and split events from Yahoo chart `events=div,split`
+
+يجلب أحداث التوزيعات والتقسيم لكل أسهم تاسي من نفس مصدر الشموع (Yahoo chart)
+ويحفظها في ملف محلي مع فهرس مرتب لكل سهم. التحديث تزايدي: يُطلب فقط ما بعد
+آخر فحص للسهم (مع تداخل بسيط لالتقاط التعديلات المتأخرة).
+
+عنوان المصدر قابل للتغيير (base_url) لتشغيل المحمل على خادم يعيد استجابات مسجلة
+(tests/test_corporate_actions.py مع tests/fixtures/yahoo_events_*.json).
+ملاحظة: مبالغ التوزيعات من Yahoo معدلة حسب التقسيمات اللاحقة (لكل سهم حالي).
+"""
+import bisect
+import json
+import os
+import pathlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import requests
+
+from market_time import RIYADH_TZ
+from rate_limiter import yahoo_rate_limiter
+from saudi_stocks import TASI_STOCKS
+
+CACHE_FILE = pathlib.Path(__file__).parent / "cache" / "corporate_actions.json"
+
+YAHOO_CHART_URL = "https://query1.finance.yahoo.com/v8/finance/chart"
+
+SECONDS_PER_DAY = 86400
+
+
+class CorporateActionsStore:
+    """أحداث التوزيعات والتقسيم لكل سهم
+
+    لكل سهم: dividends [{"date", "amount"}] و splits [{"date", "numerator", "denominator"}]
+    مرتبة تصاعدياً، و checked_to (نهاية آخر فترة تم فحصها بالثواني).
+    """
+
+    HEADERS = {
+        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36",
+    }
+
+    REFRESH_INTERVAL = 12 * 3600  # لا يُعاد فحص السهم قبل مرور 12 ساعة
+    REFRESH_OVERLAP_DAYS = 30  # إعادة فحص آخر 30 يوماً لالتقاط التعديلات
+    REFRESH_WORKERS = 4  # الطلبات محكومة أيضاً بمحدد معدل Yahoo المشترك
+
+    def __init__(self, path: pathlib.Path = CACHE_FILE, base_url: str = YAHOO_CHART_URL):
+        self.path = pathlib.Path(path)
+        self.base_url = base_url.rstrip("/")
+        self._events = {}  # الرمز -> {"dividends": [...], "splits": [...], "checked_to": ts}
+        self._split_index = {}  # الرمز -> (أيام التقسيم، حاصل ضرب النسب من كل موقع حتى النهاية)
+        self._listeners = []
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self.refresh_status = {"running": False, "done": 0, "total": 0, "updated": 0, "finished_at": None}
+        self._load()
+
+    # ==================== الملف المحلي ====================
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._events = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"خطأ في قراءة ملف الإجراءات المؤسسية: {e}")
+            self._events = {}
+
+    def save(self):
+        """حفظ الأحداث (كتابة ذرية عبر ملف مؤقت)"""
+        with self._lock:
+            data = dict(self._events)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(str(tmp_path), str(self.path))
+
+    # ==================== القراءة ====================
+
+    def dividends(self, code: str) -> List[Dict]:
+        """توزيعات السهم مرتبة تصاعدياً حسب تاريخ الاستحقاق"""
+        with self._lock:
+            return list(self._events.get(code, {}).get("dividends", []))
+
+    def splits(self, code: str) -> List[Dict]:
+        """تقسيمات السهم مرتبة تصاعدياً"""
+        with self._lock:
+            return list(self._events.get(code, {}).get("splits", []))
+
+    def split_factor(self, code: str, after: str) -> float:
+        """عدد الأسهم الحالية لكل سهم تم شراؤه في تاريخ `after` (حاصل ضرب التقسيمات بعده)"""
+        with self._lock:
+            index = self._split_index.get(code)
+            if index is None:
+                splits = self._events.get(code, {}).get("splits", [])
+                dates = [s["date"] for s in splits]
+                factors = [1.0] * (len(splits) + 1)
+                for i in range(len(splits) - 1, -1, -1):
+                    split = splits[i]
+                    factors[i] = factors[i + 1] * split["numerator"] / split["denominator"]
+                index = (dates, factors)
+                self._split_index[code] = index
+        dates, factors = index
+        return factors[bisect.bisect_right(dates, str(after)[:10])]
+
+    def status(self) -> Dict:
+        with self._lock:
+            events = dict(self._events)
+        return {
+            "symbols": len(events),
+            "with_dividends": sum(1 for e in events.values() if e.get("dividends")),
+            "with_splits": sum(1 for e in events.values() if e.get("splits")),
+            "refresh": dict(self.refresh_status),
+        }
+
+    # ==================== التحديث ====================
+
+    def add_listener(self, callback: Callable[[str], None]):
+        """دالة تُستدعى برمز السهم عند تغير أحداثه (مثل مسح فهرس التوزيعات)"""
+        self._listeners.append(callback)
+
+    def _fetch_events(self, code: str, period1: int, period2: int) -> Optional[Dict]:
+        """طلب أحداث التوزيعات والتقسيم لفترة من Yahoo chart (شموع شهرية لتصغير الاستجابة)"""
+        try:
+            url = (f"{self.base_url}/{code}.SR?interval=1mo&events=div,split"
+                   f"&period1={period1}&period2={period2}")
+            yahoo_rate_limiter.acquire()
+            response = requests.get(url, headers=self.HEADERS, timeout=15)
+
+            if response.status_code == 429:
+                yahoo_rate_limiter.backoff(2)
+            elif response.status_code == 200:
+                data = response.json()
+                if "chart" in data and data["chart"]["result"]:
+                    return data["chart"]["result"][0].get("events") or {}
+        except Exception as e:
+            print(f"خطأ في جلب التوزيعات للسهم {code}: {e}")
+
+        return None
+
+    @staticmethod
+    def _event_date(ts) -> str:
+        return datetime.fromtimestamp(int(ts), RIYADH_TZ).strftime("%Y-%m-%d")
+
+    def update_symbol(self, code: str, force: bool = False) -> bool:
+        """تحديث أحداث سهم واحد (ترجع True إذا تغيرت أحداثه)"""
+        now = int(time.time())
+        with self._lock:
+            current = self._events.get(code)
+        checked_to = (current or {}).get("checked_to", 0)
+        if not force and current is not None and now - checked_to < self.REFRESH_INTERVAL:
+            return False
+
+        period1 = max(checked_to - self.REFRESH_OVERLAP_DAYS * SECONDS_PER_DAY, 0) if current else 0
+        events = self._fetch_events(code, period1, now)
+        if events is None:
+            return False
+
+        dividends = {
+            self._event_date(e["date"]): round(float(e["amount"]), 6)
+            for e in (events.get("dividends") or {}).values()
+            if e.get("amount")
+        }
+        splits = {
+            self._event_date(e["date"]): (float(e["numerator"]), float(e["denominator"]))
+            for e in (events.get("splits") or {}).values()
+            if e.get("numerator") and e.get("denominator")
+        }
+
+        with self._lock:
+            entry = self._events.get(code) or {"dividends": [], "splits": []}
+            old_dividends = {d["date"]: d["amount"] for d in entry["dividends"]}
+            old_splits = {s["date"]: (s["numerator"], s["denominator"]) for s in entry["splits"]}
+            merged_dividends = {**old_dividends, **dividends}
+            merged_splits = {**old_splits, **splits}
+            changed = merged_dividends != old_dividends or merged_splits != old_splits
+
+            self._events[code] = {
+                "dividends": [{"date": d, "amount": merged_dividends[d]} for d in sorted(merged_dividends)],
+                "splits": [{"date": d, "numerator": n, "denominator": den}
+                           for d, (n, den) in sorted(merged_splits.items())],
+                "checked_to": now,
+            }
+            self._split_index.pop(code, None)
+
+        if changed:
+            for callback in self._listeners:
+                callback(code)
+        return changed
+
+    def refresh(self, symbols: Optional[List[str]] = None, force: bool = False) -> bool:
+        """تحديث أحداث كل أسهم تاسي (يُستدعى في الخلفية)
+
+        ترجع False إذا كان هناك تحديث قيد التشغيل
+        """
+        if not self._refresh_lock.acquire(blocking=False):
+            return False
+
+        symbols = list(symbols or TASI_STOCKS)
+        self.refresh_status = {"running": True, "done": 0, "total": len(symbols),
+                               "updated": 0, "finished_at": None}
+
+        def fetch(code):
+            try:
+                return self.update_symbol(code, force)
+            except Exception as e:
+                print(f"خطأ في تحديث توزيعات {code}: {e}")
+                return False
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.REFRESH_WORKERS,
+                                    thread_name_prefix="corporate-actions") as executor:
+                for changed in executor.map(fetch, symbols):
+                    self.refresh_status["done"] += 1
+                    self.refresh_status["updated"] += int(changed)
+            self.save()
+        finally:
+            self.refresh_status["running"] = False
+            self.refresh_status["finished_at"] = datetime.now().isoformat()
+            self._refresh_lock.release()
+
+        return True
+
+
+# المخزن المشترك
+corporate_actions = CorporateActionsStore()
@@ -0,0 +1,126 @@
+"""
+تقويم دخل التوزيعات المتوقع
+Dividend Income Calendar - 12-month projected cash flow across all wallets
+
+يبني جدول التدفقات النقدية المتوقعة لكل أسهم المحفظة من فهرس التوزيعات
+(DividendTracker) والأسهم المملوكة حالياً، مجمعاً حسب الشهر والمحفظة.
+الجدول يُحفظ ولا يُعاد بناؤه إلا عند تغير الأوامر أو بيانات التوزيعات أو
+اليوم. لا يتم أي طلب خارجي؛ العائد المتوقع يُحسب من آخر سعر محفوظ للسهم.
+"""
+import threading
+from datetime import date, datetime
+from typing import Dict, List
+
+from analysis_service import DividendTracker
+from market_time import RIYADH_TZ
+
+
+class DividendCalendar:
+    """الدخل المتوقع من التوزيعات لـ 12 شهراً قادمة"""
+
+    MONTHS = 12
+
+    def __init__(self):
+        self._key = None
+        self._calendar = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _month_start(day: date, offset: int) -> date:
+        month = day.month - 1 + offset
+        return date(day.year + month // 12, month % 12 + 1, 1)
+
+    def _build(self, stocks: List, today: date) -> Dict:
+        end = self._month_start(today, self.MONTHS)
+        months = {}
+        for i in range(self.MONTHS):
+            start = self._month_start(today, i)
+            key = start.strftime("%Y-%m")
+            months[key] = {"month": key, "total": 0.0, "payments": []}
+
+        holdings = []
+        by_wallet = {}
+        for stock in stocks:
+            shares = stock.shares
+            if shares <= 0:
+                continue
+
+            events = DividendTracker.project_dividends(stock.symbol, today, end)
+            per_share = sum(e["amount_per_share"] for e in events)
+            income = per_share * shares
+            wallet_id = stock.get_wallet_id()
+
+            for event in events:
+                amount = event["amount_per_share"] * shares
+                bucket = months[event["date"][:7]]
+                bucket["total"] += amount
+                bucket["payments"].append({
+                    "symbol": stock.symbol,
+                    "name": stock.name,
+                    "wallet_id": wallet_id,
+                    "shares": shares,
+                    **event,
+                    "amount": round(amount, 2),
+                })
+
+            if events:
+                by_wallet[wallet_id] = by_wallet.get(wallet_id, 0.0) + income
+            holdings.append({
+                "symbol": stock.symbol,
+                "name": stock.name,
+                "wallet_id": wallet_id,
+                "shares": shares,
+                "payments": len(events),
+                "projected_per_share": round(per_share, 4),
+                "projected_income": round(income, 2),
+            })
+
+        for bucket in months.values():
+            bucket["total"] = round(bucket["total"], 2)
+            bucket["payments"].sort(key=lambda p: p["date"])
+        holdings.sort(key=lambda h: h["projected_income"], reverse=True)
+
+        return {
+            "start": today.isoformat(),
+            "end": end.isoformat(),
+            "months": list(months.values()),
+            "stocks": holdings,
+            "by_wallet": {wallet_id: round(total, 2) for wallet_id, total in by_wallet.items()},
+            "total_projected": round(sum(b["total"] for b in months.values()), 2),
+            "generated_at": datetime.now().isoformat(),
+        }
+
+    def get(self, portfolio, today: date = None) -> Dict:
+        """التقويم المتوقع للمحفظة (من الكاش إذا لم تتغير الأوامر أو التوزيعات)
+
+        العائد المتوقع لكل سهم يُحسب عند الطلب من السعر الحالي المحفوظ.
+        """
+        today = today or datetime.now(RIYADH_TZ).date()
+        key = (id(portfolio), portfolio.revision, DividendTracker.index_revision, today)
+        with self._lock:
+            if self._key != key:
+                self._calendar = self._build(portfolio.get_all_stocks(), today)
+                self._key = key
+            calendar = self._calendar
+
+        stocks = []
+        total_value = 0.0
+        for holding in calendar["stocks"]:
+            stock = portfolio.get_stock(holding["symbol"])
+            price = stock.current_price if stock else 0
+            total_value += (price or 0) * holding["shares"]
+            stocks.append({
+                **holding,
+                "current_price": price,
+                "forward_yield": round(holding["projected_per_share"] / price * 100, 2) if price else None,
+            })
+
+        return {
+            **calendar,
+            "stocks": stocks,
+            "forward_yield": round(calendar["total_projected"] / total_value * 100, 2) if total_value else None,
+        }
+
+
+# التقويم المشترك
+dividend_calendar = DividendCalendar()
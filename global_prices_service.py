@@ -4,12 +4,17 @@ Global Prices Service - Fetches commodities and metals prices
 """
 
 import requests
-from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional
+from urllib.parse import urlparse
+import threading
 import time
 import re
 
+import html_extract
+from price_history import price_history
+
 # Import price fetcher for petrochemicals
 try:
     from price_fetcher import TadawulPriceFetcher
@@ -36,16 +41,16 @@ class GlobalPricesService:
         ],
         # المعادن الثمينة
         'precious_metals': [
-            {'url': 'https://sa.investing.com/commodities/gold', 'name': 'الذهب', 'name_en': 'Gold', 'unit': 'دولار/أونصة', 'icon': '🥇', 'category': 'precious'},
-            {'url': 'https://sa.investing.com/commodities/silver', 'name': 'الفضة', 'name_en': 'Silver', 'unit': 'دولار/أونصة', 'icon': '🥈', 'category': 'precious'},
+            {'url': 'https://sa.investing.com/commodities/gold', 'name': 'الذهب', 'name_en': 'Gold', 'unit': 'دولار/أونصة', 'icon': '🥇', 'category': 'precious', 'ttl': 120},
+            {'url': 'https://sa.investing.com/commodities/silver', 'name': 'الفضة', 'name_en': 'Silver', 'unit': 'دولار/أونصة', 'icon': '🥈', 'category': 'precious', 'ttl': 120},
         ],
         # المعادن الصناعية
         'industrial_metals': [
             {'url': 'https://sa.investing.com/commodities/copper', 'name': 'النحاس', 'name_en': 'Copper', 'unit': 'دولار/رطل', 'icon': '🔶', 'category': 'industrial'},
             {'url': 'https://sa.investing.com/commodities/iron-ore-62-cfr-futures', 'name': 'خام الحديد', 'name_en': 'Iron Ore', 'unit': 'دولار/طن', 'icon': '⚙️', 'category': 'industrial'},
             {'url': 'https://sa.investing.com/commodities/aluminum', 'name': 'الألمنيوم', 'name_en': 'Aluminum', 'unit': 'دولار/طن', 'icon': '🔩', 'category': 'industrial'},
-            {'url': 'https://www.investing.com/commodities/zinc', 'name': 'الزنك', 'name_en': 'Zinc', 'unit': 'دولار/طن', 'icon': '🔧', 'category': 'industrial'},
-            {'url': 'https://sa.investing.com/commodities/lead', 'name': 'الرصاص', 'name_en': 'Lead', 'unit': 'دولار/طن', 'icon': '⚫', 'category': 'industrial'},
+            {'url': 'https://www.investing.com/commodities/zinc', 'name': 'الزنك', 'name_en': 'Zinc', 'unit': 'دولار/طن', 'icon': '🔧', 'category': 'industrial', 'ttl': 1800},
+            {'url': 'https://sa.investing.com/commodities/lead', 'name': 'الرصاص', 'name_en': 'Lead', 'unit': 'دولار/طن', 'icon': '⚫', 'category': 'industrial', 'ttl': 1800},
         ],
         # البتروكيماويات (أسهم سعودية - سيتم جلبها من stock_service)
         'petrochemicals': [
@@ -56,19 +61,155 @@ class GlobalPricesService:
         ],
     }
 
-    # Cache
-    _cache = {}
-    _cache_time = None
-    CACHE_DURATION = 300  # 5 دقائق
-    REQUEST_DELAY = 0.3  # تأخير بين الطلبات
+    # كاش لكل عنصر: المفتاح -> (وقت الجلب monotonic، البيانات)
+    _item_cache = {}
+    _item_lock = threading.Lock()
+    _inflight = {}  # المفتاح -> Future للطلبات الجارية (لمنع تكرار الطلب نفسه)
+    _last_access = {}  # المفتاح -> آخر وقت طُلب فيه العنصر (للتحديث في الخلفية)
+
+    # مدة صلاحية كل عنصر بالثواني (الافتراضي حسب الفئة، ويمكن تحديد 'ttl' في العنصر)
+    CATEGORY_TTL = {'oil': 120, 'precious_metals': 300, 'industrial_metals': 900, 'petrochemicals': 60}
+    DEFAULT_TTL = 300
+    # العنصر المنتهي يُرجع (مع stale و age_seconds) حتى هذا العمر فقط، وبعده
+    # يُعامل كغير موجود (يُنتظر جلبه، وإذا فشل لا يظهر بدلاً من عرض سعر قديم كحالي)
+    MAX_STALE_AGE = 6 * 3600
+
+    # التحديث في الخلفية: العناصر المطلوبة خلال HOT_WINDOW تُجدد قبل انتهاء صلاحيتها
+    REFRESH_TICK = 15
+    HOT_WINDOW = 900
+    REFRESH_AHEAD = 0.8  # التجديد عند بلوغ 80% من مدة الصلاحية
+    _refresher = None
+
+    # الجلب المتوازي: حد أقصى للطلبات المتزامنة لكل مضيف
+    FETCH_WORKERS = 12
+    REQUEST_TIMEOUT = 15  # ثانية - مهلة طلب الصفحة الواحدة
+    # معظم العناصر من sa.investing.com، لذلك حدها هو ما يحدد سرعة الجلب البارد:
+    # 9 عناصر بحد 4 = 3 دفعات، وأبطأ حالة 3 × REQUEST_TIMEOUT. مع كاش العناصر
+    # والتحديث في الخلفية لا تُطلب كلها معاً عادة
+    HOST_LIMITS = {'sa.investing.com': 4, 'www.investing.com': 2, 'tadawul': 4}
+    FETCH_TIMEOUT = 3 * REQUEST_TIMEOUT  # ثانية - أقصى انتظار لاكتمال العناصر الناقصة
+    DEFAULT_HOST_LIMIT = 2
+    _executor = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix="global-prices")
+    _host_semaphores = {}
+    _host_lock = threading.Lock()
+
+    # فئة العنصر في COMMODITIES -> مفتاحه في النتيجة
+    RESULT_KEYS = {'oil': 'energy'}
+
+    @classmethod
+    def _host_semaphore(cls, host: str) -> threading.BoundedSemaphore:
+        with cls._host_lock:
+            semaphore = cls._host_semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(cls.HOST_LIMITS.get(host, cls.DEFAULT_HOST_LIMIT))
+                cls._host_semaphores[host] = semaphore
+            return semaphore
+
+    @staticmethod
+    def _item_key(item: Dict) -> str:
+        """مفتاح العنصر: رمز السهم أو آخر جزء من رابط Investing.com"""
+        return item.get('symbol') or item.get('url', '').rstrip('/').split('/')[-1]
+
+    @classmethod
+    def _item_ttl(cls, category: str, item: Dict) -> float:
+        return item.get('ttl', cls.CATEGORY_TTL.get(category, cls.DEFAULT_TTL))
+
+    @classmethod
+    def _fetch_item(cls, category: str, item: Dict) -> Optional[Dict]:
+        """جلب عنصر واحد مع احترام حد الطلبات المتزامنة لمضيفه"""
+        host = 'tadawul' if category == 'petrochemicals' else urlparse(item['url']).netloc
+        with cls._host_semaphore(host):
+            # للبتروكيماويات استخدم خدمة الأسهم
+            if category == 'petrochemicals':
+                return cls._fetch_petrochem_price(item)
+            return cls._fetch_price_investing(item)
+
+    @classmethod
+    def _fetch_and_store(cls, category: str, item: Dict, key: str) -> Optional[Dict]:
+        try:
+            price_data = cls._fetch_item(category, item)
+            if price_data:
+                with cls._item_lock:
+                    cls._item_cache[key] = (time.monotonic(), price_data)
+                price_history.record(key, price_data.get('price'))
+            return price_data
+        finally:
+            with cls._item_lock:
+                cls._inflight.pop(key, None)
+
+    @classmethod
+    def _schedule(cls, category: str, item: Dict):
+        """طلب تحديث العنصر (أو إرجاع الطلب الجاري له) - يُستدعى مع _item_lock"""
+        key = cls._item_key(item)
+        future = cls._inflight.get(key)
+        if future is None:
+            future = cls._executor.submit(cls._fetch_and_store, category, item, key)
+            cls._inflight[key] = future
+        return future
+
+    @classmethod
+    def _get_items(cls, categories: List[str]) -> Dict[str, List[Dict]]:
+        """أسعار عناصر الفئات المطلوبة من الكاش
+
+        العنصر الصالح يُرجع مباشرة، والمنتهي يُرجع مع stale=True وعمره مع تحديثه
+        في الخلفية، ولا يُنتظر الجلب إلا للعناصر غير الموجودة في الكاش أو الأقدم
+        من MAX_STALE_AGE (حتى FETCH_TIMEOUT).
+        العنصر الذي لا يصل خلال المهلة لا يظهر في هذه النتيجة، ويُحفظ في الكاش
+        عند وصوله للطلبات التالية.
+        """
+        now = time.monotonic()
+        cached = {}
+        missing = {}
+        with cls._item_lock:
+            for category in categories:
+                for position, item in enumerate(cls.COMMODITIES.get(category, [])):
+                    key = cls._item_key(item)
+                    cls._last_access[key] = now
+                    entry = cls._item_cache.get(key)
+                    if entry is None or now - entry[0] >= cls.MAX_STALE_AGE:
+                        missing[cls._schedule(category, item)] = (category, position)
+                        continue
+                    age = now - entry[0]
+                    cached[(category, position)] = (entry[1], age)
+                    if age >= cls._item_ttl(category, item):
+                        cls._schedule(category, item)
+
+        if missing:
+            done, not_done = wait(missing, timeout=cls.FETCH_TIMEOUT)
+            if not_done:
+                print(f"انتهت مهلة جلب {len(not_done)} من الأسعار العالمية")
+            for future in done:
+                try:
+                    price_data = future.result()
+                except Exception as e:
+                    print(f"خطأ في جلب سعر عالمي: {e}")
+                    continue
+                if price_data:
+                    cached[missing[future]] = (price_data, 0.0)
+
+        # ترتيب النتائج حسب ترتيب COMMODITIES مع الخط المصغر من السجل المحلي
+        results = {category: [] for category in categories}
+        for (category, position), (price_data, age) in sorted(cached.items(), key=lambda c: c[0]):
+            item = cls.COMMODITIES[category][position]
+            key = cls._item_key(item)
+            results[category].append({
+                **price_data,
+                'stale': age >= cls._item_ttl(category, item),
+                'age_seconds': int(age),
+                'sparkline': price_history.sparkline(key),
+            })
+        return results
 
     @classmethod
     def get_all_prices(cls) -> Dict:
-        """جلب جميع الأسعار"""
-        # التحقق من الكاش
-        if cls._cache_time and (datetime.now() - cls._cache_time).seconds < cls.CACHE_DURATION:
-            if cls._cache:
-                return cls._cache
+        """جلب جميع الأسعار
+
+        كل عنصر له مدة صلاحية خاصة؛ العناصر الناقصة تُطلب بالتوازي بحد لكل
+        مضيف، فزمن الطلب البارد يقارب عدد دفعات أكثر المضيفات عناصر (3 دفعات
+        لـ sa.investing.com) × أبطأ طلب في كل دفعة، وليس مجموع العناصر. ما لم
+        يصل خلال FETCH_TIMEOUT يُحذف من النتيجة (انظر _get_items).
+        """
+        items = cls._get_items(list(cls.COMMODITIES))
 
         all_prices = {
             'energy': [],
@@ -79,47 +220,51 @@ class GlobalPricesService:
             'refining': [],
             'timestamp': datetime.now().isoformat()
         }
-
-        print("\n=== النفط والطاقة ===")
-        # جلب أسعار كل الفئات
-        for category, items in cls.COMMODITIES.items():
-            if category == 'oil':
-                print("\n=== النفط والطاقة ===")
-            elif category == 'precious_metals':
-                print("\n=== المعادن الثمينة ===")
-            elif category == 'industrial_metals':
-                print("\n=== المعادن الصناعية ===")
-            elif category == 'petrochemicals':
-                print("\n=== البتروكيماويات ===")
-
-            for item in items:
-                # للبتروكيماويات استخدم خدمة الأسهم
-                if category == 'petrochemicals':
-                    price_data = cls._fetch_petrochem_price(item)
-                else:
-                    price_data = cls._fetch_price_investing(item)
-
-                if price_data:
-                    if category == 'oil':
-                        all_prices['energy'].append(price_data)
-                    elif category == 'precious_metals':
-                        all_prices['precious_metals'].append(price_data)
-                    elif category == 'industrial_metals':
-                        all_prices['industrial_metals'].append(price_data)
-                    elif category == 'petrochemicals':
-                        all_prices['petrochemicals'].append(price_data)
-                time.sleep(cls.REQUEST_DELAY)
+        for category, prices in items.items():
+            all_prices[cls.RESULT_KEYS.get(category, category)] = prices
 
         # إضافة بيانات الشحن والتكرير (تقديرية بناءً على النفط)
         all_prices['shipping'] = cls._get_shipping_rates(all_prices.get('energy', []))
         all_prices['refining'] = cls._get_refining_margins(all_prices.get('energy', []))
 
-        # حفظ في الكاش
-        cls._cache = all_prices
-        cls._cache_time = datetime.now()
-
         return all_prices
 
+    @classmethod
+    def refresh_hot_items(cls) -> int:
+        """تجديد العناصر المطلوبة مؤخراً قبل انتهاء صلاحيتها (ترجع عدد العناصر المجدولة)"""
+        now = time.monotonic()
+        scheduled = 0
+        with cls._item_lock:
+            for category, items in cls.COMMODITIES.items():
+                for item in items:
+                    key = cls._item_key(item)
+                    if now - cls._last_access.get(key, float('-inf')) > cls.HOT_WINDOW:
+                        continue
+                    entry = cls._item_cache.get(key)
+                    if entry and now - entry[0] < cls._item_ttl(category, item) * cls.REFRESH_AHEAD:
+                        continue
+                    if key not in cls._inflight:
+                        cls._schedule(category, item)
+                        scheduled += 1
+        return scheduled
+
+    @classmethod
+    def start_refresher(cls):
+        """تشغيل خيط التحديث في الخلفية (مرة واحدة)"""
+        if cls._refresher is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(cls.REFRESH_TICK)
+                try:
+                    cls.refresh_hot_items()
+                except Exception as e:
+                    print(f"خطأ في تحديث الأسعار العالمية: {e}")
+
+        cls._refresher = threading.Thread(target=loop, daemon=True, name="global-prices-refresher")
+        cls._refresher.start()
+
     @classmethod
     def _fetch_petrochem_price(cls, item_info: Dict) -> Optional[Dict]:
         """جلب سعر سهم بتروكيماويات من TadawulPriceFetcher"""
@@ -169,36 +314,32 @@ class GlobalPricesService:
         """جلب سعر من Investing.com"""
         try:
             url = item_info['url']
-            resp = requests.get(url, headers=cls.HEADERS, timeout=15)
+            resp = requests.get(url, headers=cls.HEADERS, timeout=cls.REQUEST_TIMEOUT)
 
             if resp.status_code == 200:
-                soup = BeautifulSoup(resp.text, 'html.parser')
+                # قراءة عناصر السعر مباشرة دون تحليل الصفحة كاملة
+                quote = html_extract.investing_quote(resp.text)
 
-                # استخراج السعر
-                price_el = soup.select_one('[data-test="instrument-price-last"]')
-                change_el = soup.select_one('[data-test="instrument-price-change"]')
-                change_pct_el = soup.select_one('[data-test="instrument-price-change-percent"]')
-
-                if not price_el:
+                if not quote['last']:
                     print(f"No price found for {item_info['name']}")
                     return None
 
                 # تحويل السعر إلى رقم
-                price_text = price_el.get_text(strip=True).replace(',', '')
+                price_text = quote['last'].replace(',', '')
                 price = float(price_text)
 
                 # استخراج التغير
                 change = 0
                 change_pct = 0
-                if change_el:
-                    change_text = change_el.get_text(strip=True).replace(',', '').replace('+', '')
+                if quote['change']:
+                    change_text = quote['change'].replace(',', '').replace('+', '')
                     try:
                         change = float(change_text)
                     except:
                         pass
 
-                if change_pct_el:
-                    pct_text = change_pct_el.get_text(strip=True)
+                if quote['change_percent']:
+                    pct_text = quote['change_percent']
                     pct_match = re.search(r'[\-\+]?([\d\.]+)', pct_text)
                     if pct_match:
                         change_pct = float(pct_match.group(1))
@@ -213,11 +354,11 @@ class GlobalPricesService:
                 low_52w = 0
 
                 # البحث عن 52-week range
-                range_els = soup.select('[data-test="weekRange"] span')
-                if len(range_els) >= 2:
+                range_texts = quote['week_range']
+                if len(range_texts) >= 2:
                     try:
-                        low_52w = float(range_els[0].get_text(strip=True).replace(',', ''))
-                        high_52w = float(range_els[1].get_text(strip=True).replace(',', ''))
+                        low_52w = float(range_texts[0].replace(',', ''))
+                        high_52w = float(range_texts[1].replace(',', ''))
                     except:
                         pass
 
@@ -331,51 +472,67 @@ class GlobalPricesService:
 
     @classmethod
     def get_price_by_symbol(cls, symbol: str) -> Optional[Dict]:
-        """جلب سعر سلعة واحدة"""
+        """جلب سعر سلعة واحدة (من الكاش)"""
         for category, items in cls.COMMODITIES.items():
-            for item in items:
+            for position, item in enumerate(items):
                 if symbol in item.get('url', ''):
-                    return cls._fetch_price_investing(item)
+                    prices = cls._get_items([category])[category]
+                    key = cls._item_key(item)
+                    return next((p for p in prices if p.get('symbol') == key), None)
         return None
 
     @classmethod
     def get_prices_by_category(cls, category: str) -> List[Dict]:
-        """جلب أسعار فئة معينة"""
-        all_prices = cls.get_all_prices()
-        return all_prices.get(category, [])
+        """جلب أسعار فئة معينة (من الكاش، بدون جلب باقي الفئات)"""
+        if category in ('shipping', 'refining'):
+            energy = cls._get_items(['oil'])['oil']
+            if category == 'shipping':
+                return cls._get_shipping_rates(energy)
+            return cls._get_refining_margins(energy)
+
+        source = {v: k for k, v in cls.RESULT_KEYS.items()}.get(category, category)
+        if source not in cls.COMMODITIES:
+            return []
+        return cls._get_items([source])[source]
 
     @classmethod
     def clear_cache(cls):
         """مسح الكاش"""
-        cls._cache = {}
-        cls._cache_time = None
+        with cls._item_lock:
+            cls._item_cache = {}
 
     @classmethod
     def get_petrochem_basket(cls) -> Dict:
-        """جلب سلة البتروكيماويات"""
+        """جلب سلة البتروكيماويات (طلب أسعار واحد لكل الأسهم عبر الكاش المشترك)
+
+        التغير المرجح يُحسب بأوزان COMMODITIES['petrochemicals'] للأسهم المتوفرة أسعارها.
+        """
+        items = cls.COMMODITIES.get('petrochemicals', [])
+        quotes = TadawulPriceFetcher.get_live_prices([item['symbol'] for item in items]) if HAS_PRICE_FETCHER else {}
+
         prices = []
         total_weighted_change = 0
-        weights = [0.4, 0.2, 0.2, 0.2]
-
-        for i, item in enumerate(cls.COMMODITIES.get('petrochemicals', [])):
-            price_data = cls._fetch_price_investing(item)
-            if price_data:
-                weight = weights[i] if i < len(weights) else 0.25
-                prices.append({
-                    'symbol': item['name'],
-                    'name': item['name'],
-                    'price': price_data['price'],
-                    'change_pct': price_data['change_pct'],
-                    'weight': weight
-                })
-                total_weighted_change += price_data['change_pct'] * weight
-            time.sleep(cls.REQUEST_DELAY)
+        total_weight = 0
+        for item in items:
+            quote = quotes.get(item['symbol'])
+            if not quote or not quote.get('price'):
+                continue
+            weight = item.get('weight', 0.25)
+            prices.append({
+                'symbol': item['symbol'],
+                'name': item['name'],
+                'price': round(quote['price'], 2),
+                'change_pct': round(quote.get('change_percent', 0), 2),
+                'weight': weight
+            })
+            total_weighted_change += quote.get('change_percent', 0) * weight
+            total_weight += weight
 
         return {
             'name': 'سلة البتروكيماويات',
             'name_en': 'Petrochemicals Basket',
             'icon': '🏭',
             'components': prices,
-            'basket_change': round(total_weighted_change, 2),
+            'basket_change': round(total_weighted_change / total_weight, 2) if total_weight else 0,
             'timestamp': datetime.now().isoformat()
         }
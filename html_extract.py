@@ -0,0 +1,200 @@
+"""
+استخراج سريع للبيانات من صفحات HTML
+Fast HTML Extraction - targeted extraction for Investing.com quotes and news pages
+
+بدلاً من بناء شجرة BeautifulSoup كاملة (html.parser بلغة Python) لكل صفحة:
+- عناصر Investing.com المعروفة (data-test) تُقرأ بالبحث النصي المباشر عن
+  السمة ثم قراءة العنصر نفسه فقط، دون تحليل باقي الصفحة.
+- صفحات الأخبار تُحلل بـ lxml (مكتوب بلغة C) إذا كان متوفراً، وإلا
+  بـ BeautifulSoup كما في السابق. النتائج مطابقة في الحالتين.
+"""
+import html as html_lib
+import re
+from typing import Dict, List, Optional, Tuple
+
+from bs4 import BeautifulSoup
+
+try:
+    import lxml.html
+    from lxml import etree
+    HAS_LXML = True
+except ImportError:
+    HAS_LXML = False
+
+# وسوم لا يدخل نصها في get_text (مثل سلوك BeautifulSoup)
+SKIP_TEXT_TAGS = {"script", "style", "template"}
+
+_TAG_RE = re.compile(r"<[^>]*>")
+_OPEN_TAG_RE = re.compile(r"<([a-zA-Z][a-zA-Z0-9]*)")
+_SPAN_RE = re.compile(r"<span\b[^>]*>(.*?)</span>", re.S | re.I)
+
+
+# ==================== Investing.com (بحث نصي مباشر) ====================
+
+def _strip_tags(fragment: str) -> str:
+    """نص جزء HTML بدون وسوم (مكافئ get_text(strip=True) للعناصر البسيطة)"""
+    parts = (part.strip() for part in _TAG_RE.split(fragment))
+    return html_lib.unescape("".join(part for part in parts if part))
+
+
+def _element_bounds(page: str, attribute: str) -> Optional[Tuple[int, int, str]]:
+    """موقع أول عنصر يحمل السمة: (بداية المحتوى، موقع وسم الإغلاق، اسم الوسم)"""
+    at = page.find(attribute)
+    if at < 0:
+        return None
+    start = page.rfind("<", 0, at)
+    tag = _OPEN_TAG_RE.match(page, start)
+    content_start = page.find(">", at)
+    if start < 0 or not tag or content_start < 0:
+        return None
+    name = tag.group(1).lower()
+
+    # البحث عن وسم الإغلاق المقابل مع مراعاة تداخل نفس الوسم
+    depth = 1
+    pos = content_start + 1
+    open_re = re.compile(rf"<{name}\b", re.I)
+    close_re = re.compile(rf"</{name}\s*>", re.I)
+    while depth:
+        close = close_re.search(page, pos)
+        if not close:
+            return None
+        depth += len(open_re.findall(page, pos, close.start())) - 1
+        pos = close.end()
+        if depth == 0:
+            return content_start + 1, close.start(), name
+    return None
+
+
+def data_test_text(page: str, name: str) -> Optional[str]:
+    """نص العنصر [data-test="name"] أو None إذا لم يوجد"""
+    bounds = _element_bounds(page, f'data-test="{name}"')
+    if bounds is None:
+        return None
+    return _strip_tags(page[bounds[0]:bounds[1]])
+
+
+def data_test_spans(page: str, name: str) -> List[str]:
+    """نصوص وسوم span داخل العنصر [data-test="name"] (مثل select('[data-test=name] span'))"""
+    bounds = _element_bounds(page, f'data-test="{name}"')
+    if bounds is None:
+        return []
+    return [_strip_tags(inner) for inner in _SPAN_RE.findall(page, bounds[0], bounds[1])]
+
+
+def investing_quote(page: str) -> Dict:
+    """حقول السعر من صفحة أداة في Investing.com"""
+    return {
+        "last": data_test_text(page, "instrument-price-last"),
+        "change": data_test_text(page, "instrument-price-change"),
+        "change_percent": data_test_text(page, "instrument-price-change-percent"),
+        "week_range": data_test_spans(page, "weekRange"),
+    }
+
+
+# ==================== صفحات الأخبار (lxml أو BeautifulSoup) ====================
+
+def _lxml_text(element) -> str:
+    """مكافئ get_text(strip=True): نصوص العنصر بدون سكربتات أو تعليقات"""
+    parts = []
+
+    def walk(node):
+        if isinstance(node.tag, str) and node.tag not in SKIP_TEXT_TAGS:
+            if node.text:
+                parts.append(node.text.strip())
+            for child in node:
+                walk(child)
+        # نص ما بعد العنصر يتبع الأب دائماً
+        if node is not element and node.tail:
+            parts.append(node.tail.strip())
+
+    walk(element)
+    return "".join(parts)
+
+
+class Document:
+    """صفحة HTML محللة مع عمليات الاستخراج المستخدمة في خدمة الأخبار
+
+    backend: "lxml" أو "bs4" (None = lxml إذا كان متوفراً)
+    """
+
+    def __init__(self, page: str, backend: str = None):
+        self.backend = backend or ("lxml" if HAS_LXML else "bs4")
+        self.root = None
+        if self.backend == "lxml":
+            try:
+                self.root = lxml.html.fromstring(page)
+            except (ValueError, etree.ParserError):
+                self.backend = "bs4"
+        if self.backend == "bs4":
+            self.root = BeautifulSoup(page, "html.parser")
+
+    def links(self, href_contains: str = None) -> List[Tuple[str, str]]:
+        """(الرابط، النص) لكل وسم a له href، مع تصفية اختيارية بجزء من الرابط"""
+        if self.backend == "lxml":
+            result = []
+            for a in self.root.iter("a"):
+                href = a.get("href")
+                if href is None or (href_contains and href_contains not in href):
+                    continue
+                result.append((href, _lxml_text(a)))
+            return result
+
+        if href_contains:
+            anchors = self.root.find_all("a", href=lambda x: x and href_contains in str(x))
+        else:
+            anchors = self.root.find_all("a", href=True)
+        return [(a.get("href", ""), a.get_text(strip=True)) for a in anchors]
+
+    def blocks(self, tags: Tuple[str, ...], class_keywords: Tuple[str, ...],
+               title_tags: Tuple[str, ...]) -> List[Dict]:
+        """عناصر tags التي يحتوي class فيها إحدى الكلمات: أول رابط وأول عنوان داخلها"""
+        result = []
+        if self.backend == "lxml":
+            for element in self.root.iter(*tags):
+                classes = (element.get("class") or "").lower()
+                if not classes or not any(k in classes for k in class_keywords):
+                    continue
+                link = next((a for a in element.iter("a")
+                             if a is not element and a.get("href") is not None), None)
+                # iter يبدأ بالعنصر نفسه، بينما find يبحث في الأبناء فقط
+                title = next((t for t in element.iter(*title_tags) if t is not element), None)
+                result.append({
+                    "href": link.get("href") if link is not None else None,
+                    "title": _lxml_text(title) if title is not None else "",
+                })
+            return result
+
+        matches = self.root.find_all(
+            list(tags), class_=lambda x: x and any(k in str(x).lower() for k in class_keywords))
+        for element in matches:
+            link = element.find("a", href=True)
+            title = element.find(list(title_tags))
+            result.append({
+                "href": link.get("href", "") if link else None,
+                "title": title.get_text(strip=True) if title else "",
+            })
+        return result
+
+    def texts(self, tag: str) -> List[str]:
+        """نصوص كل عناصر الوسم بترتيب الصفحة"""
+        if self.backend == "lxml":
+            return [_lxml_text(element) for element in self.root.iter(tag)]
+        return [element.get_text(strip=True) for element in self.root.find_all(tag)]
+
+    def first_text(self, tag: str) -> Optional[str]:
+        """نص أول عنصر من الوسم أو None"""
+        if self.backend == "lxml":
+            element = next(self.root.iter(tag), None)
+            return _lxml_text(element) if element is not None else None
+        element = self.root.find(tag)
+        return element.get_text(strip=True) if element else None
+
+    def first_text_by_class(self, tags: Tuple[str, ...], keyword: str) -> Optional[str]:
+        """نص أول عنصر من tags يحتوي class فيه الكلمة"""
+        if self.backend == "lxml":
+            for element in self.root.iter(*tags):
+                if keyword in (element.get("class") or "").lower():
+                    return _lxml_text(element)
+            return None
+        element = self.root.find(list(tags), class_=lambda x: x and keyword in str(x).lower())
+        return element.get_text(strip=True) if element else None
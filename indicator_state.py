@@ -0,0 +1,202 @@
+"""
+حالة المؤشرات الفنية المتزايدة (Streaming)
+Incremental Indicator State - O(1) updates per bar, serializable with the OHLCV cache
+
+كل مؤشر يحتفظ بالحد الأدنى من الحالة اللازمة لتحديثه بشمعة جديدة دون
+إعادة المرور على التاريخ:
+- EMA: القيمة الحالية (وبذرة SMA حتى تكتمل الفترة الأولى)
+- SMA: مجموع متحرك مع نافذة القيم
+- أعلى قمة / أدنى قاع: طابور رتيب (monotonic deque)
+- متوسط الكمية: مجموع متحرك للكميات الموجبة فقط
+
+update() تُدخل شمعة مغلقة في الحالة، و peek() تحسب القيم كما لو أُغلقت
+شمعة بالسعر المعطى دون تعديل الحالة (للشمعة الحالية أو سعر لحظي).
+"""
+import math
+from collections import deque
+from itertools import islice
+from typing import Dict, Optional
+
+MA_PERIODS = (10, 20, 50, 200)
+EXTREME_WINDOWS = (10, 20, 50)
+VOLUME_WINDOW = 20
+
+
+class EMAState:
+    """المتوسط المتحرك الأسي (البذرة SMA لأول `period` قيمة)"""
+
+    def __init__(self, period: int):
+        self.period = period
+        self.k = 2 / (period + 1)
+        self.value = None
+        self.seed_sum = 0.0
+        self.seed_count = 0
+
+    def update(self, x: float):
+        if self.value is None:
+            self.seed_sum += x
+            self.seed_count += 1
+            if self.seed_count == self.period:
+                self.value = self.seed_sum / self.period
+        else:
+            self.value = x * self.k + self.value * (1 - self.k)
+
+    def peek(self, x: float) -> Optional[float]:
+        if self.value is None:
+            if self.seed_count + 1 == self.period:
+                return (self.seed_sum + x) / self.period
+            return None
+        return x * self.k + self.value * (1 - self.k)
+
+    def to_dict(self) -> Dict:
+        return {"value": self.value, "seed_sum": self.seed_sum, "seed_count": self.seed_count}
+
+    def load(self, state: Dict):
+        self.value = state.get("value")
+        self.seed_sum = state.get("seed_sum", 0.0)
+        self.seed_count = state.get("seed_count", 0)
+
+
+class SMAState:
+    """المتوسط المتحرك البسيط عبر مجموع متحرك"""
+
+    def __init__(self, period: int):
+        self.period = period
+        self.window = deque()
+        self.total = 0.0
+
+    def update(self, x: float):
+        self.window.append(x)
+        self.total += x
+        if len(self.window) > self.period:
+            self.total -= self.window.popleft()
+
+    @property
+    def value(self) -> Optional[float]:
+        if len(self.window) < self.period:
+            return None
+        return self.total / self.period
+
+    def peek(self, x: float) -> Optional[float]:
+        size = len(self.window)
+        if size + 1 < self.period:
+            return None
+        leaving = self.window[0] if size == self.period else 0.0
+        return (self.total - leaving + x) / self.period
+
+    def to_dict(self) -> Dict:
+        return {"window": list(self.window)}
+
+    def load(self, state: Dict):
+        self.window = deque(state.get("window", [])[-self.period:])
+        self.total = math.fsum(self.window)  # إعادة الجمع تمنع تراكم أخطاء التقريب
+
+
+class RollingExtremeState:
+    """أعلى قمة أو أدنى قاع خلال آخر `window` شمعة (طابور رتيب)"""
+
+    def __init__(self, window: int, mode: str = "max"):
+        self.window = window
+        self.mode = mode
+        self.items = deque()  # (رقم الشمعة، القيمة) بترتيب رتيب
+        self.count = 0
+
+    def _better(self, a: float, b: float) -> bool:
+        return a >= b if self.mode == "max" else a <= b
+
+    def update(self, x: float):
+        while self.items and self._better(x, self.items[-1][1]):
+            self.items.pop()
+        self.items.append((self.count, x))
+        if self.items[0][0] <= self.count - self.window:
+            self.items.popleft()
+        self.count += 1
+
+    @property
+    def value(self) -> Optional[float]:
+        return self.items[0][1] if self.items else None
+
+    def peek(self, x: float) -> float:
+        # شمعة واحدة على الأكثر تخرج من النافذة عند إضافة شمعة
+        oldest = self.count - self.window
+        candidates = [item for item in islice(self.items, 2) if item[0] > oldest][:1]
+        if candidates and not self._better(x, candidates[0][1]):
+            return candidates[0][1]
+        return x
+
+    def to_dict(self) -> Dict:
+        return {"items": [list(item) for item in self.items], "count": self.count}
+
+    def load(self, state: Dict):
+        self.items = deque(tuple(item) for item in state.get("items", []))
+        self.count = state.get("count", 0)
+
+
+class IndicatorSet:
+    """كل المؤشرات المتزايدة لسهم واحد
+
+    last_ts: وقت آخر شمعة مغلقة دخلت في الحالة
+    """
+
+    def __init__(self):
+        self.last_ts = 0
+        self.ema = {p: EMAState(p) for p in MA_PERIODS}
+        self.sma = {p: SMAState(p) for p in MA_PERIODS}
+        self.highs = {w: RollingExtremeState(w, "max") for w in EXTREME_WINDOWS}
+        self.lows = {w: RollingExtremeState(w, "min") for w in EXTREME_WINDOWS}
+        self.volume = SMAState(VOLUME_WINDOW)
+
+    def update(self, ts: int, high: float, low: float, close: float, volume: float = None):
+        """إدخال شمعة مغلقة - O(1) لكل مؤشر"""
+        for state in self.ema.values():
+            state.update(close)
+        for state in self.sma.values():
+            state.update(close)
+        for state in self.highs.values():
+            state.update(high)
+        for state in self.lows.values():
+            state.update(low)
+        if volume is not None and volume > 0:
+            self.volume.update(volume)
+        self.last_ts = int(ts)
+
+    def peek(self, close: float, high: float = None, low: float = None,
+             volume: float = None) -> Dict[str, Optional[float]]:
+        """قيم المؤشرات إذا أُغلقت الشمعة الحالية بهذه القيم (بدون تعديل الحالة)"""
+        high = close if high is None else high
+        low = close if low is None else low
+
+        values = {}
+        for period in MA_PERIODS:
+            values[f"sma_{period}"] = self.sma[period].peek(close)
+            values[f"ema_{period}"] = self.ema[period].peek(close)
+        for window in EXTREME_WINDOWS:
+            values[f"high_{window}"] = self.highs[window].peek(high)
+            values[f"low_{window}"] = self.lows[window].peek(low)
+        if volume is not None and volume > 0:
+            values[f"volume_avg_{VOLUME_WINDOW}"] = self.volume.peek(volume)
+        else:
+            values[f"volume_avg_{VOLUME_WINDOW}"] = self.volume.value
+        return values
+
+    def to_dict(self) -> Dict:
+        return {
+            "last_ts": self.last_ts,
+            "ema": {str(p): s.to_dict() for p, s in self.ema.items()},
+            "sma": {str(p): s.to_dict() for p, s in self.sma.items()},
+            "highs": {str(w): s.to_dict() for w, s in self.highs.items()},
+            "lows": {str(w): s.to_dict() for w, s in self.lows.items()},
+            "volume": self.volume.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, state: Dict) -> "IndicatorSet":
+        indicator_set = cls()
+        indicator_set.last_ts = state.get("last_ts", 0)
+        for name in ("ema", "sma", "highs", "lows"):
+            saved = state.get(name, {})
+            for key, member in getattr(indicator_set, name).items():
+                if str(key) in saved:
+                    member.load(saved[str(key)])
+        indicator_set.volume.load(state.get("volume", {}))
+        return indicator_set
@@ -0,0 +1,321 @@
+"""
+مكتبة المؤشرات الفنية المتجهة (NumPy)
+Vectorized Technical Indicators - aligned OHLCV arrays with NaN masking
+
+كل الدوال تقبل مصفوفة أحادية (سهم واحد) أو مصفوفة ثنائية (سهم لكل صف).
+السلاسل في المصفوفة الثنائية تكون محاذاة لليمين (آخر شمعة في آخر عمود)
+والأعمدة الفارغة في البداية تكون NaN.
+"""
+from typing import Dict, List, Optional
+
+import numpy as np
+
+OHLC_FIELDS = ("open", "high", "low", "close")
+
+# تداول تعمل بتوقيت الرياض (UTC+3) والأسبوع من الأحد إلى الخميس
+RIYADH_UTC_OFFSET = 3 * 3600
+
+# حجم المجموعة بعدد الشموع عند غياب التواريخ (التقريب القديم)
+FALLBACK_BUCKET_BARS = {"weekly": 5, "monthly": 20}
+
+
+def to_arrays(data: Dict) -> Dict[str, np.ndarray]:
+    """تحويل بيانات get_historical_data إلى مصفوفات متحاذية
+
+    الشمعة التي تنقصها أي قيمة من OHLC تُحذف بالكامل (بدلاً من فلترة
+    كل قائمة على حدة مما يسبب عدم تطابق الشموع). الكمية المفقودة تبقى NaN.
+    """
+    if not data or data.get("close") is None or not len(data["close"]):
+        return {f: np.empty(0) for f in OHLC_FIELDS + ("volume", "timestamps")}
+
+    n = len(data["close"])
+    arrays = {}
+    for field in OHLC_FIELDS + ("volume",):
+        values = data.get(field)
+        if values is None:
+            values = []
+        arr = np.array(values[:n], dtype=np.float64)  # None تتحول إلى NaN
+        if len(arr) < n:
+            arr = np.concatenate([arr, np.full(n - len(arr), np.nan)])
+        arrays[field] = arr
+
+    valid = ~np.isnan(np.vstack([arrays[f] for f in OHLC_FIELDS])).any(axis=0)
+    for field in arrays:
+        arrays[field] = arrays[field][valid]
+
+    timestamps = data.get("timestamps")
+    if timestamps is not None and len(timestamps) == n:
+        arrays["timestamps"] = np.asarray(timestamps, dtype=np.int64)[valid]
+    else:
+        arrays["timestamps"] = np.empty(0, dtype=np.int64)
+
+    return arrays
+
+
+def stack(series_list: List[np.ndarray]) -> np.ndarray:
+    """تجميع عدة سلاسل بأطوال مختلفة في مصفوفة واحدة محاذاة لليمين"""
+    width = max((len(s) for s in series_list), default=0)
+    matrix = np.full((len(series_list), width), np.nan)
+    for row, series in enumerate(series_list):
+        if len(series):
+            matrix[row, width - len(series):] = series
+    return matrix
+
+
+def valid_counts(matrix: np.ndarray) -> np.ndarray:
+    """عدد القيم الصالحة في كل صف"""
+    return (~np.isnan(matrix)).sum(axis=-1)
+
+
+def sma_last(values: np.ndarray, period: int) -> np.ndarray:
+    """آخر قيمة للمتوسط المتحرك البسيط (NaN إذا كانت البيانات أقل من الفترة)"""
+    matrix = np.atleast_2d(values)
+    result = np.full(matrix.shape[0], np.nan)
+    if matrix.shape[1] >= period:
+        window = matrix[:, -period:]
+        enough = ~np.isnan(window).any(axis=1)
+        result[enough] = window[enough].mean(axis=1)
+    return result if np.ndim(values) > 1 else result[0]
+
+
+def sma_series(values: np.ndarray, period: int) -> np.ndarray:
+    """سلسلة المتوسط المتحرك البسيط كاملة (عبر المجموع التراكمي)"""
+    values = np.asarray(values, dtype=np.float64)
+    result = np.full(values.shape, np.nan)
+    if values.shape[-1] < period:
+        return result
+    csum = np.cumsum(np.nan_to_num(values), axis=-1)
+    csum = np.concatenate([np.zeros(values.shape[:-1] + (1,)), csum], axis=-1)
+    window_sum = csum[..., period:] - csum[..., :-period]
+    nan_count = np.cumsum(np.isnan(values), axis=-1)
+    nan_count = np.concatenate([np.zeros(values.shape[:-1] + (1,)), nan_count], axis=-1)
+    has_nan = (nan_count[..., period:] - nan_count[..., :-period]) > 0
+    means = window_sum / period
+    means[has_nan] = np.nan
+    result[..., period - 1:] = means
+    return result
+
+
+def ema_last(values: np.ndarray, period: int) -> np.ndarray:
+    """آخر قيمة للمتوسط المتحرك الأسي
+
+    نفس تعريف الحساب التكراري: البذرة هي SMA لأول `period` قيمة ثم
+    ema = price * k + ema * (1 - k). تُحسب مباشرة كمجموع موزون لكل الصفوف معاً.
+    """
+    matrix = np.atleast_2d(np.asarray(values, dtype=np.float64))
+    rows, width = matrix.shape
+    result = np.full(rows, np.nan)
+
+    counts = valid_counts(matrix)
+    eligible = counts >= period
+    if not eligible.any():
+        return result if np.ndim(values) > 1 else result[0]
+
+    k = 2 / (period + 1)
+    decay = 1 - k
+    cols = np.arange(width)
+    first_valid = width - counts  # السلاسل محاذاة لليمين
+
+    # البذرة: متوسط أول `period` قيمة صالحة
+    seed_mask = (cols >= first_valid[:, None]) & (cols < (first_valid + period)[:, None])
+    seed = np.where(seed_mask, matrix, 0).sum(axis=1) / period
+
+    # باقي القيم بأوزان متناقصة أسياً
+    tail_mask = cols >= (first_valid + period)[:, None]
+    weights = k * decay ** (width - 1 - cols)
+    tail = np.where(tail_mask, np.nan_to_num(matrix) * weights, 0).sum(axis=1)
+    remaining = counts - period
+
+    ema = seed * decay ** remaining + tail
+    result[eligible] = ema[eligible]
+    return result if np.ndim(values) > 1 else result[0]
+
+
+def volume_stats(volume: np.ndarray, recent: int = 5) -> Dict[str, np.ndarray]:
+    """إحصائيات الكميات: المتوسط والحالي ومتوسط آخر أيام والنسبة
+
+    القيم الصفرية أو المفقودة تُستبعد (كما في الحساب الأصلي)
+    """
+    matrix = np.atleast_2d(np.asarray(volume, dtype=np.float64))
+    matrix = np.where(matrix > 0, matrix, np.nan)
+
+    # إزاحة القيم الصالحة لليمين حتى يكون "آخر N" صحيحاً بعد الاستبعاد
+    packed = stack([row[~np.isnan(row)] for row in matrix])
+    counts = valid_counts(packed)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        avg = np.where(counts > 0, np.nansum(packed, axis=1) / np.maximum(counts, 1), 0.0)
+        current = packed[:, -1] if packed.shape[1] else np.zeros(len(counts))
+        current = np.nan_to_num(current)
+        if packed.shape[1] >= recent:
+            recent_avg = np.where(counts >= recent, np.nanmean(packed[:, -recent:], axis=1), avg)
+        else:
+            recent_avg = avg
+        ratio = np.where(avg > 0, current / np.where(avg > 0, avg, 1), 0.0)
+
+    stats = {"count": counts, "avg": avg, "current": current,
+             "recent_avg": np.nan_to_num(recent_avg), "ratio": ratio}
+    if np.ndim(volume) > 1:
+        return stats
+    return {key: value[0] for key, value in stats.items()}
+
+
+def pivots(high: np.ndarray, low: np.ndarray, close: np.ndarray) -> Dict[str, np.ndarray]:
+    """نقاط الارتكاز الكلاسيكية من أعلى قمة وأدنى قاع وآخر إغلاق"""
+    batched = np.ndim(high) > 1
+    high = np.atleast_2d(high)
+    low = np.atleast_2d(low)
+    close = np.atleast_2d(close)
+
+    with np.errstate(invalid="ignore"):
+        max_high = np.nanmax(high, axis=1)
+        min_low = np.nanmin(low, axis=1)
+    last_close = close[:, -1]  # السلاسل محاذاة لليمين
+
+    pivot = (max_high + min_low + last_close) / 3
+    levels = {
+        "pivot": pivot,
+        "r1": 2 * pivot - min_low,
+        "r2": pivot + (max_high - min_low),
+        "s1": 2 * pivot - max_high,
+        "s2": pivot - (max_high - min_low),
+        "max_high": max_high,
+        "min_low": min_low,
+    }
+    if batched:
+        return levels
+    return {key: value[0] for key, value in levels.items()}
+
+
+def candle_patterns(open_: np.ndarray, high: np.ndarray, low: np.ndarray,
+                    close: np.ndarray) -> Dict[str, np.ndarray]:
+    """أقنعة منطقية لأنماط الشموع لكل شمعة
+
+    أنماط الابتلاع تقارن الشمعة بالتي تليها، لذلك تكون False في آخر شمعة.
+    """
+    o, h, l, c = (np.asarray(a, dtype=np.float64) for a in (open_, high, low, close))
+    body = np.abs(c - o)
+    upper_wick = h - np.maximum(o, c)
+    lower_wick = np.minimum(o, c) - l
+    total_range = h - l
+    has_range = total_range != 0
+
+    o_next = np.roll(o, -1, axis=-1)
+    c_next = np.roll(c, -1, axis=-1)
+    has_next = np.ones(o.shape, dtype=bool)
+    has_next[..., -1] = False
+
+    return {
+        "hammer": has_range & (lower_wick > body * 2) & (upper_wick < body * 0.5) & (c > o),
+        "shooting_star": has_range & (upper_wick > body * 2) & (lower_wick < body * 0.5) & (o > c),
+        "bullish_engulfing": has_range & has_next & (o > c) & (c_next > o_next) & (c_next > o) & (o_next < c),
+        "bearish_engulfing": has_range & has_next & (c > o) & (o_next > c_next) & (o_next > c) & (c_next < o),
+        "doji": has_range & (body < total_range * 0.1),
+    }
+
+
+def round_or_none(value, digits: int = 2) -> Optional[float]:
+    """تقريب قيمة رقمية مع تحويل NaN إلى None"""
+    if value is None or np.isnan(value):
+        return None
+    return round(float(value), digits)
+
+
+def suffix_min(values: np.ndarray) -> np.ndarray:
+    """أدنى قيمة من كل موضع حتى نهاية السلسلة (suffix[i] = min(values[i:]))"""
+    values = np.asarray(values, dtype=np.float64)
+    return np.minimum.accumulate(values[::-1])[::-1]
+
+
+def suffix_max(values: np.ndarray) -> np.ndarray:
+    """أعلى قيمة من كل موضع حتى نهاية السلسلة (suffix[i] = max(values[i:]))"""
+    values = np.asarray(values, dtype=np.float64)
+    return np.maximum.accumulate(values[::-1])[::-1]
+
+
+def supply_demand_zones(open_: np.ndarray, high: np.ndarray, low: np.ndarray,
+                        close: np.ndarray, lookback: int,
+                        current_price: float) -> Dict[str, np.ndarray]:
+    """مواقع شموع مناطق الطلب والعرض غير المخترقة خلال آخر `lookback` شمعة
+
+    فحص عدم الاختراق يتم عبر مصفوفات الحد الأدنى/الأعلى اللاحق بدلاً من
+    المرور على كل الشموع التالية لكل منطقة، فيصبح الحساب خطياً في عدد الشموع.
+    ترجع مواقع الشموع (مرتبة تصاعدياً) وقناع القوة لكل منها.
+    """
+    o, h, l, c = (np.asarray(a, dtype=np.float64) for a in (open_, high, low, close))
+    total = len(c)
+    n = min(total, lookback)
+    empty = np.empty(0, dtype=np.int64)
+    result = {"demand": empty, "demand_strong": np.empty(0, dtype=bool),
+              "supply": empty, "supply_strong": np.empty(0, dtype=bool)}
+    if n < 10:
+        return result
+
+    # الشمعة المرشحة p تحتاج شمعة قبلها وشمعتين على الأقل بعدها
+    p = np.arange(total - n + 3, total - 3)
+    prev, nxt = p - 1, p + 1
+
+    lowest_after = suffix_min(l)[p + 2]
+    highest_after = suffix_max(h)[p + 2]
+
+    body = np.abs(o[p] - c[p])
+    next_body = np.abs(c[nxt] - o[nxt])
+
+    # شمعة هبوط تليها شمعة صعود تغلق فوق قمتها عند قاع محلي
+    demand = ((o[p] > c[p]) & (c[nxt] > o[nxt]) & (c[nxt] > h[p]) &
+              (l[p] < l[prev]) & (l[p] < l[nxt]) &
+              (lowest_after >= l[p] * 0.98) & (l[p] < current_price))
+
+    # شمعة صعود تليها شمعة هبوط تغلق تحت قاعها عند قمة محلية
+    supply = ((c[p] > o[p]) & (o[nxt] > c[nxt]) & (c[nxt] < l[p]) &
+              (h[p] > h[prev]) & (h[p] > h[nxt]) &
+              (highest_after <= h[p] * 1.02) & (h[p] > current_price))
+
+    result["demand"] = p[demand]
+    result["demand_strong"] = (next_body > body)[demand]
+    result["supply"] = p[supply]
+    result["supply_strong"] = (next_body > body)[supply]
+    return result
+
+
+def period_keys(timestamps: np.ndarray, period: str) -> np.ndarray:
+    """رقم الأسبوع أو الشهر التقويمي لكل شمعة (بتوقيت الرياض)"""
+    days = (np.asarray(timestamps, dtype=np.int64) + RIYADH_UTC_OFFSET) // 86400
+    if period == "weekly":
+        # 1970-01-01 كان يوم خميس، والإزاحة بأربعة أيام تجعل الأسبوع يبدأ يوم الأحد
+        return (days + 4) // 7
+    if period == "monthly":
+        return days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+    raise ValueError(f"فترة غير مدعومة: {period}")
+
+
+def resample(bars: Dict[str, np.ndarray], period: str) -> Dict[str, np.ndarray]:
+    """تجميع الشموع اليومية (من to_arrays) إلى شموع أسبوعية أو شهرية تقويمية
+
+    كل مجموعة: افتتاح أول يوم، أعلى قمة، أدنى قاع، إغلاق آخر يوم ومجموع الكمية.
+    المجموعة الأخيرة غير المكتملة (الأسبوع أو الشهر الحالي) تبقى ضمن النتائج.
+    timestamps في النتيجة هو وقت أول شمعة في كل مجموعة.
+    """
+    close = bars["close"]
+    n = len(close)
+    timestamps = bars.get("timestamps")
+    has_dates = timestamps is not None and len(timestamps) == n
+
+    if n == 0:
+        return {f: np.empty(0) for f in OHLC_FIELDS + ("volume", "timestamps")}
+
+    if has_dates:
+        keys = period_keys(timestamps, period)
+        starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+    else:
+        starts = np.arange(0, n, FALLBACK_BUCKET_BARS[period])
+    ends = np.append(starts[1:], n) - 1
+
+    return {
+        "open": bars["open"][starts],
+        "high": np.maximum.reduceat(bars["high"], starts),
+        "low": np.minimum.reduceat(bars["low"], starts),
+        "close": close[ends],
+        "volume": np.add.reduceat(np.nan_to_num(bars["volume"]), starts),
+        "timestamps": timestamps[starts] if has_dates else np.empty(0, dtype=np.int64),
+    }
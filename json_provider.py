@@ -0,0 +1,60 @@
+"""
+مزود JSON سريع لتطبيق Flask
+Fast JSON Provider - orjson when available, stdlib json otherwise
+"""
+import json
+import time
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+
+if HAS_ORJSON:
+    ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+else:
+    ORJSON_OPTIONS = 0
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """مزود JSON يستخدم orjson مع الرجوع إلى json القياسي
+
+    يضيف ترويسة Server-Timing بزمن التحويل لقياس كلفة الاستجابات الكبيرة
+    """
+
+    sort_keys = False
+    ensure_ascii = False
+
+    def dumps(self, obj, **kwargs) -> str:
+        # الخيارات الإضافية (indent وغيرها) غير مدعومة في orjson
+        if HAS_ORJSON and not kwargs:
+            return orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS).decode("utf-8")
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if HAS_ORJSON and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def encode(self, obj) -> bytes:
+        """تحويل الكائن إلى bytes مباشرة بدون نسخ إضافي"""
+        if HAS_ORJSON:
+            return orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS)
+        return json.dumps(
+            obj, default=self.default, ensure_ascii=False, separators=(",", ":")
+        ).encode("utf-8")
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+
+        start = time.perf_counter()
+        body = self.encode(obj)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        resp = self._app.response_class(body, mimetype=self.mimetype)
+        resp.headers["Server-Timing"] = f"json;dur={elapsed_ms:.2f};desc=\"{'orjson' if HAS_ORJSON else 'json'}\""
+        return resp
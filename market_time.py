@@ -0,0 +1,24 @@
+"""
+توقيت السوق السعودي
+Saudi Market Time - Riyadh timezone and trading calendar shared by the data modules
+
+السوق يعمل من الأحد إلى الخميس، من الساعة 10 صباحاً حتى 3 مساءً بتوقيت الرياض
+(UTC+3 بدون توقيت صيفي).
+"""
+from datetime import datetime, timedelta, timezone
+
+RIYADH_TZ = timezone(timedelta(hours=3))
+TRADING_WEEKDAYS = (6, 0, 1, 2, 3)  # datetime.weekday(): الأحد=6 ... الخميس=3
+MARKET_OPEN_HOUR = 10
+MARKET_CLOSE_HOUR = 15
+
+
+def last_market_close(now: datetime = None) -> datetime:
+    """آخر إغلاق للسوق حدث قبل `now`"""
+    now = (now or datetime.now(RIYADH_TZ)).astimezone(RIYADH_TZ)
+    close = now.replace(hour=MARKET_CLOSE_HOUR, minute=0, second=0, microsecond=0)
+    if close > now:
+        close -= timedelta(days=1)
+    while close.weekday() not in TRADING_WEEKDAYS:
+        close -= timedelta(days=1)
+    return close
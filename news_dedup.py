@@ -0,0 +1,104 @@
+"""
+تجميع الأخبار المتشابهة من المصادر المختلفة
+Near-Duplicate News Index - MinHash signatures over title shingles with LSH buckets
+
+نفس الخبر يُنشر في أرقام والاقتصادية ومال بصياغات مختلفة قليلاً. لكل عنوان جديد
+تُحسب بصمة MinHash من مقاطع الأحرف (بعد توحيد الكتابة العربية)، وتُقسم البصمة
+إلى نطاقات (LSH) فلا يُقارن العنوان إلا بالعناوين التي تشاركه نطاقاً واحداً على
+الأقل، بدلاً من مقارنته بكل الأخبار. الفهرس محدود الحجم (الأقدم يُحذف أولاً).
+"""
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Dict
+
+import numpy as np
+
+from news_store import search_terms
+
+_PRIME = (1 << 31) - 1
+
+
+class NearDuplicateIndex:
+    """فهرس بصمات العناوين: كل خبر جديد يُربط بمجموعة خبر سابق مشابه أو يبدأ مجموعة جديدة"""
+
+    NUM_PERM = 64
+    BANDS = 16  # 4 صفوف لكل نطاق: العناوين بتشابه 0.6 تُرشح باحتمال ~88%
+    SHINGLE_SIZE = 3
+    THRESHOLD = 0.6  # أقل تشابه Jaccard تقديري لاعتبار الخبرين نفس القصة
+    MAX_ENTRIES = 5000
+
+    def __init__(self, seed: int = 1):
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, _PRIME, size=self.NUM_PERM, dtype=np.int64)
+        self._b = rng.randint(0, _PRIME, size=self.NUM_PERM, dtype=np.int64)
+        self._rows = self.NUM_PERM // self.BANDS
+        self._entries = OrderedDict()  # المفتاح -> (البصمة، مفتاح ممثل المجموعة)
+        self._buckets = [{} for _ in range(self.BANDS)]  # لكل نطاق: قيمة النطاق -> مفاتيح
+        self._lock = threading.Lock()
+
+    def _shingles(self, title: str) -> np.ndarray:
+        text = " ".join(search_terms(title))
+        size = self.SHINGLE_SIZE
+        grams = {text[i:i + size] for i in range(max(len(text) - size + 1, 1))}
+        return np.array([zlib.crc32(g.encode("utf-8")) % _PRIME for g in grams], dtype=np.int64)
+
+    def signature(self, title: str) -> np.ndarray:
+        """بصمة MinHash للعنوان"""
+        shingles = self._shingles(title)
+        return ((np.outer(self._a, shingles) + self._b[:, None]) % _PRIME).min(axis=1)
+
+    def _bands(self, signature: np.ndarray):
+        rows = self._rows
+        for band in range(self.BANDS):
+            yield band, signature[band * rows:(band + 1) * rows].tobytes()
+
+    def add(self, key: str, title: str) -> str:
+        """إضافة خبر وترجع مفتاح ممثل مجموعته (المفتاح نفسه إذا لم يوجد خبر مشابه)"""
+        signature = self.signature(title)
+        with self._lock:
+            existing = self._entries.get(key)
+            if existing is not None:
+                return existing[1]
+
+            # المرشحون: من يشارك الخبر نطاقاً واحداً على الأقل
+            candidates = set()
+            for band, value in self._bands(signature):
+                candidates.update(self._buckets[band].get(value, ()))
+
+            cluster = key
+            if candidates:
+                candidates = list(candidates)
+                signatures = np.stack([self._entries[c][0] for c in candidates])
+                scores = (signatures == signature).mean(axis=1)
+                best = int(scores.argmax())
+                if scores[best] >= self.THRESHOLD:
+                    cluster = self._entries[candidates[best]][1]
+            self._entries[key] = (signature, cluster)
+            for band, value in self._bands(signature):
+                self._buckets[band].setdefault(value, set()).add(key)
+
+            while len(self._entries) > self.MAX_ENTRIES:
+                self._evict()
+            return cluster
+
+    def _evict(self):
+        old_key, (signature, _) = self._entries.popitem(last=False)
+        for band, value in self._bands(signature):
+            bucket = self._buckets[band].get(value)
+            if bucket is not None:
+                bucket.discard(old_key)
+                if not bucket:
+                    del self._buckets[band][value]
+
+    def status(self) -> Dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "clusters": len({cluster for _, cluster in self._entries.values()}),
+                "max_entries": self.MAX_ENTRIES,
+            }
+
+
+# الفهرس المشترك
+news_dedup = NearDuplicateIndex()
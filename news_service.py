@@ -4,14 +4,21 @@ News Service - Fetches news from multiple sources
 """
 
 import requests
-from bs4 import BeautifulSoup
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional
 import re
 import json
+import hashlib
+import threading
 import time
+from collections import OrderedDict
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
+import html_extract
+from news_store import news_store
+from news_dedup import news_dedup
+from news_tagger import symbol_tagger
+
 class NewsAggregator:
     """مجمع الأخبار من مصادر متعددة"""
 
@@ -21,145 +28,275 @@ class NewsAggregator:
         'Accept-Language': 'ar,en;q=0.9',
     }
 
-    # Cache للأخبار
-    _news_cache = {}
-    _cache_time = None
-    CACHE_DURATION = 300  # 5 دقائق
+    # إعدادات كل مصدر: الصفحة الرئيسية ومدة الصلاحية وعدد الأخبار في get_all_news
+    SOURCES = {
+        'argaam': {'url': 'https://www.argaam.com/ar', 'ttl': 180, 'limit': 20},
+        'aleqt': {'url': 'https://www.aleqt.com/', 'ttl': 300, 'limit': 15},
+        'maaal': {'url': 'https://maaal.com/', 'ttl': 600, 'limit': 15},
+    }
+    MAX_ARTICLES_PER_SOURCE = 50
 
-    @classmethod
-    def get_all_news(cls, limit: int = 50) -> List[Dict]:
-        """جلب جميع الأخبار من كل المصادر"""
-        # التحقق من الكاش
-        if cls._cache_time and (datetime.now() - cls._cache_time).seconds < cls.CACHE_DURATION:
-            if 'all' in cls._news_cache:
-                return cls._news_cache['all'][:limit]
+    # كاش لكل مصدر: المصدر -> {checked_at, etag, last_modified, digest, articles}
+    _source_cache = {}
+    _source_locks = {source: threading.Lock() for source in SOURCES}
 
-        all_news = []
+    # نصوص مقالات أرقام (LRU في الذاكرة، والنسخة الدائمة في مخزن الأخبار)
+    ARTICLE_CACHE_SIZE = 200
+    PREFETCH_ARTICLES = 5  # نصوص أول الأخبار تُجلب في الخلفية بعد كل تحديث (0 للإيقاف)
+    _article_cache = OrderedDict()
+    _article_lock = threading.Lock()
+    _prefetching = False
 
-        # جلب من كل المصادر بالتوازي
-        with ThreadPoolExecutor(max_workers=4) as executor:
-            futures = {
-                executor.submit(cls.get_argaam_news): 'argaam',
-                executor.submit(cls.get_aleqt_news): 'aleqt',
-                executor.submit(cls.get_maaal_news): 'maaal',
+    @classmethod
+    def _get_source(cls, source: str) -> List[Dict]:
+        """أخبار مصدر من الكاش، مع تحديثه عند انتهاء صلاحيته
+
+        التحديث طلب شرطي (If-None-Match / If-Modified-Since)؛ إذا لم تتغير الصفحة
+        (304 أو نفس المحتوى) لا يُحلل شيء، وإلا تُبنى فقط الأخبار غير المعروفة.
+        عند فشل الطلب تُرجع آخر أخبار محفوظة.
+        """
+        config = cls.SOURCES[source]
+        with cls._source_locks[source]:
+            entry = cls._source_cache.get(source)
+            now = time.monotonic()
+            if entry and now - entry['checked_at'] < config['ttl']:
+                return entry['articles']
+
+            headers = dict(cls.HEADERS)
+            if entry and entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry and entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+            try:
+                resp = requests.get(config['url'], headers=headers, timeout=15)
+            except Exception as e:
+                print(f"{source} error: {e}")
+                resp = None
+
+            if resp is None or resp.status_code not in (200, 304) or (resp.status_code == 304 and not entry):
+                if resp is not None:
+                    print(f"{source} status: {resp.status_code}")
+                if entry:
+                    entry['checked_at'] = now  # إعادة المحاولة بعد مدة الصلاحية
+                    return entry['articles']
+                return []
+
+            if resp.status_code == 304:
+                entry['checked_at'] = now
+                return entry['articles']
+
+            digest = hashlib.sha1(resp.content).hexdigest()
+            if entry and digest == entry['digest']:
+                articles = entry['articles']
+            else:
+                known = {a['url']: a for a in entry['articles']} if entry else {}
+                parser = getattr(cls, f'_parse_{source}')
+                try:
+                    articles = parser(resp.text, known)[:cls.MAX_ARTICLES_PER_SOURCE]
+                    # ربط الأخبار الجديدة فقط بالأسهم وبمجموعة الأخبار المشابهة ثم حفظها
+                    # (الخبر المعروف الذي تغير عنوانه يُبنى من جديد فيُعامل كجديد)
+                    new_articles = [a for a in articles if known.get(a['url']) is not a]
+                    for article in new_articles:
+                        article['symbols'] = symbol_tagger.tag(article['title'])
+                        article['cluster'] = news_dedup.add(article['url'], article['title'])
+                    news_store.add_articles(new_articles)
+                    if source == 'argaam' and new_articles:
+                        cls._start_prefetch(articles)
+                except Exception as e:
+                    print(f"{source} parse error: {e}")
+                    articles = entry['articles'] if entry else []
+
+            cls._source_cache[source] = {
+                'checked_at': now,
+                'etag': resp.headers.get('ETag'),
+                'last_modified': resp.headers.get('Last-Modified'),
+                'digest': digest,
+                'articles': articles,
             }
+            return articles
+
+    @classmethod
+    def _get_sources(cls) -> Dict[str, List[Dict]]:
+        """أخبار كل المصادر (المصادر المنتهية تُحدث بالتوازي)"""
+        results = {}
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = {executor.submit(cls._get_source, source): source for source in cls.SOURCES}
 
             for future in as_completed(futures):
                 source = futures[future]
                 try:
-                    news = future.result()
-                    all_news.extend(news)
+                    results[source] = future.result()
                 except Exception as e:
                     print(f"Error fetching {source}: {e}")
+        return results
+
+    @classmethod
+    def get_all_news(cls, limit: int = 50) -> List[Dict]:
+        """جلب جميع الأخبار من كل المصادر (كل مصدر من كاشه الخاص)"""
+        all_news = []
+        results = cls._get_sources()
+        for source, config in cls.SOURCES.items():
+            all_news.extend(results.get(source, [])[:config['limit']])
 
-        # ترتيب حسب التاريخ
-        all_news.sort(key=lambda x: x.get('date', ''), reverse=True)
+        # ترتيب حسب التاريخ (أول خبر ظهر في مجموعته يسبق المشابه له)
+        all_news.sort(key=lambda x: (x.get('date', ''), x['url'] == x.get('cluster')), reverse=True)
 
-        # إزالة المكررات
-        seen = set()
+        # إزالة المكررات: خبر واحد لكل مجموعة أخبار متشابهة، مع روابط المصادر الأخرى
+        clusters = {}
         unique_news = []
         for news in all_news:
             title = news.get('title', '')
-            if title and title not in seen:
-                seen.add(title)
-                unique_news.append(news)
-
-        # حفظ في الكاش
-        cls._news_cache['all'] = unique_news
-        cls._cache_time = datetime.now()
+            if not title:
+                continue
+            key = news.get('cluster') or title
+            representative = clusters.get(key)
+            if representative is None:
+                clusters[key] = dict(news, related=[])
+                unique_news.append(clusters[key])
+            elif news['url'] != representative['url']:
+                representative['related'].append({
+                    'title': title,
+                    'url': news['url'],
+                    'source': news.get('source'),
+                })
 
         return unique_news[:limit]
 
     @classmethod
     def get_argaam_news(cls, limit: int = 20) -> List[Dict]:
         """جلب أخبار من أرقام"""
+        return cls._get_source('argaam')[:limit]
+
+    @classmethod
+    def _parse_argaam(cls, page: str, known: Dict[str, Dict]) -> List[Dict]:
+        """استخراج أخبار أرقام (الأخبار المعروفة بنفس العنوان تُعاد كما هي)"""
         news = []
-        try:
-            resp = requests.get(
-                'https://www.argaam.com/ar',
-                headers=cls.HEADERS,
-                timeout=15
-            )
+        doc = html_extract.Document(page)
 
-            if resp.status_code == 200:
-                soup = BeautifulSoup(resp.text, 'html.parser')
+        # البحث عن روابط المقالات
+        links = doc.links('/ar/article/articledetail')
 
-                # البحث عن روابط المقالات
-                links = soup.find_all('a', href=lambda x: x and '/ar/article/articledetail' in str(x))
+        seen_ids = set()
+        for href, link_text in links:
 
-                seen_ids = set()
-                for link in links:
-                    href = link.get('href', '')
+            # استخراج ID المقال
+            article_id = ''
+            if '/id/' in href:
+                article_id = href.split('/id/')[-1].split('/')[0].split('?')[0]
 
-                    # استخراج ID المقال
-                    article_id = ''
-                    if '/id/' in href:
-                        article_id = href.split('/id/')[-1].split('/')[0].split('?')[0]
+            if not article_id or article_id in seen_ids:
+                continue
+            seen_ids.add(article_id)
 
-                    if not article_id or article_id in seen_ids:
-                        continue
-                    seen_ids.add(article_id)
+            url = f"https://www.argaam.com{href}" if href.startswith('/') else href
 
-                    # الحصول على العنوان
-                    title = link.get_text(strip=True)
+            # الحصول على العنوان
+            title = link_text
 
-                    # تنظيف العنوان
-                    if not title or len(title) < 10:
-                        continue
+            # تنظيف العنوان
+            if not title or len(title) < 10:
+                continue
 
-                    # إزالة النصوص الإضافية
-                    title = re.sub(r'(خاص|حصري|مختارات أرقام|تقارير أرقام)', '', title).strip()
+            # إزالة النصوص الإضافية
+            title = re.sub(r'(خاص|حصري|مختارات أرقام|تقارير أرقام)', '', title).strip()[:150]
 
-                    if len(title) > 10:
-                        news.append({
-                            'id': article_id,
-                            'title': title[:150],
-                            'url': f"https://www.argaam.com{href}" if href.startswith('/') else href,
-                            'source': 'أرقام',
-                            'source_icon': '📊',
-                            'date': datetime.now().strftime('%Y-%m-%d'),
-                            'category': 'أسواق'
-                        })
+            # الخبر المعروف يُعاد كما هو ما لم يتغير عنوانه
+            if url in known and known[url]['title'] == title:
+                news.append(known[url])
+                continue
 
-                    if len(news) >= limit:
-                        break
+            if len(title) > 10:
+                news.append({
+                    'id': article_id,
+                    'title': title,
+                    'url': url,
+                    'source': 'أرقام',
+                    'source_icon': '📊',
+                    'date': datetime.now().strftime('%Y-%m-%d'),
+                    'category': 'أسواق'
+                })
 
-        except Exception as e:
-            print(f"Argaam error: {e}")
+            if len(news) >= cls.MAX_ARTICLES_PER_SOURCE:
+                break
 
         return news
 
     @classmethod
     def get_argaam_article_content(cls, article_id: str) -> Optional[Dict]:
-        """جلب محتوى مقال من أرقام"""
+        """محتوى مقال من أرقام (من الذاكرة، ثم مخزن الأخبار، ثم الموقع)"""
+        article_id = str(article_id)
+        with cls._article_lock:
+            article = cls._article_cache.get(article_id)
+            if article is not None:
+                cls._article_cache.move_to_end(article_id)
+                return article
+
+        try:
+            article = news_store.get_body('أرقام', article_id)
+        except Exception as e:
+            print(f"News store error: {e}")
+            article = None
+
+        if article is None:
+            article = cls._fetch_argaam_article(article_id)
+            if article is None:
+                return None
+
+        with cls._article_lock:
+            cls._article_cache[article_id] = article
+            cls._article_cache.move_to_end(article_id)
+            while len(cls._article_cache) > cls.ARTICLE_CACHE_SIZE:
+                cls._article_cache.popitem(last=False)
+        return article
+
+    @classmethod
+    def _start_prefetch(cls, articles: List[Dict]):
+        """جلب نصوص أول الأخبار في الخلفية (إذا لم يكن هناك جلب قيد التشغيل)"""
+        ids = [a['id'] for a in articles[:cls.PREFETCH_ARTICLES] if a.get('id')]
+        with cls._article_lock:
+            if not ids or cls._prefetching:
+                return
+            cls._prefetching = True
+
+        def prefetch():
+            try:
+                for article_id in ids:
+                    cls.get_argaam_article_content(article_id)
+            finally:
+                with cls._article_lock:
+                    cls._prefetching = False
+
+        threading.Thread(target=prefetch, daemon=True).start()
+
+    @classmethod
+    def _fetch_argaam_article(cls, article_id: str) -> Optional[Dict]:
+        """تنزيل مقال من أرقام وتحليله وحفظ نصه في مخزن الأخبار"""
         try:
             url = f"https://www.argaam.com/ar/article/articledetail/id/{article_id}"
             resp = requests.get(url, headers=cls.HEADERS, timeout=15)
 
             if resp.status_code == 200:
-                soup = BeautifulSoup(resp.text, 'html.parser')
+                doc = html_extract.Document(resp.text)
 
                 # البحث عن المحتوى
-                paragraphs = soup.find_all('p')
+                paragraphs = doc.texts('p')
                 content = []
 
-                for p in paragraphs:
-                    text = p.get_text(strip=True)
+                for text in paragraphs:
                     # تجاهل النصوص القصيرة جداً أو الخاصة بالموقع
                     if len(text) > 30 and 'أرقام' not in text[:20] and 'تسجيل' not in text[:20]:
                         content.append(text)
 
                 # استخراج العنوان
-                title_tag = soup.find('h1') or soup.find('h2')
-                title = title_tag.get_text(strip=True) if title_tag else ''
+                title = doc.first_text('h1')
+                if title is None:
+                    title = doc.first_text('h2') or ''
 
                 # استخراج التاريخ
-                date_text = ''
-                date_tag = soup.find(['time', 'span'], class_=lambda x: x and 'date' in str(x).lower())
-                if date_tag:
-                    date_text = date_tag.get_text(strip=True)
+                date_text = doc.first_text_by_class(('time', 'span'), 'date') or ''
 
-                return {
+                article = {
                     'id': article_id,
                     'title': title,
                     'content': '\n\n'.join(content[:15]),  # أول 15 فقرة
@@ -167,6 +304,10 @@ class NewsAggregator:
                     'date': date_text,
                     'source': 'أرقام'
                 }
+                article['symbols'] = symbol_tagger.tag(f"{title}\n{article['content']}")
+                # حفظ النص في المخزن ليدخل في البحث
+                news_store.save_body(article)
+                return article
 
         except Exception as e:
             print(f"Error fetching article {article_id}: {e}")
@@ -176,118 +317,107 @@ class NewsAggregator:
     @classmethod
     def get_aleqt_news(cls, limit: int = 15) -> List[Dict]:
         """جلب أخبار من الاقتصادية"""
-        news = []
-        try:
-            resp = requests.get(
-                'https://www.aleqt.com/',
-                headers=cls.HEADERS,
-                timeout=15
-            )
+        return cls._get_source('aleqt')[:limit]
 
-            if resp.status_code == 200:
-                soup = BeautifulSoup(resp.text, 'html.parser')
-
-                # البحث عن الروابط
-                links = soup.find_all('a', href=True)
+    @classmethod
+    def _parse_aleqt(cls, page: str, known: Dict[str, Dict]) -> List[Dict]:
+        """استخراج أخبار الاقتصادية (الأخبار المعروفة بنفس العنوان تُعاد كما هي)"""
+        news = []
+        doc = html_extract.Document(page)
 
-                seen_titles = set()
-                for link in links:
-                    href = link.get('href', '')
-                    title = link.get_text(strip=True)
+        # البحث عن الروابط
+        links = doc.links()
 
-                    # فلترة
-                    if not title or len(title) < 20 or len(title) > 200:
-                        continue
+        seen_titles = set()
+        for href, title in links:
 
-                    if title in seen_titles:
-                        continue
+            # فلترة
+            if not title or len(title) < 20 or len(title) > 200:
+                continue
 
-                    # تجاهل الروابط العامة
-                    if any(x in title for x in ['تسجيل', 'الدخول', 'اشترك', 'البحث', 'القائمة']):
-                        continue
+            if title in seen_titles:
+                continue
 
-                    seen_titles.add(title)
+            # تجاهل الروابط العامة
+            if any(x in title for x in ['تسجيل', 'الدخول', 'اشترك', 'البحث', 'القائمة']):
+                continue
 
-                    full_url = href if href.startswith('http') else f"https://www.aleqt.com{href}"
+            seen_titles.add(title)
 
-                    news.append({
-                        'title': title,
-                        'url': full_url,
-                        'source': 'الاقتصادية',
-                        'source_icon': '📰',
-                        'date': datetime.now().strftime('%Y-%m-%d'),
-                        'category': 'اقتصاد'
-                    })
+            full_url = href if href.startswith('http') else f"https://www.aleqt.com{href}"
 
-                    if len(news) >= limit:
-                        break
+            if full_url in known and known[full_url]['title'] == title:
+                news.append(known[full_url])
+            else:
+                news.append({
+                    'title': title,
+                    'url': full_url,
+                    'source': 'الاقتصادية',
+                    'source_icon': '📰',
+                    'date': datetime.now().strftime('%Y-%m-%d'),
+                    'category': 'اقتصاد'
+                })
 
-        except Exception as e:
-            print(f"Aleqt error: {e}")
+            if len(news) >= cls.MAX_ARTICLES_PER_SOURCE:
+                break
 
         return news
 
     @classmethod
     def get_maaal_news(cls, limit: int = 15) -> List[Dict]:
         """جلب أخبار من مال"""
-        news = []
-        try:
-            resp = requests.get(
-                'https://maaal.com/',
-                headers=cls.HEADERS,
-                timeout=15
-            )
+        return cls._get_source('maaal')[:limit]
 
-            if resp.status_code == 200:
-                soup = BeautifulSoup(resp.text, 'html.parser')
+    @classmethod
+    def _parse_maaal(cls, page: str, known: Dict[str, Dict]) -> List[Dict]:
+        """استخراج أخبار مال (الأخبار المعروفة بنفس العنوان تُعاد كما هي)"""
+        news = []
+        doc = html_extract.Document(page)
 
-                # البحث عن المقالات
-                articles = soup.find_all(['article', 'div'], class_=lambda x: x and any(k in str(x).lower() for k in ['post', 'article', 'entry']))
+        # البحث عن المقالات (أول رابط وأول عنوان في كل منها)
+        articles = doc.blocks(('article', 'div'), ('post', 'article', 'entry'), ('h2', 'h3', 'h4', 'a'))
 
-                for article in articles[:limit]:
-                    link = article.find('a', href=True)
-                    if not link:
-                        continue
+        for article in articles[:cls.MAX_ARTICLES_PER_SOURCE]:
+            href = article['href']
+            if href is None:
+                continue
 
-                    href = link.get('href', '')
+            url = href if href.startswith('http') else f"https://maaal.com{href}"
 
-                    # البحث عن العنوان
-                    title_tag = article.find(['h2', 'h3', 'h4', 'a'])
-                    title = title_tag.get_text(strip=True) if title_tag else ''
+            # العنوان
+            title = article['title']
 
-                    if not title or len(title) < 15:
-                        continue
+            if not title or len(title) < 15:
+                continue
+            title = title[:150]
 
-                    news.append({
-                        'title': title[:150],
-                        'url': href if href.startswith('http') else f"https://maaal.com{href}",
-                        'source': 'مال',
-                        'source_icon': '💰',
-                        'date': datetime.now().strftime('%Y-%m-%d'),
-                        'category': 'أعمال'
-                    })
+            # الخبر المعروف يُعاد كما هو ما لم يتغير عنوانه
+            if url in known and known[url]['title'] == title:
+                news.append(known[url])
+                continue
 
-        except Exception as e:
-            print(f"Maaal error: {e}")
+            news.append({
+                'title': title,
+                'url': url,
+                'source': 'مال',
+                'source_icon': '💰',
+                'date': datetime.now().strftime('%Y-%m-%d'),
+                'category': 'أعمال'
+            })
 
         return news
 
     @classmethod
     def search_news(cls, query: str, limit: int = 20) -> List[Dict]:
-        """البحث في الأخبار"""
-        all_news = cls.get_all_news(100)
-
-        query_lower = query.lower()
-        results = []
-
-        for news in all_news:
-            title = news.get('title', '').lower()
-            if query_lower in title:
-                results.append(news)
-                if len(results) >= limit:
-                    break
+        """البحث في الأخبار (كل الأخبار المحفوظة، مرتبة حسب الصلة)"""
+        # تحديث المصادر المنتهية أولاً حتى تدخل آخر الأخبار في المخزن
+        cls._get_sources()
 
-        return results
+        try:
+            return news_store.search(query, limit)
+        except Exception as e:
+            print(f"News search error: {e}")
+            return []
 
     @classmethod
     def get_news_by_source(cls, source: str, limit: int = 20) -> List[Dict]:
@@ -305,9 +435,10 @@ class NewsAggregator:
 
     @classmethod
     def clear_cache(cls):
-        """مسح الكاش"""
-        cls._news_cache = {}
-        cls._cache_time = None
+        """مسح الكاش (التحديث التالي يطلب كل المصادر بدون شروط)"""
+        for source in cls.SOURCES:
+            with cls._source_locks[source]:
+                cls._source_cache.pop(source, None)
 
 
 # للتوافق مع الكود القديم
@@ -315,21 +446,24 @@ class NewsService:
     """واجهة متوافقة مع الكود القديم"""
 
     @staticmethod
-    def get_stock_news(symbol: str) -> List[Dict]:
-        """جلب أخبار السهم"""
+    def get_stock_news(symbol: str, limit: int = 10) -> List[Dict]:
+        """جلب أخبار السهم (الأخبار التي ذُكر فيها اسمه أو رمزه)"""
         code = symbol.strip().replace(".SR", "")
+        return NewsService.get_portfolio_news([code], limit)
 
-        # البحث عن أخبار متعلقة بالسهم
-        all_news = NewsAggregator.get_all_news(50)
+    @staticmethod
+    def get_portfolio_news(symbols: List[str], limit: int = 20) -> List[Dict]:
+        """جلب أخبار أسهم المحفظة من فهرس الرموز"""
+        codes = [s.strip().replace(".SR", "") for s in symbols]
 
-        # للأسف لا يمكننا ربط الأخبار بالأسهم بدقة بدون API
-        # نرجع الأخبار العامة
-        return all_news[:10]
+        # تحديث المصادر المنتهية حتى تُربط آخر الأخبار
+        NewsAggregator._get_sources()
 
-    @staticmethod
-    def get_portfolio_news(symbols: List[str]) -> List[Dict]:
-        """جلب أخبار المحفظة"""
-        return NewsAggregator.get_all_news(20)
+        try:
+            return news_store.by_symbols(codes, limit)
+        except Exception as e:
+            print(f"News index error: {e}")
+            return []
 
     @staticmethod
     def get_saudi_market_news() -> List[Dict]:
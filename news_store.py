@@ -0,0 +1,361 @@
+"""
+مخزن الأخبار الدائم مع بحث نصي كامل
+Persistent News Store - SQLite table + FTS5 inverted index over normalized Arabic text
+
+كل خبر يُجلب من المصادر يُحفظ مرة واحدة (حسب الرابط) مع تاريخ أول ظهور، ونص
+المقال إذا تم فتحه. العنوان والنص يُفهرسان بعد توحيد الكتابة العربية (الألف
+والهمزات، التاء المربوطة، الألف المقصورة، التشكيل والتطويل، أداة التعريف)
+فالبحث عن "اسعار" يجد "أسعار" و"الأسعار". النتائج مرتبة حسب bm25 مع وزن أكبر
+للعنوان. الأخبار الأقدم من RETENTION_DAYS تُحذف تلقائياً.
+
+إذا لم يكن FTS5 متوفراً في sqlite3 يُستخدم بحث LIKE على نفس النصوص الموحدة.
+"""
+import pathlib
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+DB_FILE = pathlib.Path(__file__).parent / "cache" / "news.db"
+
+SECONDS_PER_DAY = 86400
+
+# التشكيل وعلامات القرآن والتطويل
+_DIACRITICS_RE = re.compile(r"[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED\u0640]")
+_CHAR_MAP = str.maketrans({
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا",
+    "ؤ": "و", "ئ": "ي", "ى": "ي", "ة": "ه",
+    # الأرقام العربية الهندية
+    "٠": "0", "١": "1", "٢": "2", "٣": "3", "٤": "4",
+    "٥": "5", "٦": "6", "٧": "7", "٨": "8", "٩": "9",
+})
+_WORD_RE = re.compile(r"\w+")
+# أداة التعريف مع حروف الجر والعطف الملتصقة بها
+_ARTICLE_PREFIXES = ("وال", "بال", "كال", "فال", "لل", "ال")
+
+
+def normalize_arabic(text: str) -> str:
+    """توحيد الكتابة: حذف التشكيل والتطويل، توحيد الألف والهمزات والتاء المربوطة، أحرف صغيرة"""
+    if not text:
+        return ""
+    return _DIACRITICS_RE.sub("", text).translate(_CHAR_MAP).lower()
+
+
+def search_terms(text: str) -> List[str]:
+    """كلمات النص بعد التوحيد وحذف أداة التعريف (للفهرسة والبحث معاً)"""
+    terms = []
+    for word in _WORD_RE.findall(normalize_arabic(text)):
+        for prefix in _ARTICLE_PREFIXES:
+            if word.startswith(prefix) and len(word) - len(prefix) >= 2:
+                word = word[len(prefix):]
+                break
+        terms.append(word)
+    return terms
+
+
+def _index_text(text: str) -> str:
+    return " ".join(search_terms(text))
+
+
+class NewsStore:
+    """جدول الأخبار مع فهرس نصي
+
+    articles: خبر لكل رابط (first_seen بالثواني، body نص المقال إن وجد)
+    news_fts: العنوان والنص الموحدان لنفس rowid
+    article_symbols: فهرس (الرمز، الخبر) من ربط الأخبار بالأسهم عند الإدخال
+    """
+
+    RETENTION_DAYS = 180
+    PRUNE_INTERVAL = 3600  # ثانية بين عمليات الحذف
+    TITLE_WEIGHT = 5.0  # وزن العنوان مقابل النص في bm25
+
+    FIELDS = ("url", "article_id", "title", "source", "source_icon", "category", "date")
+
+    def __init__(self, path: pathlib.Path = DB_FILE):
+        self.path = pathlib.Path(path)
+        self._conn = None
+        self.has_fts5 = False
+        self._pruned_at = 0.0
+        self._lock = threading.RLock()
+
+    # ==================== قاعدة البيانات ====================
+
+    def _db(self) -> sqlite3.Connection:
+        """فتح قاعدة البيانات عند أول استخدام"""
+        if self._conn is not None:
+            return self._conn
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS articles (
+                id INTEGER PRIMARY KEY,
+                url TEXT UNIQUE NOT NULL,
+                article_id TEXT,
+                title TEXT NOT NULL,
+                source TEXT,
+                source_icon TEXT,
+                category TEXT,
+                date TEXT,
+                first_seen REAL NOT NULL,
+                body TEXT,
+                page_title TEXT,
+                page_date TEXT
+            );
+            CREATE INDEX IF NOT EXISTS articles_first_seen ON articles(first_seen);
+            CREATE INDEX IF NOT EXISTS articles_article_id ON articles(source, article_id);
+            CREATE TABLE IF NOT EXISTS article_symbols (
+                symbol TEXT NOT NULL,
+                id INTEGER NOT NULL,
+                PRIMARY KEY (symbol, id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS article_symbols_id ON article_symbols(id);
+            CREATE TABLE IF NOT EXISTS articles_text (
+                id INTEGER PRIMARY KEY,
+                title TEXT,
+                body TEXT
+            );
+        """)
+        # قواعد بيانات أنشئت قبل حفظ عنوان وتاريخ صفحة المقال
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(articles)")}
+        for column in ("page_title", "page_date"):
+            if column not in columns:
+                conn.execute(f"ALTER TABLE articles ADD COLUMN {column} TEXT")
+        try:
+            conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS news_fts USING fts5(title, body)")
+            self.has_fts5 = True
+        except sqlite3.OperationalError as e:
+            print(f"FTS5 غير متوفر، سيُستخدم بحث LIKE: {e}")
+        conn.commit()
+        self._conn = conn
+        return conn
+
+    def _index(self, conn: sqlite3.Connection, rowid: int, title: str, body: str):
+        """تحديث النص الموحد للخبر (في FTS5 إذا كان متوفراً)"""
+        title, body = _index_text(title), _index_text(body)
+        conn.execute("INSERT OR REPLACE INTO articles_text (id, title, body) VALUES (?, ?, ?)",
+                     (rowid, title, body))
+        if self.has_fts5:
+            conn.execute("DELETE FROM news_fts WHERE rowid = ?", (rowid,))
+            conn.execute("INSERT INTO news_fts (rowid, title, body) VALUES (?, ?, ?)", (rowid, title, body))
+
+    def _row_dicts(self, conn: sqlite3.Connection, rows: List[sqlite3.Row]) -> List[Dict]:
+        """صفوف الأخبار كقواميس مع رموز الأسهم المرتبطة بكل خبر"""
+        symbols = {}
+        ids = [row["id"] for row in rows]
+        if ids:
+            marks = ",".join("?" * len(ids))
+            for rowid, symbol in conn.execute(
+                    f"SELECT id, symbol FROM article_symbols WHERE id IN ({marks}) ORDER BY symbol", ids):
+                symbols.setdefault(rowid, []).append(symbol)
+
+        result = []
+        for row in rows:
+            article = {field: row[field] for field in self.FIELDS if row[field] is not None}
+            if article.get("article_id"):
+                article["id"] = article.pop("article_id")
+            article["symbols"] = symbols.get(row["id"], [])
+            result.append(article)
+        return result
+
+    @staticmethod
+    def _tag(conn: sqlite3.Connection, rowid: int, symbols: List[str]):
+        conn.executemany("INSERT OR IGNORE INTO article_symbols (symbol, id) VALUES (?, ?)",
+                         [(symbol, rowid) for symbol in symbols or []])
+
+    # ==================== الكتابة ====================
+
+    def add_articles(self, articles: List[Dict]) -> List[Dict]:
+        """حفظ الأخبار غير الموجودة (حسب الرابط) وتحديث ما تغير عنوانه، وترجع الجديد والمحدث فقط"""
+        added = []
+        now = time.time()
+        with self._lock:
+            conn = self._db()
+            with conn:
+                for article in articles:
+                    url = article.get("url")
+                    if not url or not article.get("title"):
+                        continue
+                    cursor = conn.execute(
+                        "INSERT OR IGNORE INTO articles (url, article_id, title, source, source_icon,"
+                        " category, date, first_seen) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (url, article.get("id"), article["title"], article.get("source"),
+                         article.get("source_icon"), article.get("category"), article.get("date"), now))
+                    if cursor.rowcount:
+                        self._index(conn, cursor.lastrowid, article["title"], "")
+                        self._tag(conn, cursor.lastrowid, article.get("symbols"))
+                        added.append(article)
+                        continue
+
+                    row = conn.execute("SELECT id, title, body FROM articles WHERE url = ?", (url,)).fetchone()
+                    if row["title"] != article["title"]:
+                        conn.execute("UPDATE articles SET title = ? WHERE id = ?", (article["title"], row["id"]))
+                        self._index(conn, row["id"], article["title"], row["body"] or "")
+                        # الرموز المرتبطة بالعنوان القديم لم تعد صحيحة
+                        conn.execute("DELETE FROM article_symbols WHERE id = ?", (row["id"],))
+                        self._tag(conn, row["id"], article.get("symbols"))
+                        added.append(article)
+            self._maybe_prune(conn, now)
+        return added
+
+    def save_body(self, article: Dict):
+        """حفظ نص مقال تم فتحه (يُضاف الخبر إذا لم يكن محفوظاً، وتُضاف رموزه الجديدة)
+
+        عنوان الصفحة وتاريخها يُحفظان مع النص ليُرجع get_body المقال كما جُلب.
+        """
+        body = article.get("content") or ""
+        page = (article.get("title"), article.get("date"))
+        with self._lock:
+            conn = self._db()
+            with conn:
+                row = None
+                if article.get("id"):
+                    row = conn.execute("SELECT id, title FROM articles WHERE source = ? AND article_id = ?",
+                                       (article.get("source"), str(article["id"]))).fetchone()
+                if row is None:
+                    row = conn.execute("SELECT id, title FROM articles WHERE url = ?",
+                                       (article.get("url"),)).fetchone()
+                if row is None:
+                    if not article.get("url") or not article.get("title"):
+                        return
+                    cursor = conn.execute(
+                        "INSERT INTO articles (url, article_id, title, source, category, date, first_seen, body,"
+                        " page_title, page_date) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (article["url"], article.get("id"), article["title"], article.get("source"),
+                         article.get("category"), article.get("date"), time.time(), body, *page))
+                    rowid, title = cursor.lastrowid, article["title"]
+                else:
+                    rowid, title = row["id"], row["title"]
+                    conn.execute("UPDATE articles SET body = ?, page_title = ?, page_date = ? WHERE id = ?",
+                                 (body, *page, rowid))
+                self._index(conn, rowid, title, body)
+                self._tag(conn, rowid, article.get("symbols"))
+
+    def _maybe_prune(self, conn: sqlite3.Connection, now: float):
+        if now - self._pruned_at >= self.PRUNE_INTERVAL:
+            self._pruned_at = now
+            self._prune(conn, now - self.RETENTION_DAYS * SECONDS_PER_DAY)
+
+    def _prune(self, conn: sqlite3.Connection, cutoff: float) -> int:
+        with conn:
+            ids = [row[0] for row in conn.execute("SELECT id FROM articles WHERE first_seen < ?", (cutoff,))]
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                marks = ",".join("?" * len(chunk))
+                conn.execute(f"DELETE FROM articles WHERE id IN ({marks})", chunk)
+                conn.execute(f"DELETE FROM articles_text WHERE id IN ({marks})", chunk)
+                conn.execute(f"DELETE FROM article_symbols WHERE id IN ({marks})", chunk)
+                if self.has_fts5:
+                    conn.execute(f"DELETE FROM news_fts WHERE rowid IN ({marks})", chunk)
+        return len(ids)
+
+    def prune(self, retention_days: int = None) -> int:
+        """حذف الأخبار الأقدم من مدة الاحتفاظ (ترجع عدد المحذوف)"""
+        days = self.RETENTION_DAYS if retention_days is None else retention_days
+        with self._lock:
+            return self._prune(self._db(), time.time() - days * SECONDS_PER_DAY)
+
+    # ==================== القراءة ====================
+
+    def search(self, query: str, limit: int = 20) -> List[Dict]:
+        """بحث في العناوين والنصوص (كل الكلمات مطلوبة، مع مطابقة بداية الكلمة)"""
+        terms = search_terms(query)
+        if not terms:
+            return []
+
+        with self._lock:
+            conn = self._db()
+            if self.has_fts5:
+                match = " ".join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+                rows = conn.execute(
+                    "SELECT a.* FROM news_fts JOIN articles a ON a.id = news_fts.rowid"
+                    " WHERE news_fts MATCH ? ORDER BY bm25(news_fts, ?, 1.0), a.first_seen DESC LIMIT ?",
+                    (match, self.TITLE_WEIGHT, limit)).fetchall()
+            else:
+                conditions = " AND ".join("(' ' || t.title || ' ' || t.body) LIKE ?" for _ in terms)
+                rows = conn.execute(
+                    f"SELECT a.* FROM articles_text t JOIN articles a ON a.id = t.id WHERE {conditions}"
+                    " ORDER BY a.first_seen DESC LIMIT ?",
+                    [f"% {term}%" for term in terms] + [limit]).fetchall()
+            return self._row_dicts(conn, rows)
+
+    def get(self, url: str) -> Optional[Dict]:
+        with self._lock:
+            conn = self._db()
+            row = conn.execute("SELECT * FROM articles WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                return None
+            article = self._row_dicts(conn, [row])[0]
+        if row["body"]:
+            article["content"] = row["body"]
+        return article
+
+    def get_body(self, source: str, article_id: str) -> Optional[Dict]:
+        """مقال محفوظ بنصه (حسب المصدر ورقم المقال) أو None إذا لم يُحفظ نصه
+
+        بنفس شكل المقال المحفوظ عبر save_body (عنوان الصفحة وتاريخها وليس عنوان الخبر)
+        """
+        with self._lock:
+            conn = self._db()
+            row = conn.execute("SELECT * FROM articles WHERE source = ? AND article_id = ? AND body != ''",
+                               (source, str(article_id))).fetchone()
+            if row is None:
+                return None
+            symbols = self._row_dicts(conn, [row])[0]["symbols"]
+        return {
+            "id": row["article_id"],
+            "title": row["page_title"] if row["page_title"] is not None else row["title"],
+            "content": row["body"],
+            "url": row["url"],
+            "date": row["page_date"] if row["page_date"] is not None else row["date"],
+            "source": row["source"],
+            "symbols": symbols,
+        }
+
+    def recent(self, limit: int = 50, source: str = None) -> List[Dict]:
+        """آخر الأخبار المحفوظة حسب تاريخ أول ظهور"""
+        with self._lock:
+            conn = self._db()
+            if source:
+                rows = conn.execute("SELECT * FROM articles WHERE source = ? ORDER BY first_seen DESC LIMIT ?",
+                                    (source, limit)).fetchall()
+            else:
+                rows = conn.execute("SELECT * FROM articles ORDER BY first_seen DESC LIMIT ?",
+                                    (limit,)).fetchall()
+            return self._row_dicts(conn, rows)
+
+    def by_symbols(self, symbols: List[str], limit: int = 20) -> List[Dict]:
+        """آخر الأخبار المرتبطة بأي من الرموز (من فهرس الرموز)"""
+        symbols = list(dict.fromkeys(symbols))
+        if not symbols:
+            return []
+
+        marks = ",".join("?" * len(symbols))
+        with self._lock:
+            conn = self._db()
+            rows = conn.execute(
+                "SELECT * FROM articles WHERE id IN"
+                f" (SELECT id FROM article_symbols WHERE symbol IN ({marks}))"
+                " ORDER BY first_seen DESC LIMIT ?", symbols + [limit]).fetchall()
+            return self._row_dicts(conn, rows)
+
+    def status(self) -> Dict:
+        with self._lock:
+            conn = self._db()
+            count, with_body, oldest = conn.execute(
+                "SELECT COUNT(*), COUNT(body), MIN(first_seen) FROM articles").fetchone()
+        return {
+            "articles": count,
+            "with_body": with_body,
+            "oldest": time.strftime("%Y-%m-%d", time.localtime(oldest)) if oldest else None,
+            "fts5": self.has_fts5,
+            "retention_days": self.RETENTION_DAYS,
+        }
+
+
+# المخزن المشترك
+news_store = NewsStore()
@@ -0,0 +1,189 @@
+"""
+ربط الأخبار بالأسهم
+News Symbol Tagger - Aho-Corasick matcher over TASI names and codes
+
+يبني آلة Aho-Corasick واحدة من أسماء أسهم تاسي (العربية بعد التوحيد والإنجليزية)
+ورموزها، فيُفحص نص الخبر مرة واحدة مهما كان عدد الأسماء. النص والأسماء يمران
+بنفس التوحيد المستخدم في مخزن الأخبار (الهمزات، التاء المربوطة، أداة التعريف)
+فـ"للراجحي" و"الراجحي" و"مصرف الراجحي" كلها تطابق نفس السهم.
+
+الأسماء العامة (مثل الرياض، العربي، الغاز) لا تُعتمد وحدها بل مع كلمة مميزة
+قبلها (شركة، بنك، مصرف، سهم)، والرموز التي تشبه السنوات (مثل 2030) لا تُعتمد
+إلا بعد كلمة "رمز" أو "سهم".
+"""
+from collections import deque
+from typing import Dict, Iterator, List, Set, Tuple
+
+from news_store import search_terms
+from saudi_stocks import TASI_STOCKS
+
+# أسماء هي كلمات شائعة في النصوص الاقتصادية (تنطبق على الأسماء المختصرة والبديلة)
+AMBIGUOUS_NAMES = {
+    "الرياض", "الأول", "العربي", "الاستثمار", "الجزيرة", "البلاد", "المتقدمة",
+    "الكابلات", "الدوائية", "الأدوية", "الصحراء", "الاتصالات", "التعاونية", "الغاز",
+    "الخزف", "الكيميائية", "العقارية", "الأسماك", "التصنيع", "الواحة", "البحري",
+    "المصافي", "سلامة", "عناية", "شمس", "صدق", "مسك", "رعاية", "ثمار", "طيبة",
+    "أنابيب", "معدنية", "الباحة", "مرافق", "صادرات", "المجموعة السعودية",
+    "المجموعة المتحدة", "الخليج العامة", "الخليجية العامة", "المتحدة للتأمين",
+    "العالمية للتأمين", "الوطنية للتأمين", "التأمين العربية", "الإعادة السعودية",
+    "المعرفة المالية", "زهرة الواحة", "زين", "كيان",
+}
+QUALIFIERS = ("شركة", "بنك", "مصرف", "سهم", "أسهم")
+
+# أسماء متداولة في الأخبار غير الاسم المختصر في القائمة
+ALIASES = {
+    "2222": ["أرامكو"],
+    "1180": ["البنك الأهلي السعودي", "البنك الأهلي"],
+    "1120": ["مصرف الراجحي"],
+    "1010": ["بنك الرياض"],
+    "1030": ["البنك السعودي للاستثمار"],
+    "1050": ["البنك السعودي الفرنسي"],
+    "1060": ["البنك السعودي الأول"],
+    "1080": ["البنك العربي الوطني"],
+    "2350": ["كيان"],
+    "2310": ["سبكيم"],
+    "2240": ["الزامل"],
+    "4081": ["النهدي"],
+    "4161": ["أكوا"],
+    "2081": ["أكوا"],
+    "4210": ["العثيم"],
+    "7010": ["الاتصالات السعودية", "إس تي سي", "stc"],
+    "7020": ["موبايلي", "اتحاد اتصالات"],
+    "7030": ["زين"],
+    "5110": ["الكهرباء السعودية"],
+    "8210": ["بوبا"],
+}
+CODE_MARKERS = ("رمز", "سهم")
+
+# حروف العطف والجر التي تلتصق بالاسم (وأرامكو، لسابك)
+PROCLITICS = set("وبلفك")
+
+
+def _normalize(text: str) -> str:
+    """نص موحد بكلمات مفصولة بمسافة واحدة (نفس توحيد الفهرس)"""
+    return " ".join(search_terms(text))
+
+
+class AhoCorasick:
+    """آلة مطابقة متعددة الأنماط (كل نمط يحمل قيمة)"""
+
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+
+    def add(self, pattern: str, value):
+        state = 0
+        for char in pattern:
+            nxt = self._goto[state].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][char] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = nxt
+        self._output[state].append((len(pattern), value))
+
+    def build(self):
+        """حساب روابط الفشل (بحث بالعرض)"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(char, 0)
+                self._output[nxt] = self._output[nxt] + self._output[self._fail[nxt]]
+
+    def iter(self, text: str) -> Iterator[Tuple[int, int, object]]:
+        """(بداية، نهاية، القيمة) لكل تطابق"""
+        state = 0
+        goto, fail, output = self._goto, self._fail, self._output
+        for i, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for length, value in output[state]:
+                yield i + 1 - length, i + 1, value
+
+
+class SymbolTagger:
+    """رموز الأسهم المذكورة في نص"""
+
+    def __init__(self, stocks: Dict[str, Dict] = None):
+        self._matcher = AhoCorasick()
+        for pattern, value in self._patterns(stocks if stocks is not None else TASI_STOCKS).items():
+            self._matcher.add(pattern, value)
+        self._matcher.build()
+        self._code_markers = {_normalize(marker) for marker in CODE_MARKERS}
+
+    @staticmethod
+    def _patterns(stocks: Dict[str, Dict]) -> Dict[str, Tuple[Set[str], bool]]:
+        """النمط -> (الرموز، هل هو رمز رقمي)"""
+        patterns = {}
+
+        def add(pattern, code, is_code=False):
+            if pattern:
+                patterns.setdefault(pattern, (set(), is_code))[0].add(code)
+
+        def add_name(name, code):
+            if name in AMBIGUOUS_NAMES:
+                for qualifier in QUALIFIERS:
+                    add(_normalize(f"{qualifier} {name}"), code)
+            else:
+                add(_normalize(name), code)
+
+        for code, info in stocks.items():
+            add(code, code, is_code=True)
+            add_name(info.get("name", ""), code)
+            for alias in ALIASES.get(code, []):
+                add_name(alias, code)
+
+            english = info.get("english", "")
+            # الاختصارات القصيرة (SAB, ANB) تطابق كلمات عادية بسهولة
+            if len(english) > 3:
+                add(_normalize(english), code)
+        return patterns
+
+    @staticmethod
+    def _year_like(code: str) -> bool:
+        return 1900 <= int(code) <= 2099
+
+    def tag(self, text: str) -> List[str]:
+        """رموز الأسهم المذكورة في النص (مرتبة)"""
+        text = _normalize(text)
+        if not text:
+            return []
+
+        matches = []
+        for start, end, (codes, is_code) in self._matcher.iter(text):
+            # حدود الكلمة: نهاية كلمة، وبداية كلمة أو حرف عطف/جر ملتصق
+            if end < len(text) and text[end] != " ":
+                continue
+            if start > 0 and text[start - 1] != " ":
+                if is_code or text[start - 1] not in PROCLITICS or (start > 1 and text[start - 2] != " "):
+                    continue
+
+            if is_code and self._year_like(next(iter(codes))):
+                previous = text[:max(start - 1, 0)].rsplit(" ", 1)[-1]
+                if previous not in self._code_markers:
+                    continue
+            matches.append((start, end, codes))
+
+        # عند التداخل يُعتمد التطابق الأطول ("الراجحي ريت" وليس "الراجحي"،
+        # و"شركة الاتصالات السعودية" هي الاتصالات السعودية وليست "شركة الاتصالات")
+        found = set()
+        accepted = []
+        for start, end, codes in sorted(matches, key=lambda m: (m[0] - m[1], m[0])):
+            if any(start < a_end and a_start < end for a_start, a_end in accepted):
+                continue
+            found.update(codes)
+            accepted.append((start, end))
+        return sorted(found)
+
+
+# الأداة المشتركة
+symbol_tagger = SymbolTagger()
@@ -0,0 +1,295 @@
+"""
+مخزن البيانات التاريخية (OHLCV) على القرص
+Persistent OHLCV Store - one NumPy .npz file per symbol with incremental updates
+"""
+import json
+import os
+import pathlib
+import threading
+import time
+from typing import Optional, Dict
+
+import numpy as np
+
+import indicators
+from indicator_state import IndicatorSet
+
+CACHE_DIR = pathlib.Path(__file__).parent / "cache" / "ohlcv"
+
+PRICE_FIELDS = ("open", "high", "low", "close", "volume")
+
+SECONDS_PER_DAY = 86400
+
+
+class OHLCVStore:
+    """مخزن الشموع اليومية لكل سهم
+
+    كل سهم يُحفظ في ملف .npz يحتوي على مصفوفات مرتبة حسب الوقت:
+    timestamps (int64) و open/high/low/close/volume (float64 مع NaN للقيم المفقودة)
+    إضافة إلى coverage_start (بداية أقدم فترة تم تنزيلها) و fetched_at (آخر تحديث)
+    و indicator_state (حالة المؤشرات المتزايدة حتى الشمعة قبل الأخيرة، بصيغة JSON)
+    """
+
+    def __init__(self, cache_dir: pathlib.Path = CACHE_DIR):
+        self.cache_dir = pathlib.Path(cache_dir)
+        self._series = {}  # نسخة في الذاكرة من الملفات المحملة
+        self._resampled = {}  # (الرمز، الفترة) -> شموع أسبوعية/شهرية مشتقة من السلسلة اليومية
+        self._states = {}  # الرمز -> IndicatorSet
+        self._lock = threading.RLock()
+
+    def _path(self, code: str) -> pathlib.Path:
+        return self.cache_dir / f"{code}.npz"
+
+    def load(self, code: str) -> Optional[Dict]:
+        """تحميل سلسلة سهم (من الذاكرة أو القرص)"""
+        with self._lock:
+            if code in self._series:
+                return self._series[code]
+
+            path = self._path(code)
+            if not path.exists():
+                return None
+
+            try:
+                with np.load(str(path)) as npz:
+                    series = {key: npz[key] for key in npz.files}
+            except (OSError, ValueError) as e:
+                print(f"خطأ في قراءة ملف {path.name}: {e}")
+                return None
+
+            series["coverage_start"] = int(series.get("coverage_start", 0))
+            series["fetched_at"] = float(series.get("fetched_at", 0))
+            self._series[code] = series
+            return series
+
+    def save(self, code: str, series: Dict):
+        """حفظ سلسلة سهم (كتابة ذرية عبر ملف مؤقت)"""
+        with self._lock:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            path = self._path(code)
+            tmp_path = path.with_suffix(".tmp")
+
+            with open(str(tmp_path), "wb") as f:
+                np.savez(f, **{k: np.asarray(v) for k, v in series.items()})
+            os.replace(str(tmp_path), str(path))
+
+            self._series[code] = series
+            self._drop_resampled(code)
+
+    def merge(self, code: str, history: Dict, coverage_start: int = None) -> Dict:
+        """دمج شموع جديدة مع المخزنة (الشمعة الأحدث لنفس اليوم تستبدل القديمة)"""
+        new_ts = np.asarray(history.get("timestamps") or [], dtype=np.int64)
+        new_fields = {
+            field: _to_float_array(history.get(field), len(new_ts))
+            for field in PRICE_FIELDS
+        }
+
+        with self._lock:
+            stored = self.load(code)
+
+            if stored is not None and len(stored["timestamps"]):
+                timestamps = np.concatenate([stored["timestamps"], new_ts])
+                fields = {f: np.concatenate([stored[f], new_fields[f]]) for f in PRICE_FIELDS}
+                old_coverage = stored["coverage_start"]
+            else:
+                timestamps = new_ts
+                fields = new_fields
+                old_coverage = None
+
+            # شمعة واحدة لكل يوم: نحتفظ بآخر نسخة (الأحدث تأتي في نهاية المصفوفة)
+            days = timestamps // SECONDS_PER_DAY
+            reversed_days = days[::-1]
+            _, last_idx = np.unique(reversed_days, return_index=True)
+            keep = len(days) - 1 - last_idx  # مرتبة تصاعدياً حسب اليوم
+
+            series = {"timestamps": timestamps[keep]}
+            for f in PRICE_FIELDS:
+                series[f] = fields[f][keep]
+
+            starts = [c for c in (old_coverage, coverage_start) if c is not None]
+            if not starts and len(series["timestamps"]):
+                starts = [int(series["timestamps"][0])]
+            series["coverage_start"] = int(min(starts)) if starts else 0
+            series["fetched_at"] = time.time()
+
+            # إعادة بناء الحالة فقط إذا تغيرت شموع سبق إدخالها (مثل توسيع الفترة للخلف)
+            state = self.get_state(code) if stored is not None else None
+            if state is not None and len(new_ts) and new_ts.min() // SECONDS_PER_DAY <= state.last_ts // SECONDS_PER_DAY:
+                state = None
+            state = self._advance_state(state or IndicatorSet(), series)
+            series["indicator_state"] = json.dumps(state.to_dict())
+
+            self.save(code, series)
+            self._states[code] = state
+            return series
+
+    @staticmethod
+    def _advance_state(state: IndicatorSet, series: Dict) -> IndicatorSet:
+        """إدخال الشموع المغلقة الجديدة في حالة المؤشرات
+
+        الشمعة الأخيرة لا تدخل لأنها قد تكون شمعة اليوم غير المكتملة،
+        وتُضاف عند الطلب عبر peek في get_indicators.
+        """
+        timestamps = series["timestamps"]
+        closed = len(timestamps) - 1
+        start = int(np.searchsorted(timestamps[:closed], state.last_ts, side="right"))
+
+        # نفس الشموع التي يحذفها indicators.to_arrays (أي قيمة OHLC مفقودة)
+        valid = _valid_bars(series)
+        high, low, close, volume = (series[f] for f in ("high", "low", "close", "volume"))
+        for i in range(start, closed):
+            if not valid[i]:
+                continue
+            vol = None if np.isnan(volume[i]) else float(volume[i])
+            state.update(int(timestamps[i]), float(high[i]), float(low[i]), float(close[i]), vol)
+        return state
+
+    def get_state(self, code: str) -> Optional[IndicatorSet]:
+        """حالة المؤشرات المتزايدة للسهم (محملة من الملف عند الحاجة)"""
+        with self._lock:
+            if code in self._states:
+                return self._states[code]
+
+            stored = self.load(code)
+            if stored is None or not len(stored["timestamps"]):
+                return None
+
+            raw = stored.get("indicator_state")
+            if raw is not None:
+                state = IndicatorSet.from_dict(json.loads(str(raw)))
+            else:
+                # ملف قديم بدون حالة: بناء الحالة مرة واحدة من السلسلة
+                state = self._advance_state(IndicatorSet(), stored)
+            self._states[code] = state
+            return state
+
+    def get_indicators(self, code: str, price: float = None, volume: float = None) -> Optional[Dict]:
+        """قيم المؤشرات الحالية للسهم بدون إعادة حساب التاريخ
+
+        price: سعر لحظي يحل محل إغلاق الشمعة الأخيرة (None = إغلاق آخر شمعة مخزنة)
+        """
+        with self._lock:
+            state = self.get_state(code)
+            if state is None:
+                return None
+
+            stored = self._series[code]
+            last = {f: stored[f][-1] for f in ("high", "low", "close", "volume")}
+            if price is None and np.isnan(last["close"]):
+                return None
+
+            close = float(last["close"]) if price is None else float(price)
+            high = close if np.isnan(last["high"]) else max(float(last["high"]), close)
+            low = close if np.isnan(last["low"]) else min(float(last["low"]), close)
+            if volume is None and not np.isnan(last["volume"]):
+                volume = float(last["volume"])
+
+            values = state.peek(close, high, low, volume)
+            values["last_ts"] = int(stored["timestamps"][-1])
+            # الشموع الصالحة التي بُنيت منها الحالة (للتحقق من نافذة البيانات المطلوبة)
+            valid_ts = stored["timestamps"][_valid_bars(stored)]
+            values["first_ts"] = int(valid_ts[0]) if len(valid_ts) else values["last_ts"]
+            values["bars"] = len(valid_ts)
+            return values
+
+    def bars_since(self, code: str, start_ts: int) -> int:
+        """عدد الشموع الصالحة المخزنة من start_ts حتى آخر شمعة"""
+        stored = self.load(code)
+        if stored is None or not len(stored["timestamps"]):
+            return 0
+        start = int(np.searchsorted(stored["timestamps"], start_ts, side="left"))
+        return int(_valid_bars(stored)[start:].sum())
+
+    def touch(self, code: str):
+        """تحديث وقت آخر فحص بدون تغيير البيانات
+
+        في الذاكرة فقط: الشموع لم تتغير فلا داعي لإعادة كتابة الملف أو مسح
+        التجميعات الأسبوعية والشهرية (يُحفظ الوقت مع الدمج التالي).
+        """
+        with self._lock:
+            stored = self.load(code)
+            if stored is not None:
+                stored["fetched_at"] = time.time()
+
+    def covers(self, code: str, start_ts: int) -> bool:
+        """هل البيانات المخزنة تغطي الفترة من start_ts؟"""
+        stored = self.load(code)
+        return bool(stored is not None and len(stored["timestamps"])
+                    and stored["coverage_start"] <= start_ts)
+
+    def get_range(self, code: str, start_ts: int) -> Optional[Dict]:
+        """إرجاع الشموع من start_ts حتى آخر شمعة بصيغة get_historical_data"""
+        stored = self.load(code)
+        if stored is None or not len(stored["timestamps"]):
+            return None
+
+        start = int(np.searchsorted(stored["timestamps"], start_ts, side="left"))
+        result = {
+            "symbol": code,
+            "timestamps": stored["timestamps"][start:].tolist(),
+        }
+        for f in PRICE_FIELDS:
+            result[f] = _to_list(stored[f][start:])
+        return result
+
+    def get_resampled(self, code: str, period: str, start_ts: int = 0) -> Optional[Dict]:
+        """الشموع الأسبوعية أو الشهرية للسهم من المجموعة التي تحتوي start_ts
+
+        التجميع يتم مرة واحدة لكامل السلسلة المخزنة ويُحفظ حتى تتغير السلسلة
+        """
+        with self._lock:
+            key = (code, period)
+            resampled = self._resampled.get(key)
+            if resampled is None:
+                stored = self.load(code)
+                if stored is None or not len(stored["timestamps"]):
+                    return None
+                daily = indicators.to_arrays(dict(stored))
+                resampled = indicators.resample(daily, period)
+                self._resampled[key] = resampled
+
+        start = max(int(np.searchsorted(resampled["timestamps"], start_ts, side="right")) - 1, 0)
+        return {field: values[start:] for field, values in resampled.items()}
+
+    def _drop_resampled(self, code: str):
+        for key in [k for k in self._resampled if k[0] == code]:
+            del self._resampled[key]
+
+    def clear(self, code: str = None):
+        """مسح ذاكرة المخزن (والملف إذا حُدد سهم)"""
+        with self._lock:
+            if code is None:
+                self._series = {}
+                self._resampled = {}
+                self._states = {}
+                return
+            self._series.pop(code, None)
+            self._states.pop(code, None)
+            self._drop_resampled(code)
+            path = self._path(code)
+            if path.exists():
+                path.unlink()
+
+
+def _valid_bars(series: Dict) -> np.ndarray:
+    """قناع الشموع الكاملة (بدون NaN في الافتتاح أو القمة أو القاع أو الإغلاق)"""
+    return ~np.isnan(np.vstack([series[f] for f in ("open", "high", "low", "close")])).any(axis=0)
+
+
+def _to_float_array(values, length: int) -> np.ndarray:
+    """تحويل قائمة قد تحتوي None إلى مصفوفة float مع NaN"""
+    if not values:
+        return np.full(length, np.nan)
+    arr = np.array(values, dtype=np.float64)  # None تتحول إلى NaN
+    if len(arr) < length:
+        arr = np.concatenate([arr, np.full(length - len(arr), np.nan)])
+    return arr[:length]
+
+
+def _to_list(arr: np.ndarray) -> list:
+    """تحويل مصفوفة إلى قائمة مع None بدلاً من NaN (للتوافق مع الكود الحالي)"""
+    return [None if v != v else v for v in arr.tolist()]
+
+
+# المخزن المشترك
+ohlcv_store = OHLCVStore()
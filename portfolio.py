@@ -565,35 +565,63 @@ class Stock:
             "last_updated": self.last_updated
         }
 
-    def to_summary_dict(self) -> dict:
-        """ملخص للعرض في الجدول"""
+    def to_summary_dict(self, include_orders: bool = False) -> dict:
+        """ملخص للعرض في الجدول
+        include_orders: تضمين قائمة الأوامر الكاملة (مكلفة للمحافظ ذات السجل الطويل)
+        """
         realized = self.get_realized_profit_loss()
-        # آخر تاريخ عملية (شراء أو بيع)
-        last_order_date = max((o.date for o in self.orders), default=None) if self.orders else None
 
-        return {
+        # تمريرة واحدة على الأوامر بدلاً من إعادة حساب الخصائص لكل حقل
+        base_shares = 0
+        total_buy_value = 0
+        total_sell_value = 0
+        total_commission = 0
+        total_tax = 0
+        last_order_date = None
+        for order in self.orders:
+            if order.order_type == "buy":
+                base_shares += order.shares
+                total_buy_value += order.total_value
+            else:
+                base_shares -= order.shares
+                total_sell_value += order.total_value
+            total_commission += order.commission
+            total_tax += order.tax
+            if last_order_date is None or order.date > last_order_date:
+                last_order_date = order.date
+
+        shares = base_shares * self.get_corporate_action_multiplier()
+        total_cost = self.total_cost
+        current_value = shares * self.current_price
+        profit_loss = current_value - total_cost
+
+        summary = {
             "symbol": self.symbol,
             "name": self.name,
-            "shares": self.shares,
-            "bonus_shares": self.get_bonus_shares(),
-            "buy_price": self.avg_buy_price,
+            "shares": shares,
+            "bonus_shares": shares - base_shares,
+            "buy_price": total_cost / shares if shares > 0 else 0,
             "current_price": self.current_price,
-            "total_cost": self.total_cost,
-            "current_value": self.current_value,
-            "profit_loss": self.profit_loss,
-            "profit_loss_percent": self.profit_loss_percent,
+            "total_cost": total_cost,
+            "current_value": current_value,
+            "profit_loss": profit_loss,
+            "profit_loss_percent": (profit_loss / total_cost) * 100 if total_cost != 0 else 0,
             "last_updated": self.last_updated,
             "orders_count": len(self.orders),
             "corporate_actions_count": len(self.corporate_actions),
-            "total_fees": self.total_fees,
-            "total_commission": self.total_commission,
-            "total_tax": self.total_tax,
+            "total_fees": total_commission + total_tax,
+            "total_commission": total_commission,
+            "total_tax": total_tax,
+            "total_buy_value": total_buy_value,
+            "total_sell_value": total_sell_value,
             "wallet_id": self.get_wallet_id(),
             "realized_profit_loss": realized['realized_profit_loss'],
             "last_sell_date": realized['last_sell_date'],
-            "last_order_date": last_order_date,
-            "orders": [order.to_dict() for order in self.orders]
+            "last_order_date": last_order_date
         }
+        if include_orders:
+            summary["orders"] = [order.to_dict() for order in self.orders]
+        return summary
 
     @classmethod
     def from_dict(cls, data: dict) -> "Stock":
@@ -626,6 +654,7 @@ class Portfolio:
 
     def __init__(self):
         self.stocks = {}
+        self.revision = 0  # يزيد مع كل تغيير في الأوامر أو الأسهم (لإبطال الحسابات المخزنة)
         self.load()
 
     def add_stock(self, symbol: str, name: str, shares: float,
@@ -777,8 +806,13 @@ class Portfolio:
             return 0
         return (self.total_profit_loss / self.total_cost) * 100
 
-    def save(self):
-        """حفظ البيانات"""
+    def save(self, orders_changed: bool = True):
+        """حفظ البيانات
+
+        orders_changed: False عند حفظ الأسعار فقط (لا يبطل الحسابات المعتمدة على الأوامر)
+        """
+        if orders_changed:
+            self.revision += 1
         data = {
             "stocks": {symbol: stock.to_dict()
                       for symbol, stock in self.stocks.items()},
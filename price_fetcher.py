@@ -5,8 +5,12 @@ Saudi Stock Price Fetcher - using Yahoo Finance API
 import requests
 from datetime import datetime
 from typing import Optional, Dict, List
+import threading
 import time
 
+from price_history import price_history
+from rate_limiter import yahoo_rate_limiter
+
 # استيراد قائمة الأسهم الكاملة
 from saudi_stocks import TASI_STOCKS, get_stock_info, get_all_stocks as get_tasi_stocks, search_stocks
 
@@ -43,15 +47,68 @@ class TadawulPriceFetcher:
             return info["sector"]
         return "غير محدد"
 
+    # كاش الأسعار المشترك: الرمز -> (وقت الجلب monotonic، بيانات السعر)
+    _quote_cache = {}
+    _quote_lock = threading.Lock()
+    QUOTE_CACHE_DURATION = 30  # ثانية
+    SPARK_BATCH = 20  # أقصى عدد رموز في طلب spark واحد
+
+    @classmethod
+    def _cached_quote(cls, code: str) -> Optional[dict]:
+        with cls._quote_lock:
+            entry = cls._quote_cache.get(code)
+        if entry and time.monotonic() - entry[0] < cls.QUOTE_CACHE_DURATION:
+            return entry[1]
+        return None
+
+    @classmethod
+    def _store_quote(cls, code: str, quote: dict):
+        with cls._quote_lock:
+            cls._quote_cache[code] = (time.monotonic(), quote)
+        price_history.record(code, quote["price"])
+
+    @staticmethod
+    def _quote_from_meta(code: str, meta: Dict) -> Optional[dict]:
+        """تحويل meta من استجابة Yahoo chart/spark إلى بيانات السعر"""
+        price = meta.get("regularMarketPrice", 0)
+        if not price or price <= 0:
+            return None
+
+        prev_close = meta.get("previousClose") or meta.get("chartPreviousClose") or price
+        change = price - prev_close if prev_close else 0
+        change_pct = (change / prev_close * 100) if prev_close else 0
+
+        return {
+            "symbol": code,
+            "code": code,
+            "price": float(price),
+            "currency": "SAR",
+            "name": TadawulPriceFetcher.get_stock_name(code),
+            "sector": TadawulPriceFetcher.get_stock_sector(code),
+            "change": round(change, 2),
+            "change_percent": round(change_pct, 2),
+            "day_high": float(meta.get("regularMarketDayHigh") or 0),
+            "day_low": float(meta.get("regularMarketDayLow") or 0),
+            "open": float(meta.get("regularMarketOpen") or 0),
+            "previous_close": float(prev_close),
+            "volume": int(meta.get("regularMarketVolume") or 0),
+            "timestamp": datetime.now().isoformat()
+        }
+
     @staticmethod
     def get_live_price(symbol: str) -> Optional[dict]:
-        """جلب السعر الحالي من Yahoo Finance"""
+        """جلب السعر الحالي من Yahoo Finance (أو من الكاش المشترك)"""
         code = symbol.strip().replace(".SR", "")
 
+        cached = TadawulPriceFetcher._cached_quote(code)
+        if cached:
+            return cached
+
         for attempt in range(3):
             try:
                 url = f"https://query1.finance.yahoo.com/v8/finance/chart/{code}.SR?interval=1d&range=1d"
 
+                yahoo_rate_limiter.acquire()
                 response = requests.get(
                     url,
                     headers=TadawulPriceFetcher.HEADERS,
@@ -59,38 +116,18 @@ class TadawulPriceFetcher:
                 )
 
                 if response.status_code == 429:
-                    # Rate limited - wait and retry
-                    time.sleep(2 * (attempt + 1))
+                    # Rate limited - pause all Yahoo requests then retry
+                    yahoo_rate_limiter.backoff(2 * (attempt + 1))
                     continue
 
                 if response.status_code == 200:
                     data = response.json()
                     if "chart" in data and data["chart"]["result"]:
                         result = data["chart"]["result"][0]
-                        meta = result.get("meta", {})
-
-                        price = meta.get("regularMarketPrice", 0)
-                        if price and price > 0:
-                            prev_close = meta.get("previousClose", price)
-                            change = price - prev_close if prev_close else 0
-                            change_pct = (change / prev_close * 100) if prev_close else 0
-
-                            return {
-                                "symbol": code,
-                                "code": code,
-                                "price": float(price),
-                                "currency": "SAR",
-                                "name": TadawulPriceFetcher.get_stock_name(code),
-                                "sector": TadawulPriceFetcher.get_stock_sector(code),
-                                "change": round(change, 2),
-                                "change_percent": round(change_pct, 2),
-                                "day_high": float(meta.get("regularMarketDayHigh", 0)),
-                                "day_low": float(meta.get("regularMarketDayLow", 0)),
-                                "open": float(meta.get("regularMarketOpen", 0)),
-                                "previous_close": float(prev_close),
-                                "volume": int(meta.get("regularMarketVolume", 0)),
-                                "timestamp": datetime.now().isoformat()
-                            }
+                        quote = TadawulPriceFetcher._quote_from_meta(code, result.get("meta", {}))
+                        if quote:
+                            TadawulPriceFetcher._store_quote(code, quote)
+                            return quote
                 break
             except Exception as e:
                 print(f"خطأ في جلب سعر {symbol}: {e}")
@@ -99,6 +136,80 @@ class TadawulPriceFetcher:
         # Fallback to local data
         return TadawulPriceFetcher._get_local_stock_data(code)
 
+    @staticmethod
+    def _parse_spark(data: Dict) -> Dict[str, dict]:
+        """أسعار الرموز من استجابة spark
+
+        v7: {"spark": {"result": [{"symbol", "response": [{"meta": {...}}]}]}}
+        v8: {"2010.SR": {"close": [...], "chartPreviousClose": ...}} (بدون meta)
+        """
+        quotes = {}
+        if "spark" in data:
+            for result in (data.get("spark") or {}).get("result") or []:
+                code = str(result.get("symbol", "")).replace(".SR", "")
+                meta = ((result.get("response") or [{}])[0]).get("meta") or {}
+                quote = TadawulPriceFetcher._quote_from_meta(code, meta)
+                if quote:
+                    quotes[code] = quote
+            return quotes
+
+        for symbol, series in data.items():
+            if not isinstance(series, dict):
+                continue
+            closes = [c for c in series.get("close") or [] if c is not None]
+            if not closes:
+                continue
+            code = str(series.get("symbol") or symbol).replace(".SR", "")
+            meta = {"regularMarketPrice": closes[-1],
+                    "chartPreviousClose": series.get("chartPreviousClose") or series.get("previousClose")}
+            quote = TadawulPriceFetcher._quote_from_meta(code, meta)
+            if quote:
+                quotes[code] = quote
+        return quotes
+
+    @staticmethod
+    def get_live_prices(symbols: List[str]) -> Dict[str, dict]:
+        """جلب أسعار عدة أسهم دفعة واحدة (طلب spark واحد لكل SPARK_BATCH رمز)
+
+        الأسعار الحديثة في الكاش المشترك لا تُطلب، والرموز التي لا ترد في
+        الاستجابة تُرجع بالبيانات المحلية دون طلبات إضافية.
+        """
+        codes = [s.strip().replace(".SR", "") for s in symbols]
+        quotes = {}
+        missing = []
+        for code in dict.fromkeys(codes):
+            cached = TadawulPriceFetcher._cached_quote(code)
+            if cached:
+                quotes[code] = cached
+            else:
+                missing.append(code)
+
+        batch_size = TadawulPriceFetcher.SPARK_BATCH
+        for i in range(0, len(missing), batch_size):
+            batch = missing[i:i + batch_size]
+            try:
+                joined = ",".join(f"{code}.SR" for code in batch)
+                url = f"https://query1.finance.yahoo.com/v7/finance/spark?symbols={joined}&range=1d&interval=1d"
+
+                yahoo_rate_limiter.acquire()
+                response = requests.get(url, headers=TadawulPriceFetcher.HEADERS, timeout=10)
+
+                if response.status_code == 429:
+                    yahoo_rate_limiter.backoff(2)
+                elif response.status_code == 200:
+                    for code, quote in TadawulPriceFetcher._parse_spark(response.json()).items():
+                        TadawulPriceFetcher._store_quote(code, quote)
+                        quotes[code] = quote
+            except Exception as e:
+                print(f"خطأ في جلب أسعار {len(batch)} سهم: {e}")
+
+        for code in missing:
+            if code not in quotes:
+                local = TadawulPriceFetcher._get_local_stock_data(code)
+                if local:
+                    quotes[code] = local
+        return quotes
+
     @staticmethod
     def _get_local_stock_data(code: str) -> Optional[dict]:
         code = code.strip().replace(".SR", "")
@@ -136,7 +247,7 @@ class TadawulPriceFetcher:
                 updated[symbol] = data
             time.sleep(0.5)  # Delay between requests
 
-        portfolio.save()
+        portfolio.save(orders_changed=False)
         return updated
 
     @staticmethod
@@ -0,0 +1,184 @@
+"""
+مخزن السلاسل الزمنية اللحظية للأسعار
+Intraday Price History - fixed-size ring buffers in a memory-mapped file
+
+كل أداة (سلعة أو سهم) لها خانة ثابتة الحجم في ملف .npy مفتوح كـ memmap:
+CAPACITY نقطة (الوقت، السعر) تُكتب بشكل دائري، فالذاكرة محدودة لكل أداة
+والبيانات تبقى بعد إعادة التشغيل. أسماء الأدوات وموقع كل خانة في ملف JSON صغير.
+الخطوط المصغرة (sparklines) تُشتق من المخزن دون أي طلب خارجي.
+"""
+import atexit
+import json
+import os
+import pathlib
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+CACHE_DIR = pathlib.Path(__file__).parent / "cache"
+DATA_FILE = CACHE_DIR / "price_history.npy"
+META_FILE = CACHE_DIR / "price_history_meta.npy"
+KEYS_FILE = CACHE_DIR / "price_history_keys.json"
+
+
+class PriceHistoryStore:
+    """حلقات دائرية لأسعار كل أداة
+
+    data[slot, i] = (الوقت بالثواني، السعر)، و meta[slot] = (موقع أقدم نقطة، عدد النقاط)
+    """
+
+    MAX_INSTRUMENTS = 512
+    CAPACITY = 1440  # نقطة لكل أداة (يوم كامل بنقطة كل دقيقة)
+    MIN_INTERVAL = 60  # ثانية - التحديث الأقرب من ذلك يستبدل آخر نقطة
+    SPARKLINE_POINTS = 48
+    SPARKLINE_WINDOW = 24 * 3600  # ثانية
+    FLUSH_INTERVAL = 30  # ثانية
+
+    def __init__(self, data_file: pathlib.Path = DATA_FILE, meta_file: pathlib.Path = META_FILE,
+                 keys_file: pathlib.Path = KEYS_FILE):
+        self.data_file = pathlib.Path(data_file)
+        self.meta_file = pathlib.Path(meta_file)
+        self.keys_file = pathlib.Path(keys_file)
+        self._data = None
+        self._meta = None
+        self._slots = {}  # المفتاح -> رقم الخانة
+        self._keys_dirty = False
+        self._flushed_at = 0.0
+        self._lock = threading.Lock()
+
+    # ==================== الملفات ====================
+
+    def _open(self):
+        """فتح الملفات عند أول استخدام (أو إنشاؤها إذا لم توجد أو تغير حجمها)"""
+        if self._data is not None:
+            return
+
+        data_shape = (self.MAX_INSTRUMENTS, self.CAPACITY, 2)
+        meta_shape = (self.MAX_INSTRUMENTS, 2)
+        try:
+            data = np.load(str(self.data_file), mmap_mode="r+")
+            meta = np.load(str(self.meta_file), mmap_mode="r+")
+            with open(self.keys_file, "r", encoding="utf-8") as f:
+                slots = json.load(f)
+            if data.shape != data_shape or meta.shape != meta_shape:
+                raise ValueError("حجم الملف لا يطابق الإعدادات")
+        except (OSError, ValueError) as e:
+            if self.data_file.exists():
+                print(f"إعادة إنشاء مخزن الأسعار اللحظية: {e}")
+            self.data_file.parent.mkdir(parents=True, exist_ok=True)
+            data = np.lib.format.open_memmap(str(self.data_file), mode="w+", dtype=np.float64, shape=data_shape)
+            meta = np.lib.format.open_memmap(str(self.meta_file), mode="w+", dtype=np.int64, shape=meta_shape)
+            slots = {}
+            self._keys_dirty = True
+
+        self._data, self._meta, self._slots = data, meta, slots
+
+    def _slot(self, key: str) -> int:
+        """خانة الأداة (تُحجز عند أول تسجيل؛ عند الامتلاء تُستبدل الأقدم تحديثاً)"""
+        slot = self._slots.get(key)
+        if slot is not None:
+            return slot
+
+        if len(self._slots) < self.MAX_INSTRUMENTS:
+            slot = len(self._slots)
+        else:
+            by_slot = {s: k for k, s in self._slots.items()}
+            slot = min(by_slot, key=self._last_ts)
+            del self._slots[by_slot[slot]]
+        self._meta[slot] = (0, 0)
+        self._slots[key] = slot
+        self._keys_dirty = True
+        return slot
+
+    def _last_ts(self, slot: int) -> float:
+        head, count = self._meta[slot]
+        if not count:
+            return float("-inf")
+        return float(self._data[slot, (head + count - 1) % self.CAPACITY, 0])
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if self._data is None:
+            return
+        self._data.flush()
+        self._meta.flush()
+        if self._keys_dirty:
+            tmp_path = self.keys_file.with_suffix(".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._slots, f)
+            os.replace(str(tmp_path), str(self.keys_file))
+            self._keys_dirty = False
+        self._flushed_at = time.monotonic()
+
+    # ==================== الكتابة والقراءة ====================
+
+    def record(self, key: str, price: float, ts: float = None):
+        """تسجيل سعر للأداة"""
+        try:
+            price = float(price)
+        except (TypeError, ValueError):
+            return
+        if not price > 0:
+            return
+        ts = time.time() if ts is None else float(ts)
+
+        with self._lock:
+            self._open()
+            slot = self._slot(key)
+            head, count = (int(v) for v in self._meta[slot])
+
+            last = (head + count - 1) % self.CAPACITY
+            if count and ts - self._data[slot, last, 0] < self.MIN_INTERVAL:
+                self._data[slot, last] = (ts, price)
+            elif count < self.CAPACITY:
+                self._data[slot, (head + count) % self.CAPACITY] = (ts, price)
+                self._meta[slot, 1] = count + 1
+            else:
+                # الحلقة ممتلئة: الكتابة فوق أقدم نقطة
+                self._data[slot, head] = (ts, price)
+                self._meta[slot, 0] = (head + 1) % self.CAPACITY
+
+            if time.monotonic() - self._flushed_at >= self.FLUSH_INTERVAL:
+                self._flush()
+
+    def series(self, key: str, since: float = None) -> Optional[Dict[str, np.ndarray]]:
+        """نقاط الأداة مرتبة من الأقدم (timestamps, prices)"""
+        with self._lock:
+            self._open()
+            slot = self._slots.get(key)
+            if slot is None:
+                return None
+            head, count = (int(v) for v in self._meta[slot])
+            order = (head + np.arange(count)) % self.CAPACITY
+            points = np.array(self._data[slot, order])
+
+        if since is not None:
+            points = points[points[:, 0] >= since]
+        return {"timestamps": points[:, 0], "prices": points[:, 1]}
+
+    def sparkline(self, key: str, points: int = None, window: float = None) -> List[float]:
+        """أسعار الأداة خلال النافذة الأخيرة مختصرة إلى `points` نقطة"""
+        points = points or self.SPARKLINE_POINTS
+        window = self.SPARKLINE_WINDOW if window is None else window
+        series = self.series(key, since=time.time() - window)
+        if series is None:
+            return []
+
+        prices = series["prices"]
+        if len(prices) > points:
+            # متوسط كل مجموعة متساوية، مع الإبقاء على آخر سعر كما هو
+            edges = np.linspace(0, len(prices), points + 1).astype(int)[:-1]
+            sampled = np.add.reduceat(prices, edges) / np.diff(np.append(edges, len(prices)))
+            sampled[-1] = prices[-1]
+            prices = sampled
+        return [round(float(p), 4) for p in prices]
+
+
+# المخزن المشترك
+price_history = PriceHistoryStore()
+atexit.register(price_history.flush)
@@ -0,0 +1,57 @@
+"""
+محدد معدل الطلبات المشترك
+Shared Rate Limiter - token bucket shared by all threads hitting the same upstream
+"""
+import threading
+import time
+
+
+class RateLimiter:
+    """محدد معدل (Token Bucket) آمن للاستخدام من عدة خيوط"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate  # عدد الطلبات المسموح بها في الثانية
+        self.burst = max(1, burst)  # أقصى عدد طلبات متتالية بدون انتظار
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self._last
+        self._last = now
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+
+    def acquire(self, timeout: float = None) -> bool:
+        """انتظار حتى يتوفر إذن بالطلب
+        timeout: أقصى مدة انتظار بالثواني (None = انتظار بلا حد)
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+
+                if now >= self._blocked_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+
+                wait = max(self._blocked_until - now, (1 - self._tokens) / self.rate)
+
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+    def backoff(self, seconds: float):
+        """إيقاف جميع الطلبات مؤقتاً (مثلاً بعد استجابة 429)"""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+
+# محدد مشترك لجميع طلبات Yahoo Finance (الأسعار والبيانات التاريخية)
+yahoo_rate_limiter = RateLimiter(rate=4, burst=4)
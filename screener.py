@@ -0,0 +1,253 @@
+"""
+ماسح السوق السعودي (تاسي)
+Market Screener - batched scans over every TASI symbol from the local OHLCV cache
+
+يقرأ الشموع المخزنة محلياً لكل الأسهم ويجمعها في مصفوفة واحدة (سهم لكل صف)
+ثم يحسب الدعم والمقاومة والمتوسطات ونسبة الكمية والاتجاه وأنماط الشموع لكل
+السوق دفعة واحدة. لا يتم أي طلب خارجي أثناء الفحص؛ تحديث المخزن يتم في
+الخلفية عبر refresh().
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import indicators
+from analysis_service import TechnicalAnalysis
+from ohlcv_store import ohlcv_store
+from saudi_stocks import TASI_STOCKS
+
+
+class MarketScreener:
+    """فحص كل أسهم تاسي وترتيبها حسب الإشارات الفنية"""
+
+    LOOKBACK_BARS = 250  # عدد الشموع اليومية المستخدمة من كل سهم
+    SCAN_CACHE_DURATION = 60  # ثانية
+    NEAR_ZONE_PERCENT = 3.0  # المسافة القصوى من منطقة الطلب أو الدعم (%)
+    VOLUME_SPIKE_RATIO = 1.5
+    REFRESH_PERIOD = "1y"
+    REFRESH_WORKERS = 4  # الطلبات محكومة أيضاً بمحدد معدل Yahoo المشترك
+
+    # الفلاتر المتاحة: المفتاح -> (الوصف، وزن الإشارة في الترتيب)
+    FILTERS = {
+        "near_demand": ("قريب من منطقة طلب", 3),
+        "near_support": ("قريب من مستوى دعم", 2),
+        "volume_spike": ("كمية أعلى من 1.5 ضعف المتوسط", 2),
+        "above_sma50": ("السعر فوق متوسط 50 يوم", 1),
+        "above_sma200": ("السعر فوق متوسط 200 يوم", 1),
+        "bullish_trend": ("اتجاه صاعد", 2),
+        "bearish_trend": ("اتجاه هابط", -2),
+        "breakout": ("اختراق قمة 20 يوم", 2),
+        "bullish_pattern": ("نمط شموع إيجابي", 1),
+        "bearish_pattern": ("نمط شموع سلبي", -1),
+    }
+
+    SORT_KEYS = ("score", "volume_ratio", "change_percent", "distance_to_demand")
+
+    def __init__(self):
+        self._results = None
+        self._scanned_at = 0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self.refresh_status = {"running": False, "done": 0, "total": 0, "finished_at": None}
+
+    # ==================== تحميل البيانات ====================
+
+    def _load_bars(self) -> Dict[str, Dict[str, np.ndarray]]:
+        """الشموع اليومية المخزنة لكل سهم (آخر LOOKBACK_BARS شمعة)"""
+        loaded = {}
+        for code in TASI_STOCKS:
+            stored = ohlcv_store.load(code)
+            if stored is None or not len(stored["timestamps"]):
+                continue
+            bars = indicators.to_arrays(dict(stored))
+            if len(bars["close"]) < 20:
+                continue
+            loaded[code] = {field: values[-self.LOOKBACK_BARS:] for field, values in bars.items()}
+        return loaded
+
+    # ==================== الفحص ====================
+
+    def scan(self, force: bool = False) -> List[Dict]:
+        """فحص كل الأسهم المخزنة (النتيجة محفوظة لمدة SCAN_CACHE_DURATION)"""
+        with self._lock:
+            if (not force and self._results is not None
+                    and time.monotonic() - self._scanned_at < self.SCAN_CACHE_DURATION):
+                return self._results
+
+            loaded = self._load_bars()
+            self._results = self._scan_bars(loaded) if loaded else []
+            self._scanned_at = time.monotonic()
+            return self._results
+
+    def _scan_bars(self, loaded: Dict[str, Dict[str, np.ndarray]]) -> List[Dict]:
+        codes = list(loaded)
+        matrix = {
+            field: indicators.stack([loaded[code][field] for code in codes])
+            for field in ("open", "high", "low", "close", "volume")
+        }
+        close, high, low, open_ = matrix["close"], matrix["high"], matrix["low"], matrix["open"]
+        price = close[:, -1]
+        prev_close = close[:, -2]
+
+        # المتوسطات المتحركة
+        sma20 = indicators.sma_last(close, 20)
+        sma50 = indicators.sma_last(close, 50)
+        sma200 = indicators.sma_last(close, 200)
+
+        # الكمية
+        volume = indicators.volume_stats(matrix["volume"])
+
+        # الدعم والمقاومة: أقرب مستوى أسفل/أعلى السعر من الارتكاز وقمم وقيعان آخر 10 أيام
+        points = indicators.pivots(high, low, close)
+        with np.errstate(invalid="ignore"):
+            recent_high = np.nanmax(high[:, -10:], axis=1)
+            recent_low = np.nanmin(low[:, -10:], axis=1)
+            prior_high_20 = np.nanmax(high[:, -21:-1], axis=1)
+        candidates = np.column_stack([recent_low, points["s1"], points["s2"], points["min_low"],
+                                      recent_high, points["r1"], points["r2"], points["max_high"]])
+        below = np.where(candidates < price[:, None], candidates, np.nan)
+        above = np.where(candidates > price[:, None], candidates, np.nan)
+
+        # أنماط آخر شمعتين (أنماط الابتلاع تعتمد على الشمعة التالية)
+        masks = indicators.candle_patterns(open_[:, -2:], high[:, -2:], low[:, -2:], close[:, -2:])
+        bullish_pattern = masks["hammer"][:, -1] | masks["bullish_engulfing"][:, 0]
+        bearish_pattern = masks["shooting_star"][:, -1] | masks["bearish_engulfing"][:, 0]
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            support = np.nanmax(below, axis=1)
+            resistance = np.nanmin(above, axis=1)
+            change = (price - prev_close) / prev_close * 100
+            distance_to_support = (price - support) / price * 100
+
+        signals = {
+            "near_support": distance_to_support <= self.NEAR_ZONE_PERCENT,
+            "volume_spike": volume["ratio"] > self.VOLUME_SPIKE_RATIO,
+            "above_sma50": price > sma50,
+            "above_sma200": price > sma200,
+            "bullish_trend": (price > sma20) & (sma20 > sma50),
+            "bearish_trend": (price < sma20) & (sma20 < sma50),
+            "breakout": price > prior_high_20,
+            "bullish_pattern": bullish_pattern,
+            "bearish_pattern": bearish_pattern,
+        }
+
+        # مناطق الطلب (فحص خطي لكل سهم)
+        demand_low = np.full(len(codes), np.nan)
+        demand_high = np.full(len(codes), np.nan)
+        for row, code in enumerate(codes):
+            bars = loaded[code]
+            zones = indicators.supply_demand_zones(bars["open"], bars["high"], bars["low"],
+                                                   bars["close"], self.LOOKBACK_BARS, float(price[row]))
+            if len(zones["demand"]):
+                # أقرب منطقة طلب أسفل السعر
+                tops = np.minimum(bars["open"], bars["close"])[zones["demand"]]
+                nearest = int(np.argmax(tops))
+                demand_high[row] = tops[nearest]
+                demand_low[row] = bars["low"][zones["demand"][nearest]]
+
+        with np.errstate(invalid="ignore"):
+            distance_to_demand = np.maximum(price - demand_high, 0) / price * 100
+        signals["near_demand"] = distance_to_demand <= self.NEAR_ZONE_PERCENT
+
+        score = np.zeros(len(codes))
+        for key, (_, weight) in self.FILTERS.items():
+            score += weight * signals[key]
+
+        results = []
+        for row, code in enumerate(codes):
+            info = TASI_STOCKS[code]
+            last_ts = loaded[code]["timestamps"]
+            results.append({
+                "symbol": code,
+                "name": info["name"],
+                "sector": info["sector"],
+                "price": indicators.round_or_none(price[row]),
+                "change_percent": indicators.round_or_none(change[row]),
+                "sma_20": indicators.round_or_none(sma20[row]),
+                "sma_50": indicators.round_or_none(sma50[row]),
+                "sma_200": indicators.round_or_none(sma200[row]),
+                "volume_ratio": indicators.round_or_none(volume["ratio"][row]),
+                "support": indicators.round_or_none(support[row]),
+                "resistance": indicators.round_or_none(resistance[row]),
+                "demand_zone": None if np.isnan(demand_high[row]) else {
+                    "low": round(float(demand_low[row]), 2),
+                    "high": round(float(demand_high[row]), 2),
+                },
+                "distance_to_demand": indicators.round_or_none(distance_to_demand[row]),
+                "signals": [key for key in self.FILTERS if signals[key][row]],
+                "score": int(score[row]),
+                "last_date": datetime.fromtimestamp(int(last_ts[-1])).strftime("%Y-%m-%d") if len(last_ts) else None,
+            })
+        return results
+
+    def screen(self, filters: List[str] = None, sector: str = None, sort: str = "score",
+               limit: int = 50) -> Dict:
+        """فحص السوق مع الفلترة والترتيب
+
+        filters: قائمة مفاتيح من FILTERS (يجب تحقق جميعها)
+        """
+        filters = [f for f in (filters or []) if f in self.FILTERS]
+        sort = sort if sort in self.SORT_KEYS else "score"
+
+        results = self.scan()
+        matched = [
+            r for r in results
+            if all(f in r["signals"] for f in filters) and (not sector or r["sector"] == sector)
+        ]
+
+        # الأقرب لمنطقة الطلب أولاً، وباقي المفاتيح تنازلياً
+        if sort == "distance_to_demand":
+            matched.sort(key=lambda r: (r["distance_to_demand"] is None, r["distance_to_demand"] or 0))
+        else:
+            matched.sort(key=lambda r: r[sort] if r[sort] is not None else float("-inf"), reverse=True)
+
+        return {
+            "results": matched[:limit],
+            "count": len(matched),
+            "scanned": len(results),
+            "universe": len(TASI_STOCKS),
+            "filters": filters,
+            "available_filters": {key: desc for key, (desc, _) in self.FILTERS.items()},
+            "refresh": dict(self.refresh_status),
+        }
+
+    # ==================== تحديث المخزن ====================
+
+    def refresh(self, symbols: Optional[List[str]] = None) -> bool:
+        """تحديث الشموع المخزنة لكل الأسهم (يُستدعى في الخلفية)
+
+        ترجع False إذا كان هناك تحديث قيد التشغيل
+        """
+        if not self._refresh_lock.acquire(blocking=False):
+            return False
+
+        symbols = list(symbols or TASI_STOCKS)
+        self.refresh_status = {"running": True, "done": 0, "total": len(symbols), "finished_at": None}
+
+        def fetch(code):
+            try:
+                TechnicalAnalysis.get_historical_data(code, self.REFRESH_PERIOD)
+            except Exception as e:
+                print(f"خطأ في تحديث بيانات {code}: {e}")
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.REFRESH_WORKERS,
+                                    thread_name_prefix="screener") as executor:
+                for _ in executor.map(fetch, symbols):
+                    self.refresh_status["done"] += 1
+        finally:
+            self.refresh_status["running"] = False
+            self.refresh_status["finished_at"] = datetime.now().isoformat()
+            self._refresh_lock.release()
+            with self._lock:
+                self._results = None
+
+        return True
+
+
+# الماسح المشترك
+market_screener = MarketScreener()
@@ -0,0 +1,7 @@
+import pathlib
+import sys
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+FIXTURES_DIR = pathlib.Path(__file__).resolve().parent / "fixtures"
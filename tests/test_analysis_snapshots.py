@@ -0,0 +1,26 @@
+from datetime import datetime
+
+import analysis_snapshots
+from analysis_snapshots import RIYADH_TZ, AnalysisSnapshotStore, in_trading_session
+
+
+def test_trading_session_covers_post_close_delay():
+    monday = datetime(2026, 10, 19, tzinfo=RIYADH_TZ)
+    assert not in_trading_session(monday.replace(hour=9, minute=59))
+    assert in_trading_session(monday.replace(hour=10))
+    assert in_trading_session(monday.replace(hour=15, minute=29))
+    assert not in_trading_session(monday.replace(hour=15, minute=30))
+    # الجمعة ليست يوم تداول
+    assert not in_trading_session(datetime(2026, 10, 23, 12, tzinfo=RIYADH_TZ))
+
+
+def test_bundles_built_during_session_are_not_stored(tmp_path, monkeypatch):
+    store = AnalysisSnapshotStore(path=tmp_path / "snapshots.json")
+
+    monkeypatch.setattr(analysis_snapshots, "in_trading_session", lambda now=None: True)
+    assert store.put("2222", {"support": [27.1]}) is False
+    assert store.get("2222") is None
+
+    monkeypatch.setattr(analysis_snapshots, "in_trading_session", lambda now=None: False)
+    assert store.put("2222", {"support": [27.1]}) is True
+    assert store.get("2222") == {"support": [27.1]}
@@ -0,0 +1,128 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from conftest import FIXTURES_DIR
+from corporate_actions import CorporateActionsStore
+
+
+class StandInYahoo:
+    """خادم محلي يعيد استجابات Yahoo chart المسجلة بالترتيب ويسجل الطلبات"""
+
+    def __init__(self):
+        self.responses = []
+        self.requests = []
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                stand_in.requests.append((url.path, {k: v[0] for k, v in parse_qs(url.query).items()}))
+                body = json.dumps(stand_in.responses.pop(0)).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def recorded(name):
+    with open(FIXTURES_DIR / name, encoding="utf-8") as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def yahoo():
+    server = StandInYahoo()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def store(tmp_path, yahoo):
+    return CorporateActionsStore(path=tmp_path / "corporate_actions.json", base_url=yahoo.url)
+
+
+def test_initial_load_parses_dividends_and_splits(store, yahoo):
+    yahoo.responses.append(recorded("yahoo_events_2222_initial.json"))
+
+    assert store.update_symbol("2222") is True
+
+    path, query = yahoo.requests[0]
+    assert path == "/2222.SR"
+    assert query["events"] == "div,split"
+    assert query["period1"] == "0"
+
+    dividends = store.dividends("2222")
+    assert [d["date"] for d in dividends] == sorted(d["date"] for d in dividends)
+    assert dividends[0] == {"date": "2023-05-31", "amount": 0.3637}
+    assert len(dividends) == 6
+    assert store.splits("2222") == [{"date": "2023-05-21", "numerator": 11.0, "denominator": 10.0}]
+
+    # سهم مشترى قبل التقسيم = 1.1 سهم حالي، وبعده سهم واحد
+    assert store.split_factor("2222", "2023-01-01") == pytest.approx(1.1)
+    assert store.split_factor("2222", "2023-05-21") == 1.0
+    assert store.split_factor("2222", "2024-01-01") == 1.0
+
+
+def test_incremental_update_merges_with_overlap(store, yahoo):
+    yahoo.responses.append(recorded("yahoo_events_2222_initial.json"))
+    store.update_symbol("2222")
+    checked_to = store._events["2222"]["checked_to"]
+
+    changed = []
+    store.add_listener(changed.append)
+
+    # قبل مرور فترة التحديث لا يُرسل أي طلب
+    assert store.update_symbol("2222") is False
+    assert len(yahoo.requests) == 1
+
+    yahoo.responses.append(recorded("yahoo_events_2222_update.json"))
+    assert store.update_symbol("2222", force=True) is True
+
+    _, query = yahoo.requests[1]
+    overlap = CorporateActionsStore.REFRESH_OVERLAP_DAYS * 86400
+    assert int(query["period1"]) == checked_to - overlap
+
+    dates = [d["date"] for d in store.dividends("2222")]
+    assert dates[-2:] == ["2024-08-25", "2024-11-24"]
+    assert len(dates) == 7  # التوزيع المتداخل لا يتكرر
+    # التقسيم السابق يبقى رغم أن الفترة الجديدة لا تحتويه
+    assert len(store.splits("2222")) == 1
+    assert changed == ["2222"]
+
+
+def test_unchanged_refresh_does_not_notify(store, yahoo):
+    yahoo.responses.append(recorded("yahoo_events_2222_initial.json"))
+    store.update_symbol("2222")
+    changed = []
+    store.add_listener(changed.append)
+
+    yahoo.responses.append(recorded("yahoo_events_2222_initial.json"))
+    assert store.update_symbol("2222", force=True) is False
+    assert changed == []
+
+
+def test_refresh_saves_and_reloads(store, yahoo, tmp_path):
+    yahoo.responses.append(recorded("yahoo_events_2222_initial.json"))
+    assert store.refresh(["2222"], force=True) is True
+    assert store.refresh_status["updated"] == 1
+
+    reloaded = CorporateActionsStore(path=tmp_path / "corporate_actions.json", base_url=yahoo.url)
+    assert reloaded.dividends("2222") == store.dividends("2222")
+    assert reloaded.split_factor("2222", "2023-01-01") == pytest.approx(1.1)
@@ -0,0 +1,56 @@
+import pytest
+
+import analysis_service
+from analysis_service import DividendTracker
+from portfolio import Stock
+
+HISTORY = [
+    {"date": "2024-03-10", "amount": 0.5, "type": "نصف سنوي"},
+    {"date": "2024-09-08", "amount": 0.5, "type": "نصف سنوي"},
+]
+
+
+@pytest.fixture
+def static_history(monkeypatch):
+    """توزيعات ثابتة غير معدلة (بدون بيانات محملة من المصدر)"""
+    monkeypatch.setitem(DividendTracker.DIVIDEND_HISTORY, "9999", HISTORY)
+    monkeypatch.setattr(analysis_service.corporate_actions, "dividends", lambda code: [])
+    DividendTracker.clear_index("9999")
+    yield
+    DividendTracker.clear_index("9999")
+
+
+def stock_with_bonus():
+    stock = Stock("9999", "اختبار")
+    stock.add_order("buy", 100, 10.0, "2024-01-15", commission=0)
+    # منحة سهم لكل سهمين بين التوزيعين
+    stock.add_corporate_action("bonus", "2024-06-01", 1, 2)
+    return stock
+
+
+def test_bonus_between_ex_dates_scales_later_dividends(static_history):
+    stock = stock_with_bonus()
+
+    result = DividendTracker.get_position_dividends(
+        stock.symbol, stock.orders, share_multiplier=stock.get_corporate_action_multiplier)
+
+    shares = {d["date"]: d["shares"] for d in result["dividends"]}
+    assert shares == {"2024-03-10": 100, "2024-09-08": 150}
+    assert result["total_dividends"] == 125.0
+
+
+def test_portfolio_dividends_use_stock_actions(static_history):
+    stock = stock_with_bonus()
+
+    result = DividendTracker.get_portfolio_dividends([stock])
+
+    assert result["total_dividends"] == 125.0
+    assert stock.shares == 150
+
+
+def test_without_multiplier_uses_order_shares(static_history):
+    stock = stock_with_bonus()
+
+    result = DividendTracker.get_position_dividends(stock.symbol, stock.orders)
+
+    assert result["total_dividends"] == 100.0
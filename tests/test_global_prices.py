@@ -0,0 +1,46 @@
+import math
+import time
+from collections import Counter
+from urllib.parse import urlparse
+
+from global_prices_service import GlobalPricesService
+
+
+def test_fetch_timeout_covers_cold_rounds_per_host():
+    """الجلب البارد لا يُسقط عناصر بسبب حد المضيف (دفعات × مهلة الطلب)"""
+    service = GlobalPricesService
+    hosts = Counter(
+        'tadawul' if category == 'petrochemicals' else urlparse(item['url']).netloc
+        for category, items in service.COMMODITIES.items()
+        for item in items
+    )
+    for host, count in hosts.items():
+        limit = service.HOST_LIMITS.get(host, service.DEFAULT_HOST_LIMIT)
+        assert math.ceil(count / limit) * service.REQUEST_TIMEOUT <= service.FETCH_TIMEOUT, host
+
+
+def cached_gold(monkeypatch, age):
+    service = GlobalPricesService
+    monkeypatch.setattr(service, '_item_cache', {'gold': (time.monotonic() - age, {'name': 'الذهب', 'price': 2400.0})})
+    monkeypatch.setattr(service, '_inflight', {})
+    monkeypatch.setattr(service, '_last_access', {})
+    # المصدر لا يستجيب
+    monkeypatch.setattr(service, '_fetch_item', classmethod(lambda cls, category, item: None))
+
+
+def test_expired_price_is_marked_stale(monkeypatch):
+    cached_gold(monkeypatch, GlobalPricesService.CATEGORY_TTL['precious_metals'] + 60)
+
+    gold = GlobalPricesService._get_items(['precious_metals'])['precious_metals']
+
+    assert [p['price'] for p in gold] == [2400.0]
+    assert gold[0]['stale'] is True
+    assert gold[0]['age_seconds'] >= 120
+
+
+def test_price_past_max_staleness_is_dropped(monkeypatch):
+    cached_gold(monkeypatch, GlobalPricesService.MAX_STALE_AGE + 60)
+
+    gold = GlobalPricesService._get_items(['precious_metals'])['precious_metals']
+
+    assert gold == []
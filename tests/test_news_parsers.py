@@ -0,0 +1,26 @@
+import pytest
+
+from news_service import NewsAggregator
+
+PAGES = {
+    "argaam": '<a href="/ar/article/articledetail/id/123">{title}</a>',
+    "aleqt": '<a href="/markets/1">{title}</a>',
+    "maaal": '<div class="post"><h3>{title}</h3><a href="/x/1">المزيد</a></div>',
+}
+
+
+@pytest.mark.parametrize("source", sorted(PAGES))
+def test_known_article_is_reused_until_retitled(source):
+    parse = getattr(NewsAggregator, f"_parse_{source}")
+    page = PAGES[source].format(title="أرامكو تعلن نتائج الربع الثالث من العام")
+
+    first = parse(page, {})
+    assert len(first) == 1
+    known = {first[0]["url"]: first[0]}
+
+    assert parse(page, known)[0] is first[0]
+
+    retitled = parse(PAGES[source].format(title="أرامكو تعلن نتائج الربع الثالث وتوزيعات إضافية"), known)
+    assert retitled[0] is not first[0]
+    assert retitled[0]["url"] == first[0]["url"]
+    assert retitled[0]["title"] == "أرامكو تعلن نتائج الربع الثالث وتوزيعات إضافية"
@@ -0,0 +1,46 @@
+import sqlite3
+
+from news_store import NewsStore
+
+HEADLINE = {
+    "id": "123",
+    "title": "أرامكو تعلن نتائج الربع الثالث",
+    "url": "https://www.argaam.com/ar/article/articledetail/id/123",
+    "source": "أرقام",
+    "date": "2026-10-18",
+    "category": "أسواق",
+    "symbols": ["2222"],
+}
+PAGE = {
+    "id": "123",
+    "title": "أرامكو السعودية تعلن نتائج الربع الثالث 2026",
+    "content": "ارتفع صافي ربح أرامكو في الربع الثالث مقارنة بالربع المماثل من العام الماضي.",
+    "url": HEADLINE["url"],
+    "date": "الأحد 18 أكتوبر 2026",
+    "source": "أرقام",
+    "symbols": ["2222"],
+}
+
+
+def test_saved_body_is_served_as_fetched(tmp_path):
+    store = NewsStore(path=tmp_path / "news.db")
+    store.add_articles([dict(HEADLINE)])
+    store.save_body(dict(PAGE))
+
+    assert store.get_body("أرقام", "123") == PAGE
+    # الخبر في القائمة يبقى بعنوان الخبر
+    assert store.recent()[0]["title"] == HEADLINE["title"]
+
+
+def test_old_database_gains_page_columns(tmp_path):
+    path = tmp_path / "news.db"
+    conn = sqlite3.connect(str(path))
+    conn.execute("CREATE TABLE articles (id INTEGER PRIMARY KEY, url TEXT UNIQUE NOT NULL, article_id TEXT,"
+                 " title TEXT NOT NULL, source TEXT, source_icon TEXT, category TEXT, date TEXT,"
+                 " first_seen REAL NOT NULL, body TEXT)")
+    conn.commit()
+    conn.close()
+
+    store = NewsStore(path=path)
+    store.save_body(dict(PAGE))
+    assert store.get_body("أرقام", "123")["title"] == PAGE["title"]
@@ -0,0 +1,32 @@
+import pytest
+
+from news_tagger import symbol_tagger
+
+
+@pytest.mark.parametrize("headline, expected", [
+    ("أرامكو تعلن أرباح الربع الثالث", ["2222"]),
+    ("وسابك ترتفع في التعاملات المبكرة", ["2010"]),
+    ("للراجحي ومصرف الإنماء", ["1120", "1150"]),
+    ("أرامكو للتوزيع تعلن نتائجها", ["2082"]),
+    ("شركة الاتصالات السعودية توزع أرباحاً", ["7010"]),
+    ("شركة الاتصالات تعلن عن نتائجها", ["7020"]),
+    ("زين السعودية تحقق أرباحاً", ["7030"]),
+    ("شركة زين توقع اتفاقية", ["7030"]),
+    ("كيان السعودية تقلص خسائرها", ["2350"]),
+    ("الشركة السعودية للكهرباء توقع عقداً", ["5110"]),
+    ("بنك الرياض يوزع أرباحاً", ["1010"]),
+    ("سهم 2030 يرتفع", ["2030"]),
+])
+def test_tags_known_headlines(headline, expected):
+    assert symbol_tagger.tag(headline) == expected
+
+
+@pytest.mark.parametrize("headline", [
+    "زين العابدين يتحدث عن الاقتصاد",
+    "كيان جديد للاستثمار في القطاع",
+    "رؤية 2030 والنمو في الرياض",
+    "البنك المركزي يثبت أسعار الفائدة",
+    "سابكو",
+])
+def test_common_words_are_not_tagged(headline):
+    assert symbol_tagger.tag(headline) == []
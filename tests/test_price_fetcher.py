@@ -0,0 +1,42 @@
+import json
+from unittest import mock
+
+from conftest import FIXTURES_DIR
+from price_fetcher import TadawulPriceFetcher
+
+
+def load(name):
+    with open(FIXTURES_DIR / name, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_parse_spark_v7():
+    quotes = TadawulPriceFetcher._parse_spark(load("yahoo_spark_v7.json"))
+    assert set(quotes) == {"2010", "2310"}
+    assert quotes["2010"]["price"] == 58.7
+    assert quotes["2010"]["previous_close"] == 59.1
+    assert quotes["2010"]["change"] == -0.4
+    assert quotes["2310"]["change_percent"] == 1.62
+
+
+def test_parse_spark_v8_symbol_keyed():
+    quotes = TadawulPriceFetcher._parse_spark(load("yahoo_spark_v8.json"))
+    assert set(quotes) == {"2010", "2310"}
+    assert quotes["2010"]["price"] == 58.7
+    assert quotes["2010"]["previous_close"] == 59.1
+    # آخر إغلاق غير فارغ
+    assert quotes["2310"]["price"] == 21.2
+
+
+def test_get_live_prices_single_request():
+    response = mock.Mock(status_code=200)
+    response.json.return_value = load("yahoo_spark_v7.json")
+    TadawulPriceFetcher._quote_cache.clear()
+    with mock.patch("price_fetcher.requests.get", return_value=response) as get, \
+            mock.patch("price_fetcher.price_history.record"):
+        quotes = TadawulPriceFetcher.get_live_prices(["2010.SR", "2310"])
+
+    assert get.call_count == 1
+    assert "/v7/finance/spark?symbols=2010.SR,2310.SR" in get.call_args[0][0]
+    assert quotes["2010"]["price"] == 58.7
+    assert quotes["2310"]["price"] == 21.34
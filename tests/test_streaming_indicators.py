@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+
+import analysis_service
+from analysis_service import TechnicalAnalysis, calculate_moving_averages_batch
+from ohlcv_store import OHLCVStore
+
+DAY = 86400
+START = 1_700_000_000 // DAY * DAY
+
+
+def history(days, nan_open_at=()):
+    rng = np.random.RandomState(7)
+    close = 30 + np.cumsum(rng.normal(0, 0.4, days))
+    series = {
+        "symbol": "2222",
+        "timestamps": [START + i * DAY for i in range(days)],
+        "open": (close + rng.normal(0, 0.2, days)).tolist(),
+        "high": (close + 0.5).tolist(),
+        "low": (close - 0.5).tolist(),
+        "close": close.tolist(),
+        "volume": rng.randint(1000, 5000, days).astype(float).tolist(),
+    }
+    for i in nan_open_at:
+        series["open"][i] = None
+    return series
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = OHLCVStore(cache_dir=tmp_path)
+    monkeypatch.setattr(analysis_service, "ohlcv_store", store)
+    return store
+
+
+def recomputed(data):
+    """المتوسطات بالحساب الكامل من البيانات (بدون الحالة المتزايدة)"""
+    original = TechnicalAnalysis.get_streaming_indicators
+    TechnicalAnalysis.get_streaming_indicators = staticmethod(lambda *args, **kwargs: None)
+    try:
+        return calculate_moving_averages_batch([data])[0]
+    finally:
+        TechnicalAnalysis.get_streaming_indicators = staticmethod(original)
+
+
+def test_window_slice_uses_state_for_sma(store):
+    store.merge("2222", history(365, nan_open_at=(300,)))
+
+    # طلبات لوحة 6mo متتالية: بداية النافذة تتقدم كل يوم
+    for shift in range(6):
+        window = store.get_range("2222", START + (182 + shift) * DAY)
+        streaming = TechnicalAnalysis.get_streaming_indicators(window)
+
+        assert streaming is not None
+        assert streaming["full_window"] is False
+        assert "ema_20" not in streaming
+        assert "sma_200" not in streaming  # النافذة أقصر من 200 شمعة
+
+        valid = [o is not None for o in window["open"]]
+        closes = np.array(window["close"])[valid]
+        highs = np.array(window["high"])[valid]
+        assert streaming["sma_50"] == pytest.approx(closes[-50:].mean())
+        assert streaming["high_20"] == pytest.approx(highs[-20:].max())
+
+        assert calculate_moving_averages_batch([window])[0] == recomputed(window)
+
+
+def test_full_series_uses_state_for_everything(store):
+    store.merge("2222", history(300))
+    window = store.get_range("2222", 0)
+
+    streaming = TechnicalAnalysis.get_streaming_indicators(window)
+    assert streaming["full_window"] is True
+    assert streaming["ema_200"] is not None
+    assert calculate_moving_averages_batch([window])[0] == recomputed(window)
+
+
+def test_nan_open_bar_is_skipped_like_to_arrays(store):
+    store.merge("2222", history(120, nan_open_at=(50,)))
+    state = store.get_state("2222")
+    assert len(state.sma[10].window) == 10
+    # 118 شمعة مغلقة صالحة (الأخيرة تُضاف عبر peek)
+    assert state.highs[10].count == 118
+
+
+def test_foreign_data_is_not_served_from_state(store):
+    store.merge("2222", history(300))
+    other = history(300)
+    other["close"] = [c + 1 for c in other["close"]]
+    other["timestamps"] = other["timestamps"][:-1] + [START + 400 * DAY]
+    assert TechnicalAnalysis.get_streaming_indicators(other) is None
+
+
+def test_empty_tail_marks_store_checked(store, monkeypatch):
+    store.merge("2222", history(300))
+    stored = store.load("2222")
+    stored["fetched_at"] = 0.0  # آخر فحص قديم
+    stored["coverage_start"] = 0  # المخزن يغطي الفترة المطلوبة
+
+    calls = []
+
+    def empty_tail(code, query):
+        calls.append(query)
+        return {"symbol": code, "timestamps": []}
+
+    monkeypatch.setattr(TechnicalAnalysis, "_fetch_chart", staticmethod(empty_tail))
+    for _ in range(3):
+        TechnicalAnalysis.clear_history_cache()
+        TechnicalAnalysis.get_historical_data("2222", "5y")
+
+    assert len(calls) == 1
+    assert store.load("2222")["fetched_at"] > 0